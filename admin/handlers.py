@@ -8,9 +8,10 @@ from telegram.ext import (
     MessageHandler,
     filters,
 )
-from datetime import datetime
+from datetime import datetime, timedelta
 import config
-from database import get_db_statistics, get_user, set_premium, revoke_premium
+import user_cache
+import async_database as db
 
 # --- States for Conversation ---
 MAIN_MENU, USER_LOOKUP, MANAGE_PREMIUM_USER_ID, MANAGE_PREMIUM_ACTION = range(4)
@@ -43,15 +44,26 @@ async def show_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     query = update.callback_query
     await query.answer()
 
-    stats = get_db_statistics()
+    stats = await db.get_db_statistics()
     usage_gb = stats['total_daily_usage_bytes'] / (1024**3)
+    cache_stats = user_cache.cache.stats()
+    # The oldest snapshot of the last week, to show the trend
+    history = await db.get_statistics_history(datetime.utcnow() - timedelta(days=7), limit=1)
 
     message = (
         "📊 *Bot Statistics*\n\n"
         f"Total Users: `{stats['total_users']}`\n"
         f"Premium Users: `{stats['premium_users']}`\n"
         f"Total Usage Today: `{usage_gb:.2f} GB`\n"
+        f"User Cache Hit Rate: `{cache_stats['hit_rate']:.1%} of {cache_stats['hits'] + cache_stats['misses']}`\n"
     )
+    if history:
+        week_ago = history[0]
+        message += (
+            f"\nSince `{week_ago['at']:%Y-%m-%d}`: "
+            f"`{stats['total_users'] - week_ago['total_users']:+d} users, "
+            f"{stats['premium_users'] - week_ago['premium_users']:+d} premium`\n"
+        )
 
     keyboard = [[InlineKeyboardButton("⬅️ Back to Main Menu", callback_data="admin_back_to_main")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -101,13 +113,13 @@ async def perform_user_lookup(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("Invalid ID. Please send a valid Telegram User ID (which is a number).")
         return USER_LOOKUP
 
-    user_data = get_user(user_id)
+    user_data = await db.get_user(user_id)
 
     if not user_data or not user_data.get('created_at'): # Check if it's a real user vs a placeholder
         message = f"❌ No user found with the ID `{user_id}`."
     else:
         status = "Premium ✨" if user_data.get('is_premium') else "Free"
-        usage_gb = user_data.get('daily_usage', 0) / (1024**3)
+        usage_gb = db.current_usage(user_data) / (1024**3)
         limit_gb = user_data.get('daily_limit_bytes', 0) / (1024**3)
         expires = user_data.get('premium_expires', 'N/A')
         if isinstance(expires, datetime):
@@ -145,7 +157,7 @@ async def prompt_premium_action(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text("Invalid ID. Please send a valid Telegram User ID.")
         return MANAGE_PREMIUM_USER_ID
 
-    user_data = get_user(user_id)
+    user_data = await db.get_user(user_id)
     if not user_data or not user_data.get('created_at'):
         await update.message.reply_text(f"❌ No user found with the ID `{user_id}`.")
         return MANAGE_PREMIUM_USER_ID
@@ -188,13 +200,13 @@ async def perform_premium_action(update: Update, context: ContextTypes.DEFAULT_T
         plan_name = action.replace("admin_grant_", "")
         plan = config.PRICING.get(plan_name)
         if plan:
-            set_premium(user_id, plan['duration_days'], plan['limit'])
+            await db.set_premium(user_id, plan['duration_days'], plan['limit'])
             await query.edit_message_text(f"✅ Successfully granted premium plan '{plan_name}' to user `{user_id}`.")
         else:
             await query.edit_message_text(f"❌ Error: Plan '{plan_name}' not found.")
 
     elif action == "admin_revoke_premium":
-        revoke_premium(user_id)
+        await db.revoke_premium(user_id)
         await query.edit_message_text(f"✅ Successfully revoked premium status from user `{user_id}`.")
 
     context.user_data.pop('target_user_id', None)
@@ -1,7 +1,11 @@
 import argparse
 import asyncio
+from datetime import datetime, timedelta
 from telegram import Bot
-from database import get_user, set_premium, get_all_users
+from telegram.request import HTTPXRequest
+from database import get_user, set_premium, get_all_users, current_usage, get_unfinished_broadcast, count_users
+from database import get_db_statistics, reconcile_statistics, get_statistics_history
+import broadcast
 import config
 
 def list_users():
@@ -12,7 +16,7 @@ def list_users():
         status = "Premium" if user.get('is_premium') else "Free"
         print(
             f"ID: {user['user_id']} | Status: {status} | "
-            f"Usage: {user.get('daily_usage', 0) / (1024**3):.2f} GB | "
+            f"Usage today: {current_usage(user) / (1024**3):.2f} GB | "
             f"Expires: {user.get('premium_expires', 'N/A')}"
         )
     print("-----------------")
@@ -29,7 +33,7 @@ def user_info(user_id):
         if key == 'daily_limit_bytes':
             print(f"  {key}: {value} ({value / (1024**3):.1f} GB)")
         elif key == 'daily_usage':
-            print(f"  {key}: {value} ({value / (1024**3):.2f} GB)")
+            print(f"  {key}: {value} ({value / (1024**3):.2f} GB; {current_usage(user) / (1024**3):.2f} GB today)")
         else:
             print(f"  {key}: {value}")
     print("-----------------------------")
@@ -57,38 +61,66 @@ def revoke_premium(user_id):
     print(f"✅ Successfully revoked premium status from user {user_id}.")
     user_info(user_id)
 
+def show_statistics(days, recount=False):
+    """Prints the current statistics and the snapshots of the last ``days`` days."""
+    stats = reconcile_statistics() if recount else get_db_statistics()
+    print("--- Statistics ---")
+    print(f"Total users: {stats['total_users']}")
+    print(f"Premium users: {stats['premium_users']}")
+    print(f"Usage today: {stats['total_daily_usage_bytes'] / (1024**3):.2f} GB")
+
+    history = get_statistics_history(datetime.utcnow() - timedelta(days=days))
+    print(f"--- History ({len(history)} snapshots in {days} days) ---")
+    for snapshot in history:
+        print(
+            f"{snapshot['at']:%Y-%m-%d %H:%M} | Users: {snapshot['total_users']} | "
+            f"Premium: {snapshot['premium_users']} | "
+            f"Usage that day: {snapshot['total_daily_usage_bytes'] / (1024**3):.2f} GB"
+        )
+    print("------------------")
+
+def _broadcast_bot():
+    # One connection per message in flight.
+    request = HTTPXRequest(connection_pool_size=config.BROADCAST_CONCURRENCY)
+    if config.BOT_API_SERVER:
+        return Bot(token=config.BOT_TOKEN, request=request, base_url=config.BOT_API_BASE_URL)
+    return Bot(token=config.BOT_TOKEN, request=request)
+
+def _print_broadcast_progress(run):
+    print(f"Sent: {run.sent}, Failed: {run.failed}, Blocked: {run.blocked} (up to user {run.last_user_id})")
+
 async def broadcast_message(message):
-    """Sends a message to all users of the bot."""
+    """Sends a message to all users of the bot. See broadcast.py."""
     print(f"--- Broadcasting Message ---")
     print(f"Message: {message}")
 
-    users = get_all_users()
-    user_ids = [user['user_id'] for user in users]
-
-    if not user_ids:
-        print("No users found to broadcast to.")
+    unfinished = get_unfinished_broadcast()
+    if unfinished:
+        print(f"Broadcast {unfinished['_id']} has not finished. Run `broadcast-resume` to continue it first.")
         return
 
-    confirm = input(f"This will send a message to {len(user_ids)} users. Are you sure? (yes/no): ")
+    confirm = input(f"This will send a message to about {count_users()} users. Are you sure? (yes/no): ")
     if confirm.lower() != 'yes':
         print("Broadcast cancelled.")
         return
 
-    bot = Bot(token=config.BOT_TOKEN)
-    sent_count = 0
-    failed_count = 0
-
-    for user_id in user_ids:
-        try:
-            await bot.send_message(chat_id=user_id, text=message)
-            sent_count += 1
-            print(f"Sent to {user_id}")
-        except Exception as e:
-            failed_count += 1
-            print(f"Failed to send to {user_id}: {e}")
+    async with _broadcast_bot() as bot:
+        sent, failed, blocked = await broadcast.start(bot, message, on_progress=_print_broadcast_progress)
 
     print("--------------------------")
-    print(f"✅ Broadcast complete. Sent: {sent_count}, Failed: {failed_count}.")
+    print(f"✅ Broadcast complete. Sent: {sent}, Failed: {failed}, Blocked: {blocked}.")
+
+async def resume_broadcast():
+    """Continues the last broadcast that did not finish, e.g. after a crash or Ctrl+C."""
+    unfinished = get_unfinished_broadcast()
+    if not unfinished:
+        print("There is no unfinished broadcast.")
+        return
+
+    print(f"Resuming broadcast {unfinished['_id']}: {unfinished['text']!r}")
+    async with _broadcast_bot() as bot:
+        sent, failed, blocked = await broadcast.resume(bot, unfinished, on_progress=_print_broadcast_progress)
+    print(f"✅ Broadcast complete. Sent: {sent}, Failed: {failed}, Blocked: {blocked}.")
 
 
 def main():
@@ -111,9 +143,15 @@ def main():
     revoke_parser = subparsers.add_parser("revoke-premium", help="Revoke premium status from a user.")
     revoke_parser.add_argument("user_id", type=int, help="The user's Telegram ID.")
 
+    # Statistics
+    stats_parser = subparsers.add_parser("stats", help="Show statistics and their history.")
+    stats_parser.add_argument("--days", type=int, default=30, help="Days of history to show.")
+    stats_parser.add_argument("--recount", action="store_true", help="Recount from the users collection first.")
+
     # Broadcast message
     broadcast_parser = subparsers.add_parser("broadcast", help="Send a message to all users.")
     broadcast_parser.add_argument("message", type=str, help="The message to send.")
+    subparsers.add_parser("broadcast-resume", help="Continue the last broadcast that did not finish.")
 
     args = parser.parse_args()
 
@@ -125,8 +163,12 @@ def main():
         grant_premium(args.user_id, args.plan_name)
     elif args.command == "revoke-premium":
         revoke_premium(args.user_id)
+    elif args.command == "stats":
+        show_statistics(args.days, args.recount)
     elif args.command == "broadcast":
         asyncio.run(broadcast_message(args.message))
+    elif args.command == "broadcast-resume":
+        asyncio.run(resume_broadcast())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,221 @@
+# admission.py
+"""
+Disk-space admission control for downloads.
+
+Before a job starts downloading, it reserves the file's size on every
+filesystem it will write to: the download (staging) directory and
+PUBLIC_FILES_DIR, once if they share a filesystem. A reservation only
+succeeds if the space is free after subtracting ADMISSION_DISK_MARGIN and
+everything other jobs have already reserved. Otherwise the job is put back
+in the queue with a delay instead of starting a download that would fill
+the disk and fail.
+
+Reservations live in Redis, so they are shared by every worker process:
+per filesystem, a hash of token -> bytes plus a sorted set of deadlines.
+A job releases its reservation when it finishes, whether it succeeded or
+failed. If its worker crashes, the reservation is dropped at its deadline
+(ADMISSION_LEASE).
+
+Free space is measured from the filesystem, which already excludes what
+running downloads have written so far. A download that preallocates its
+file (parallel_download.py) reports it with `allocated`, and only the
+rest of its reservation keeps counting. Bytes written by other downloads
+are still counted twice until they finish, so admission errs on the safe
+side.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import time
+import weakref
+
+import redis.asyncio as aioredis
+
+import config
+import storage
+
+logger = logging.getLogger(__name__)
+
+# KEYS = per filesystem: reservations hash, deadlines zset
+# ARGV = now (ms), deadline (ms), token, bytes, then the usable bytes of each filesystem
+# Returns 0 when the space was reserved, otherwise the bytes missing on the tightest filesystem.
+_RESERVE_SCRIPT = """
+local now, deadline, token, need = tonumber(ARGV[1]), tonumber(ARGV[2]), ARGV[3], tonumber(ARGV[4])
+local missing = 0
+for i = 1, #KEYS, 2 do
+    for _, stale in ipairs(redis.call('ZRANGEBYSCORE', KEYS[i + 1], '-inf', now)) do
+        redis.call('HDEL', KEYS[i], stale)
+        redis.call('ZREM', KEYS[i + 1], stale)
+    end
+    local reserved = 0
+    for _, nbytes in ipairs(redis.call('HVALS', KEYS[i])) do
+        reserved = reserved + tonumber(nbytes)
+    end
+    local short = reserved + need - tonumber(ARGV[4 + (i + 1) / 2])
+    if short > missing then
+        missing = short
+    end
+end
+if missing > 0 then
+    return missing
+end
+for i = 1, #KEYS, 2 do
+    redis.call('HSET', KEYS[i], token, need)
+    redis.call('ZADD', KEYS[i + 1], deadline, token)
+end
+return 0
+"""
+
+# KEYS[1] = reservations hash, ARGV = token, bytes still to be allocated.
+# Leaves reservations that were released or lapsed alone.
+_SHRINK_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+end
+return 0
+"""
+
+# redis.asyncio clients are bound to the loop they were created on.
+_clients = weakref.WeakKeyDictionary()
+
+
+class DiskFull(Exception):
+    """A file that can't get disk space, even after waiting ADMISSION_MAX_WAIT."""
+
+
+def _get_redis():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = aioredis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=0)
+        client.reserve_script = client.register_script(_RESERVE_SCRIPT)
+        client.shrink_script = client.register_script(_SHRINK_SCRIPT)
+        _clients[loop] = client
+    return client
+
+
+def _filesystems():
+    """Returns {device id: directory} for the filesystems a download writes to."""
+    devices = {}
+    for directory in (storage.STAGING_DIR, config.PUBLIC_FILES_DIR):
+        devices.setdefault(os.stat(directory).st_dev, directory)
+    return devices
+
+
+def _usable_bytes(directory):
+    st = os.statvfs(directory)
+    return st.f_bavail * st.f_frsize - config.ADMISSION_DISK_MARGIN
+
+
+def _keys(device):
+    return f"disk:{device}:reserved", f"disk:{device}:deadlines"
+
+
+# --- Reservations ---
+async def reserve(nbytes):
+    """
+    Reserves ``nbytes`` on every filesystem a download writes to.
+
+    Returns a reservation dict for `release`, or None if the file doesn't
+    fit right now. Fails open (admits the job) if Redis is unavailable.
+    """
+    filesystems = _filesystems()
+    token = secrets.token_hex(8)
+    keys = [key for device in filesystems for key in _keys(device)]
+    now = int(time.time() * 1000)
+    try:
+        missing = await _get_redis().reserve_script(
+            keys=keys,
+            args=[now, now + config.ADMISSION_LEASE * 1000, token, nbytes,
+                  *(_usable_bytes(directory) for directory in filesystems.values())],
+        )
+    except aioredis.RedisError as e:
+        logger.warning(f"Disk admission unavailable, admitting the job: {e}")
+        return {"token": None, "bytes": nbytes, "devices": []}
+    if missing > 0:
+        logger.info(f"Not enough disk space for {nbytes} bytes ({missing} missing); deferring.")
+        return None
+    return {"token": token, "bytes": nbytes, "devices": list(filesystems)}
+
+
+async def release(reservation):
+    """Gives a reservation's space back. Safe to call with None or twice."""
+    if not reservation or not reservation["token"]:
+        return
+    try:
+        pipe = _get_redis().pipeline(transaction=False)
+        for device in reservation["devices"]:
+            reserved_key, deadlines_key = _keys(device)
+            pipe.hdel(reserved_key, reservation["token"])
+            pipe.zrem(deadlines_key, reservation["token"])
+        await pipe.execute()
+    except aioredis.RedisError as e:
+        # The reservation lapses at its deadline anyway.
+        logger.warning(f"Could not release disk reservation {reservation['token']}: {e}")
+
+
+async def allocated(reservation, path, nbytes):
+    """
+    Notes that ``nbytes`` of a reservation are now allocated on disk at
+    ``path``. Free space measured from the filesystem already excludes them,
+    so only the rest stays reserved on that filesystem.
+    """
+    if not reservation or not reservation["token"]:
+        return
+    device = os.stat(path).st_dev
+    if device not in reservation["devices"]:
+        return
+    reserved_key, _ = _keys(device)
+    try:
+        await _get_redis().shrink_script(keys=[reserved_key],
+                                         args=[reservation["token"], max(reservation["bytes"] - nbytes, 0)])
+    except aioredis.RedisError as e:
+        logger.warning(f"Could not shrink disk reservation {reservation['token']}: {e}")
+
+
+def fits_at_all(nbytes):
+    """Whether ``nbytes`` could ever be admitted: it is smaller than the filesystems themselves."""
+    for directory in _filesystems().values():
+        st = os.statvfs(directory)
+        if nbytes > st.f_blocks * st.f_frsize - config.ADMISSION_DISK_MARGIN:
+            return False
+    return True
+
+
+# --- Wait Estimates ---
+async def expected_wait(nbytes):
+    """
+    Estimates the seconds until ``nbytes`` could be reserved: 0 if it fits
+    now, None if finishing every running download would not free enough.
+
+    Running downloads are assumed to progress at ADMISSION_ESTIMATED_SPEED,
+    so the result is a rough guide for users, not a promise.
+    """
+    now = time.time()
+    wait = 0
+    try:
+        client = _get_redis()
+        for device, directory in _filesystems().items():
+            reserved_key, deadlines_key = _keys(device)
+            sizes = await client.hgetall(reserved_key)
+            deadlines = dict(await client.zrange(deadlines_key, 0, -1, withscores=True))
+            # Seconds until each running download should finish and free its reservation
+            pending = []
+            for token, size in sizes.items():
+                started = deadlines.get(token, 0) / 1000 - config.ADMISSION_LEASE
+                remaining = int(size) / config.ADMISSION_ESTIMATED_SPEED - (now - started)
+                pending.append((max(0.0, remaining), int(size)))
+
+            short = sum(size for _, size in pending) + nbytes - _usable_bytes(directory)
+            for remaining, size in sorted(pending):
+                if short <= 0:
+                    break
+                short -= size
+                wait = max(wait, remaining)
+            if short > 0:
+                return None
+    except aioredis.RedisError as e:
+        logger.warning(f"Could not estimate the wait for disk space: {e}")
+        return 0
+    return wait
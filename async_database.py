@@ -0,0 +1,87 @@
+# async_database.py
+"""
+Async facade over database.py for code that runs on an event loop.
+
+pymongo is synchronous, so calling database.py from a PTB handler stalls
+the whole polling loop for a network round-trip. Every function here has
+the same name and arguments as its database.py counterpart but runs the
+query on a bounded thread pool, leaving the loop free to serve other
+updates. Functions returning live cursors (get_all_users,
+get_unreferenced_blobs) are not wrapped; iterate those off the loop.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import database
+import user_cache
+
+_executor = ThreadPoolExecutor(max_workers=config.MONGO_EXECUTOR_WORKERS, thread_name_prefix="mongo")
+
+
+async def run(func, *args, **kwargs):
+    """Runs a blocking database call on the Mongo thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def _wrap(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+    return wrapper
+
+
+# Cache misses currently being loaded, keyed by (loop, user_id). A burst of
+# updates from one user triggers a single MongoDB read instead of one each.
+_inflight_loads = {}
+
+
+async def get_user(user_id):
+    """Async `database.get_user`. Cache hits are answered without leaving the loop."""
+    user = user_cache.cache.get(user_id)
+    if user is not None:
+        return user
+
+    key = (asyncio.get_running_loop(), user_id)
+    load = _inflight_loads.get(key)
+    if load is None:
+        load = asyncio.ensure_future(run(database.load_user, user_id))
+        _inflight_loads[key] = load
+        load.add_done_callback(lambda _: _inflight_loads.pop(key, None))
+    # Each caller gets its own copy, just like a cache hit.
+    return dict(await asyncio.shield(load))
+
+
+update_usage = _wrap(database.update_usage)
+reserve_usage = _wrap(database.reserve_usage)
+refund_usage = _wrap(database.refund_usage)
+set_premium = _wrap(database.set_premium)
+revoke_premium = _wrap(database.revoke_premium)
+check_premium_status = _wrap(database.check_premium_status)
+get_db_statistics = _wrap(database.get_db_statistics)
+reconcile_statistics = _wrap(database.reconcile_statistics)
+save_statistics_snapshot = _wrap(database.save_statistics_snapshot)
+get_statistics_history = _wrap(database.get_statistics_history)
+create_pending_payment = _wrap(database.create_pending_payment)
+get_and_delete_pending_payment = _wrap(database.get_and_delete_pending_payment)
+find_blob_by_unique_id = _wrap(database.find_blob_by_unique_id)
+find_blob = _wrap(database.find_blob)
+create_blob = _wrap(database.create_blob)
+add_blob_unique_id = _wrap(database.add_blob_unique_id)
+add_blob_reference = _wrap(database.add_blob_reference)
+release_blob_reference = _wrap(database.release_blob_reference)
+delete_blob = _wrap(database.delete_blob)
+create_stream = _wrap(database.create_stream)
+get_stream = _wrap(database.get_stream)
+create_broadcast = _wrap(database.create_broadcast)
+get_broadcast = _wrap(database.get_broadcast)
+get_unfinished_broadcast = _wrap(database.get_unfinished_broadcast)
+save_broadcast_progress = _wrap(database.save_broadcast_progress)
+get_broadcast_recipients = _wrap(database.get_broadcast_recipients)
+mark_users_blocked = _wrap(database.mark_users_blocked)
+
+# Pure helpers that never touch MongoDB, re-exported for async callers.
+utc_day = database.utc_day
+current_usage = database.current_usage
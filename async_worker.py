@@ -0,0 +1,294 @@
+# async_worker.py
+"""
+An asyncio-native alternative to `dramatiq tasks` for file jobs.
+
+Downloads are I/O-bound, yet a Dramatiq worker can only run as many jobs
+at once as it has threads. This worker consumes the same Redis queues
+(premium and free, plus their delay queues) and runs up to --concurrency
+jobs as coroutines on one event loop in a single process.
+
+It behaves like a Dramatiq worker towards everything else:
+- Messages are acked when done and nacked (dead-lettered) when they fail
+  for good.
+- The broker's middleware runs around every message: Retries re-enqueues
+  with backoff, AgeLimit skips stale messages and fair_queue releases
+  slots. Thread-bound middleware (TimeLimit, ShutdownNotifications) is
+  skipped; time limits are enforced with asyncio instead, cancelling the
+  job's coroutine.
+- Delayed messages (retries waiting for their backoff) are moved back to
+  their queue when due.
+- A message is only fetched when a slot is free, so a busy worker leaves
+  jobs in Redis for other workers (backpressure).
+
+Dramatiq's Redis consumers are blocking and not thread-safe, so each
+queue gets a consumer thread that fetches messages and performs that
+queue's acks; the jobs themselves all run on the event loop.
+
+Usage:
+    python async_worker.py --concurrency 64
+"""
+import argparse
+import asyncio
+import logging
+import queue
+import signal
+import threading
+
+import dramatiq
+from dramatiq.common import current_millis, dq_name, q_name
+from dramatiq.errors import ActorNotFound
+from dramatiq.middleware import ShutdownNotifications, SkipMessage, TimeLimit
+from dramatiq.middleware.time_limit import TimeLimitExceeded
+
+import config
+import fair_queue
+import tasks
+import worker_runtime
+
+logger = logging.getLogger(__name__)
+
+# Middleware that interrupts worker threads with asynchronous exceptions;
+# on an event loop that would hit unrelated coroutines.
+_THREAD_BOUND_MIDDLEWARE = (TimeLimit, ShutdownNotifications)
+_DEFAULT_TIME_LIMIT_MS = 600_000  # Dramatiq's default
+_POLL_INTERVAL = 0.1  # Seconds a consumer thread waits for a free slot before checking acks again
+
+
+class AsyncWorker:
+    """Consumes Dramatiq queues and runs their messages as coroutines."""
+
+    def __init__(self, broker=None, queues=None, concurrency=None, runtime=None, shutdown_grace=None):
+        self.broker = broker or dramatiq.get_broker()
+        self.queues = list(queues or fair_queue.TIERS)
+        self.concurrency = concurrency or config.ASYNC_WORKER_CONCURRENCY
+        self.runtime = runtime
+        self._owns_runtime = runtime is None
+        self.shutdown_grace = config.ASYNC_WORKER_SHUTDOWN_GRACE if shutdown_grace is None else shutdown_grace
+        self.middleware = [m for m in self.broker.middleware if not isinstance(m, _THREAD_BOUND_MIDDLEWARE)]
+
+        self.loop = None
+        self._running = threading.Event()
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._acks = {}
+        self._consumers = {}
+        self._threads = []
+        self._jobs = set()
+        self.processed = 0
+        self.failed = 0
+
+    # --- Lifecycle ---
+    async def start(self):
+        """Starts consuming. Must be awaited on the loop the jobs should run on."""
+        self.loop = asyncio.get_running_loop()
+        if self._owns_runtime:
+            self.runtime = await worker_runtime.WorkerRuntime(loop=self.loop).open()
+            worker_runtime.install(self.runtime)
+
+        self._running.set()
+        for queue_name in self.queues:
+            for name, delayed in ((queue_name, False), (dq_name(queue_name), True)):
+                self._acks[name] = queue.Queue()
+                thread = threading.Thread(target=self._consume, args=(name, delayed), name=f"consumer-{name}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+        self._emit_after("worker_boot", self)
+        logger.info(f"Async worker consuming {self.queues} with up to {self.concurrency} concurrent jobs")
+
+    async def stop(self):
+        """Stops fetching, lets running jobs finish within the grace period and requeues the rest."""
+        self._running.clear()
+        if self._jobs:
+            logger.info(f"Waiting up to {self.shutdown_grace}s for {len(self._jobs)} running jobs")
+            _, pending = await asyncio.wait(set(self._jobs), timeout=self.shutdown_grace)
+            for job in pending:
+                job.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        for thread in self._threads:
+            await asyncio.to_thread(thread.join)
+        self._emit_before("worker_shutdown", self)
+        if self._owns_runtime:
+            await self.runtime.aclose()
+        logger.info(f"Async worker stopped after {self.processed} jobs ({self.failed} failed)")
+
+    # --- Consumer Threads ---
+    def _consume(self, queue_name, delayed):
+        consumer = self.broker.consume(queue_name, prefetch=self._prefetch(delayed), timeout=1000)
+        self._consumers[queue_name] = consumer
+        try:
+            while self._running.is_set():
+                self._post_process(queue_name, consumer)
+                if not delayed and not self._slots.acquire(timeout=_POLL_INTERVAL):
+                    continue
+                message = next(consumer)
+                if message is None:
+                    if not delayed:
+                        self._slots.release()
+                    continue
+                handler = self._delay if delayed else self._start_job
+                self.loop.call_soon_threadsafe(handler, queue_name, message)
+        except Exception:
+            logger.critical(f"Consumer for {queue_name} crashed", exc_info=True)
+            self._running.clear()
+        finally:
+            self._shutdown_consumer(queue_name, consumer)
+
+    def _prefetch(self, delayed):
+        # Delayed messages sit in memory until due, so take plenty at once.
+        # For work queues the slot semaphore is what bounds concurrency.
+        return 1000 if delayed else self.concurrency
+
+    def _post_process(self, queue_name, consumer):
+        """Acks or nacks finished messages. Runs on the queue's consumer thread only."""
+        acks = self._acks[queue_name]
+        while True:
+            try:
+                message, requeue = acks.get_nowait()
+            except queue.Empty:
+                return
+            if requeue:
+                consumer.requeue([message])
+            elif message.failed:
+                self._emit_before("nack", message)
+                consumer.nack(message)
+                self._emit_after("nack", message)
+            else:
+                self._emit_before("ack", message)
+                consumer.ack(message)
+                self._emit_after("ack", message)
+
+    def _shutdown_consumer(self, queue_name, consumer):
+        # Wait for the loop to hand back every message taken from this queue.
+        while any(job.queue_name == queue_name for job in list(self._jobs)):
+            self._post_process(queue_name, consumer)
+            threading.Event().wait(_POLL_INTERVAL)
+        self._post_process(queue_name, consumer)
+        # Prefetched messages that never started go straight back to the queue.
+        cached = [dramatiq.broker.MessageProxy(dramatiq.Message.decode(data)) for data in consumer.message_cache if data]
+        consumer.message_cache = []
+        consumer.requeue(cached)
+        consumer.close()
+
+    # --- Message Handling (event loop) ---
+    def _delay(self, queue_name, message):
+        """Moves a delayed message back to its work queue once its eta passes."""
+        delay = max(0, message.options.get("eta", 0) - current_millis()) / 1000
+
+        async def release():
+            await asyncio.sleep(delay)
+            new_message = message.copy(queue_name=q_name(message.queue_name))
+            del new_message.options["eta"]
+            await asyncio.to_thread(self.broker.enqueue, new_message)
+            self._acks[queue_name].put((message, False))
+
+        job = asyncio.ensure_future(release())
+        job.queue_name = queue_name
+        self._track(job)
+
+    def _start_job(self, queue_name, message):
+        job = asyncio.ensure_future(self._process(queue_name, message))
+        job.queue_name = queue_name
+        self._track(job)
+        job.add_done_callback(lambda _: self._slots.release())
+
+    def _track(self, job):
+        self._jobs.add(job)
+        job.add_done_callback(self._jobs.discard)
+
+    async def _process(self, queue_name, message):
+        requeue = False
+        try:
+            try:
+                actor = self.broker.get_actor(message.actor_name)
+            except ActorNotFound as e:
+                logger.error(f"Received message for undefined actor {message.actor_name!r}")
+                message.fail()
+                message.stuff_exception(e)
+                return
+
+            try:
+                await asyncio.to_thread(self._emit_before, "process_message", message)
+            except SkipMessage:
+                logger.warning(f"Message {message.message_id} was skipped")
+                await asyncio.to_thread(self._emit_after, "skip_message", message)
+                return
+
+            result = exception = None
+            time_limit = message.options.get("time_limit") or actor.options.get("time_limit", _DEFAULT_TIME_LIMIT_MS)
+            try:
+                result = await asyncio.wait_for(self._call(actor, message), time_limit / 1000)
+            except asyncio.TimeoutError:
+                exception = TimeLimitExceeded(f"Job {message.message_id} exceeded its {time_limit} ms time limit.")
+                logger.warning(str(exception))
+            except Exception as e:
+                exception = e
+                logger.error(f"Job {message.message_id} failed: {e}", exc_info=True)
+            if exception is not None:
+                message.stuff_exception(exception)
+                self.failed += 1
+            else:
+                self.processed += 1
+            # Retries, fair_queue, callbacks...
+            await asyncio.to_thread(self._emit_after, "process_message", message, result=result, exception=exception)
+
+        except asyncio.CancelledError:
+            # Shutting down mid-job: hand the message back for another worker.
+            requeue = True
+            raise
+        except Exception:
+            logger.critical(f"Unexpected failure while processing message {message.message_id}", exc_info=True)
+            message.fail()
+        finally:
+            self._acks[queue_name].put((message, requeue))
+
+    async def _call(self, actor, message):
+        handler = tasks.ASYNC_HANDLERS.get(actor.fn)
+        if handler:
+            return await handler(self.runtime.bot, *message.args, **message.kwargs)
+        # Any other actor is synchronous; run it off the loop. A time limit
+        # then only stops waiting for it, the thread itself runs to the end.
+        return await asyncio.to_thread(actor.fn, *message.args, **message.kwargs)
+
+    # --- Middleware ---
+    def _emit_before(self, signal_name, *args, **kwargs):
+        for middleware in self.middleware:
+            try:
+                getattr(middleware, "before_" + signal_name)(self.broker, *args, **kwargs)
+            except SkipMessage:
+                raise
+            except Exception:
+                logger.critical(f"Unexpected failure in before_{signal_name} of {middleware!r}", exc_info=True)
+
+    def _emit_after(self, signal_name, *args, **kwargs):
+        for middleware in reversed(self.middleware):
+            try:
+                getattr(middleware, "after_" + signal_name)(self.broker, *args, **kwargs)
+            except Exception:
+                logger.critical(f"Unexpected failure in after_{signal_name} of {middleware!r}", exc_info=True)
+
+
+# --- Main Worker Logic ---
+async def run_worker(concurrency=None, queues=None):
+    """Runs an AsyncWorker until SIGINT or SIGTERM."""
+    worker = AsyncWorker(queues=queues, concurrency=concurrency)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    await worker.start()
+    await stopping.wait()
+    logger.info("Shutting down async worker...")
+    await worker.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Asyncio worker for file processing jobs")
+    parser.add_argument("--concurrency", type=int, default=config.ASYNC_WORKER_CONCURRENCY,
+                        help="Maximum jobs running at once in this process")
+    parser.add_argument("--queues", nargs="+", default=list(fair_queue.TIERS), help="Queues to consume")
+    args = parser.parse_args()
+    asyncio.run(run_worker(args.concurrency, args.queues))
+
+
+if __name__ == "__main__":
+    main()
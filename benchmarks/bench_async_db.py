@@ -0,0 +1,91 @@
+# benchmarks/bench_async_db.py
+"""
+Compares update throughput with blocking vs. async database access.
+
+Simulates a burst of updates hitting handlers that call get_user and then
+reply to Telegram. MongoDB is an in-memory mongomock with a simulated
+round-trip time; the Telegram reply is an asyncio sleep. With blocking
+pymongo calls every round-trip stalls the event loop; async_database
+moves them onto a thread pool and serves cache hits inline.
+
+Usage:
+    python benchmarks/bench_async_db.py --updates 2000 --users 500 --rtt-ms 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakes
+
+fakes.use_mongomock()
+
+import async_database  # noqa: E402
+import database  # noqa: E402
+import user_cache  # noqa: E402
+
+
+async def _loop_lag_monitor(samples, interval=0.005):
+    """Records how late the event loop wakes up, i.e. how long it was blocked."""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+
+async def run_case(name, get_user, user_ids, reply_latency):
+    database.users.delete_many({})
+    user_cache.cache.clear(publish=False)
+
+    async def handle_update(user_id):
+        await get_user(user_id)
+        await asyncio.sleep(reply_latency)  # reply_text to Telegram
+
+    lag = []
+    monitor = asyncio.create_task(_loop_lag_monitor(lag))
+    started = time.perf_counter()
+    await asyncio.gather(*(handle_update(user_id) for user_id in user_ids))
+    elapsed = time.perf_counter() - started
+    monitor.cancel()
+
+    return {
+        "mode": name,
+        "seconds": round(elapsed, 3),
+        "updates_per_s": round(len(user_ids) / elapsed, 1),
+        "max_loop_block_ms": round(max(lag, default=0) * 1000, 1),
+        "cache": user_cache.cache.stats(),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--rtt-ms", type=float, default=2.0, help="Simulated MongoDB round-trip time.")
+    parser.add_argument("--reply-ms", type=float, default=30.0, help="Simulated Telegram reply latency.")
+    args = parser.parse_args()
+
+    database.users = fakes.LatencyCollection(database.users, args.rtt_ms / 1000)
+    rng = random.Random(0)
+    user_ids = [rng.randrange(args.users) for _ in range(args.updates)]
+
+    async def blocking_get_user(user_id):
+        return database.get_user(user_id)
+
+    results = [
+        await run_case("blocking", blocking_get_user, user_ids, args.reply_ms / 1000),
+        await run_case("async", async_database.get_user, user_ids, args.reply_ms / 1000),
+    ]
+    for result in results:
+        print(f"{result['mode']:>8}: {result['updates_per_s']:>8} updates/s, "
+              f"loop blocked up to {result['max_loop_block_ms']} ms")
+    print(json.dumps({"benchmark": "async_db", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+# benchmarks/bench_async_worker.py
+"""
+Compares a threaded Dramatiq worker with async_worker.py on file jobs.
+
+A batch of process_file messages is queued on fakeredis, then drained by
+either a `dramatiq.Worker` with --threads threads (like `dramatiq tasks`)
+or an AsyncWorker running up to --concurrency jobs as coroutines. Both
+run the real tasks.handle_job: status edits and a getFile + download
+from a local fake Bot API server that streams each file at --bandwidth-mb
+MB/s, then publishing into a temporary blob store (mongomock).
+
+Usage:
+    python benchmarks/bench_async_worker.py --jobs 200 --threads 8 --concurrency 64 --file-mb 0.5 --bandwidth-mb 0.25
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+_tmp = tempfile.mkdtemp(prefix="bench_async_worker_")
+os.environ["DOWNLOAD_DIR"] = os.path.join(_tmp, "downloads")
+os.environ["PUBLIC_FILES_DIR"] = os.path.join(_tmp, "public")
+
+import fakes
+
+fakes.use_mongomock()
+fakes.use_fakeredis()
+
+import dramatiq  # noqa: E402
+import redis  # noqa: E402
+
+import async_worker  # noqa: E402
+import config  # noqa: E402
+import tasks  # noqa: E402
+import worker_runtime  # noqa: E402
+
+
+def enqueue_jobs(count, first_id):
+    # Fresh file ids per run, so no job is served by the dedup store.
+    redis.Redis().flushall()
+    for i in range(first_id, first_id + count):
+        tasks.enqueue_file_job(
+            user_id=i, is_premium=False, chat_id=i, status_message_id=1, original_message_id=1,
+            file_id=f"F{i}", file_unique_id=f"U{i}", file_name=f"file{i}.bin",
+        )
+
+
+def wait_for_jobs(fake_api, count, started_edits):
+    # Every job edits its status message twice: "started" and the final link.
+    while fake_api.calls.get("editMessageText", 0) - started_edits < 2 * count:
+        time.sleep(0.02)
+
+
+def run_dramatiq(args, fake_api):
+    worker_runtime._runtime = None
+    worker_runtime.install(make_runtime(fake_api).start())
+    enqueue_jobs(args.jobs, first_id=0)
+    edits = fake_api.calls.get("editMessageText", 0)
+    fake_api.peak_downloads = 0
+
+    started = time.perf_counter()
+    worker = dramatiq.Worker(tasks.redis_broker, worker_threads=args.threads, worker_timeout=50)
+    worker.start()
+    wait_for_jobs(fake_api, args.jobs, edits)
+    elapsed = time.perf_counter() - started
+    worker.stop()
+    worker_runtime.get_runtime().stop()
+    return {"mode": f"dramatiq x{args.threads} threads", "seconds": elapsed}
+
+
+def run_async(args, fake_api):
+    worker_runtime._runtime = None
+    enqueue_jobs(args.jobs, first_id=args.jobs)
+    edits = fake_api.calls.get("editMessageText", 0)
+    fake_api.peak_downloads = 0
+
+    async def main():
+        runtime = await make_runtime(fake_api, loop=asyncio.get_running_loop()).open()
+        worker_runtime.install(runtime)
+        worker = async_worker.AsyncWorker(tasks.redis_broker, concurrency=args.concurrency, runtime=runtime)
+        started = time.perf_counter()
+        await worker.start()
+        await asyncio.to_thread(wait_for_jobs, fake_api, args.jobs, edits)
+        elapsed = time.perf_counter() - started
+        await worker.stop()
+        await runtime.aclose()
+        return elapsed
+
+    elapsed = asyncio.run(main())
+    return {"mode": f"async x{args.concurrency} coroutines", "seconds": elapsed}
+
+
+def make_runtime(fake_api, loop=None):
+    return worker_runtime.WorkerRuntime(base_url=fake_api.base_url, base_file_url=fake_api.base_file_url, loop=loop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8, help="Dramatiq worker threads.")
+    parser.add_argument("--concurrency", type=int, default=64, help="AsyncWorker jobs in flight.")
+    parser.add_argument("--file-mb", type=float, default=0.5, help="Size of each downloaded file.")
+    parser.add_argument("--bandwidth-mb", type=float, default=0.25, help="Per-download bandwidth, MB/s.")
+    parser.add_argument("--reply-ms", type=float, default=20.0, help="Simulated Bot API latency.")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    config.FAIR_QUEUE_ENABLED = False
+    config.WORKER_BOT_POOL_SIZE = max(args.threads, args.concurrency) + 4
+    fake_api = fakes.FakeBotApi(
+        latency=args.reply_ms / 1000, file_size=int(args.file_mb * 1024 * 1024),
+        bandwidth=args.bandwidth_mb * 1024 * 1024,
+    ).start_in_thread()
+
+    results = []
+    for run in (run_dramatiq, run_async):
+        result = run(args, fake_api)
+        result.update(
+            jobs=args.jobs,
+            seconds=round(result["seconds"], 2),
+            jobs_per_s=round(args.jobs / result["seconds"], 1),
+            peak_concurrent_downloads=fake_api.peak_downloads,
+        )
+        results.append(result)
+
+    for r in results:
+        print(f"{r['mode']:>24}: {r['jobs_per_s']:>6} jobs/s, {r['seconds']}s for {r['jobs']} jobs, "
+              f"peak {r['peak_concurrent_downloads']} concurrent downloads")
+    print(json.dumps({"benchmark": "async_worker", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# benchmarks/bench_fair_queue.py
+"""
+Shows how tiered, fair-share queueing changes queue waits under a flood.
+
+One free user dumps a burst of files at once while other free and premium
+users keep sending a few files each. Jobs run on a real Dramatiq worker
+against fakeredis; each job just sleeps for --job-ms. The run is repeated
+with plain FIFO queues (FAIR_QUEUE_ENABLED=false) and with fair sharing,
+and queue-wait percentiles are reported for the flooding user, other free
+users and premium users.
+
+Usage:
+    python benchmarks/bench_fair_queue.py --flood 60 --users 20 --premium-users 5 --workers 8
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+
+import fakes
+
+fakes.use_mongomock()
+fakes.use_fakeredis()
+
+import dramatiq  # noqa: E402
+import redis  # noqa: E402
+from dramatiq.brokers.redis import RedisBroker  # noqa: E402
+
+import config  # noqa: E402
+import fair_queue  # noqa: E402
+
+broker = RedisBroker()
+broker.add_middleware(fair_queue.FairShareMiddleware())
+dramatiq.set_broker(broker)
+
+_waits = []
+_lock = threading.Lock()
+_job_seconds = 0.05
+
+
+def _job(group, submitted_at):
+    with _lock:
+        _waits.append((group, time.time() - submitted_at))
+    time.sleep(_job_seconds)
+
+
+sim_free = dramatiq.actor(_job, actor_name="sim_free", queue_name=fair_queue.FREE, priority=10)
+sim_premium = dramatiq.actor(_job, actor_name="sim_premium", queue_name=fair_queue.PREMIUM, priority=0)
+
+
+def submit(user_id, is_premium, group):
+    tier = fair_queue.tier_of(is_premium)
+    actor = sim_premium if is_premium else sim_free
+    message = actor.message_with_options(args=(group, time.time()), user_id=user_id, tier=tier)
+    if config.FAIR_QUEUE_ENABLED:
+        fair_queue.submit(message, user_id, tier)
+    else:
+        broker.enqueue(message)
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[max(0, math.ceil(len(samples) * p / 100) - 1)] if samples else None
+
+
+def run_case(args, fair):
+    config.FAIR_QUEUE_ENABLED = fair
+    redis.Redis().flushall()
+    _waits.clear()
+
+    rng = random.Random(0)
+    # The flood arrives first, then everyone else trickles in.
+    arrivals = [(0.0, 1, False, "flooder")] * args.flood
+    for user_id in range(2, args.users + 2):
+        arrivals += [(rng.uniform(0, args.spread), user_id, False, "free") for _ in range(args.files_per_user)]
+    for user_id in range(1000, 1000 + args.premium_users):
+        arrivals += [(rng.uniform(0, args.spread), user_id, True, "premium") for _ in range(args.files_per_user)]
+    arrivals.sort(key=lambda a: a[0])
+
+    worker = dramatiq.Worker(broker, worker_threads=args.workers, worker_timeout=50)
+    worker.start()
+    started = time.time()
+    for offset, user_id, is_premium, group in arrivals:
+        delay = started + offset - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        submit(user_id, is_premium, group)
+
+    while len(_waits) < len(arrivals):
+        time.sleep(0.05)
+    worker.stop()
+
+    result = {"mode": "fair" if fair else "fifo", "seconds": round(time.time() - started, 2)}
+    for group in ("flooder", "free", "premium"):
+        waits = [w for g, w in _waits if g == group]
+        result[group] = {f"p{p}": round(percentile(waits, p), 3) for p in (50, 90, 99)}
+    return result
+
+
+def main():
+    global _job_seconds
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--flood", type=int, default=60, help="Files the flooding free user sends at once.")
+    parser.add_argument("--users", type=int, default=20, help="Other free users.")
+    parser.add_argument("--premium-users", type=int, default=5)
+    parser.add_argument("--files-per-user", type=int, default=2)
+    parser.add_argument("--spread", type=float, default=1.0, help="Seconds over which the other users arrive.")
+    parser.add_argument("--workers", type=int, default=8, help="Worker threads.")
+    parser.add_argument("--job-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    _job_seconds = args.job_ms / 1000
+    # Split the worker threads between the tiers roughly 3:1.
+    fair_queue._SLOTS[fair_queue.PREMIUM] = max(1, args.workers * 3 // 4)
+    fair_queue._SLOTS[fair_queue.FREE] = max(1, args.workers - fair_queue._SLOTS[fair_queue.PREMIUM])
+
+    results = [run_case(args, fair=False), run_case(args, fair=True)]
+    for r in results:
+        print(f"{r['mode']:>5}: flooder p50 {r['flooder']['p50']}s | other free p50 {r['free']['p50']}s "
+              f"p99 {r['free']['p99']}s | premium p50 {r['premium']['p50']}s p99 {r['premium']['p99']}s")
+    print(json.dumps({"benchmark": "fair_queue", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
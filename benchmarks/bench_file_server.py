@@ -0,0 +1,127 @@
+# benchmarks/bench_file_server.py
+"""
+Load-tests local_server.py with hundreds of concurrent keep-alive clients.
+
+The server runs in a separate process, serving a temporary directory with a
+mix of small files and one large file. Each client issues a sequence of
+whole-file and random Range requests over a single connection.
+
+Usage:
+    python benchmarks/bench_file_server.py --clients 500 --requests 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def _request(reader, writer, path, range_header=None):
+    lines = [f"GET /{path} HTTP/1.1", "Host: localhost"]
+    if range_header:
+        lines.append(f"Range: {range_header}")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+    await writer.drain()
+
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = 0
+    for line in head.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":", 1)[1])
+    await reader.readexactly(length)
+    return status, length
+
+
+async def _client(port, files, big_size, requests, rng, latencies, totals):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        for _ in range(requests):
+            started = time.perf_counter()
+            if rng.random() < 0.5:
+                status, length = await _request(reader, writer, rng.choice(files))
+                expected = 200
+            else:
+                start = rng.randrange(big_size - 256 * 1024)
+                status, length = await _request(reader, writer, "big.bin", f"bytes={start}-{start + 256 * 1024 - 1}")
+                expected = 206
+            latencies.append(time.perf_counter() - started)
+            totals["bytes"] += length
+            if status != expected:
+                totals["errors"] += 1
+    finally:
+        writer.close()
+
+
+async def _wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("File server did not start in time.")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=20, help="Requests per client connection.")
+    parser.add_argument("--big-mb", type=int, default=64)
+    parser.add_argument("--port", type=int, default=18080)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = []
+        for i in range(50):
+            name = f"small_{i}.bin"
+            with open(os.path.join(directory, name), "wb") as f:
+                f.write(os.urandom(64 * 1024))
+            files.append(name)
+        big_size = args.big_mb * 1024 * 1024
+        with open(os.path.join(directory, "big.bin"), "wb") as f:
+            f.write(os.urandom(big_size))
+
+        env = dict(os.environ, PUBLIC_FILES_DIR=directory, LOCAL_SERVER_PORT=str(args.port))
+        server = subprocess.Popen([sys.executable, os.path.join(ROOT, "local_server.py")], env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            await _wait_for_port(args.port)
+            latencies, totals = [], {"bytes": 0, "errors": 0}
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                _client(args.port, files, big_size, args.requests, random.Random(i), latencies, totals)
+                for i in range(args.clients)
+            ))
+            elapsed = time.perf_counter() - started
+        finally:
+            server.terminate()
+            server.wait()
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    result = {
+        "benchmark": "file_server",
+        "clients": args.clients,
+        "requests": len(latencies),
+        "errors": totals["errors"],
+        "seconds": round(elapsed, 3),
+        "requests_per_s": round(len(latencies) / elapsed, 1),
+        "mb_per_s": round(totals["bytes"] / elapsed / 1024 ** 2, 1),
+        "latency_ms": {"p50": round(quantiles[49] * 1000, 2), "p99": round(quantiles[98] * 1000, 2)},
+    }
+    print(f"{result['requests_per_s']} req/s, {result['mb_per_s']} MB/s, "
+          f"p50 {result['latency_ms']['p50']} ms, p99 {result['latency_ms']['p99']} ms")
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+# benchmarks/bench_local_bot_api.py
+"""
+Compares downloading direct uploads over HTTP with taking them over from a
+local Bot API server (telegram-bot-api --local).
+
+--jobs file jobs of --file-mb each run through tasks.handle_job against a
+local fake Bot API server, --concurrency at a time, publishing into a
+temporary blob store (mongomock). In "http" mode the worker streams every
+file from the server's file endpoint. In "local" mode the server answers
+getFile with a path on its own disk (written before the clock starts, as
+the real server fetches it from Telegram first), and the worker hardlinks
+it. Reported: throughput and the bytes the worker wrote to disk.
+
+Usage:
+    python benchmarks/bench_local_bot_api.py --jobs 20 --file-mb 64 --concurrency 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+_tmp = tempfile.mkdtemp(prefix="bench_local_bot_api_")
+os.environ["DOWNLOAD_DIR"] = os.path.join(_tmp, "downloads")
+os.environ["PUBLIC_FILES_DIR"] = os.path.join(_tmp, "public")
+
+import fakes  # noqa: E402
+
+fakes.use_mongomock()
+fakes.use_fakeredis()
+
+import config  # noqa: E402
+import tasks  # noqa: E402
+import worker_runtime  # noqa: E402
+
+
+def disk_writes():
+    """Bytes this process has written to storage so far (Linux only)."""
+    with open("/proc/self/io") as f:
+        return int(dict(line.split(": ") for line in f.read().splitlines())["write_bytes"])
+
+
+async def run(mode, args):
+    local_dir = os.path.join(_tmp, "bot-api-server") if mode == "local" else None
+    fake_api = fakes.FakeBotApi(file_size=int(args.file_mb * 1024 * 1024), bandwidth=10 ** 12,
+                                local_dir=local_dir)
+    await fake_api.start()
+    runtime = worker_runtime.WorkerRuntime(base_url=fake_api.base_url, base_file_url=fake_api.base_file_url,
+                                           local_mode=mode == "local", loop=asyncio.get_running_loop())
+    await runtime.open()
+    worker_runtime._runtime = None
+    worker_runtime.install(runtime)
+
+    # Fresh file ids per job, so none is served by the file_unique_id lookup.
+    # The fake serves the same bytes for every file, so after the first job the
+    # blob store drops each download as a duplicate in both modes alike.
+    file_ids = [f"{mode}{i}" for i in range(args.jobs)]
+    if local_dir:
+        for file_id in file_ids:
+            fake_api._write_local_file(f"documents/{file_id}.bin")
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def job(i, file_id):
+        async with semaphore:
+            await tasks.handle_job(runtime.bot, chat_id=i + 1, status_message_id=1, original_message_id=1,
+                                   file_id=file_id, file_unique_id=f"U{file_id}", file_name=f"{file_id}.bin")
+
+    os.sync()
+    written = disk_writes()
+    started = time.perf_counter()
+    await asyncio.gather(*(job(i, file_id) for i, file_id in enumerate(file_ids)))
+    elapsed = time.perf_counter() - started
+    os.sync()
+    written = disk_writes() - written
+
+    await runtime.aclose()
+    await fake_api.close()
+    return {"mode": mode, "jobs": args.jobs, "seconds": round(elapsed, 2),
+            "jobs_per_s": round(args.jobs / elapsed, 1), "mb_written_by_worker": round(written / 1024 ** 2, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--file-mb", type=float, default=64)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    config.ADMISSION_ENABLED = False
+    results = []
+    try:
+        for mode in ("http", "local"):
+            results.append(asyncio.run(run(mode, args)))
+    finally:
+        shutil.rmtree(_tmp, ignore_errors=True)
+
+    for r in results:
+        print(f"{r['mode']:>6}: {r['jobs_per_s']:>6} jobs/s, {r['seconds']}s for {r['jobs']} jobs, "
+              f"{r['mb_written_by_worker']} MB written by the worker")
+    print(json.dumps({"benchmark": "local_bot_api", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
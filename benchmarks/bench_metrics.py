@@ -0,0 +1,91 @@
+# benchmarks/bench_metrics.py
+"""
+Measures what recording a metric costs the job that records it.
+
+--calls timings are recorded from --threads threads, like worker threads
+sharing a process, against fakeredis: either with metrics.record, which
+writes each sample to Redis as it happens, or with metrics.observe, which
+only adds to in-process histogram totals flushed in the background.
+--rtt-ms adds a simulated Redis round-trip to every command sent. Finally
+one /metrics render is timed.
+
+Usage:
+    python benchmarks/bench_metrics.py --calls 20000 --threads 8 --rtt-ms 0.2
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+
+import fakes  # noqa: E402
+
+fakes.use_fakeredis()
+
+import metrics  # noqa: E402
+
+
+def slow_down(rtt):
+    """Makes every command (or pipeline) sent to fakeredis pay ``rtt``."""
+    connection = metrics._get_redis().connection_pool.get_connection()
+    cls = type(connection)
+    metrics._get_redis().connection_pool.release(connection)
+    send = cls.send_packed_command
+
+    def send_packed_command(self, *args, **kwargs):
+        time.sleep(rtt)
+        return send(self, *args, **kwargs)
+    cls.send_packed_command = send_packed_command
+
+
+def run(record_one, calls, threads):
+    def worker(n):
+        for i in range(n):
+            record_one(i)
+
+    pool = [threading.Thread(target=worker, args=(calls // threads,)) for _ in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--rtt-ms", type=float, default=0.2, help="Simulated Redis round-trip.")
+    args = parser.parse_args()
+
+    slow_down(args.rtt_ms / 1000)
+    strategies = (
+        ("record (Redis per call)", lambda i: metrics.record("bench", i % 100 / 10)),
+        ("observe (buffered)", lambda i: metrics.observe("download_seconds", i % 100 / 10, method="bench")),
+    )
+    results = []
+    for name, record_one in strategies:
+        elapsed = run(record_one, args.calls, args.threads)
+        results.append({"strategy": name, "calls": args.calls, "seconds": round(elapsed, 3),
+                        "us_per_call": round(elapsed / args.calls * 1e6, 2)})
+
+    started = time.perf_counter()
+    text = metrics.render()
+    render_ms = round((time.perf_counter() - started) * 1000, 1)
+    counted = next(line for line in text.splitlines()
+                   if line.startswith('morphile_download_seconds_count{method="bench"}'))
+    assert int(counted.split()[-1]) == args.calls // args.threads * args.threads, counted
+
+    for r in results:
+        print(f"{r['strategy']:>24}: {r['us_per_call']:>8} us per call")
+    print(f"{'render /metrics':>24}: {render_ms:>8} ms")
+    print(json.dumps({"benchmark": "metrics", "results": results, "render_ms": render_ms}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# benchmarks/bench_parallel_download.py
+"""
+Measures parallel_download throughput against a fake file source.
+
+With --interrupt-at, also kills a download part-way through (as a lost
+connection or worker restart would) and measures what the retry costs
+when it resumes from the checkpoint manifest.
+
+Usage:
+    python benchmarks/bench_parallel_download.py --size-mb 256 --connections 1,2,4,8
+    python benchmarks/bench_parallel_download.py --size-mb 256 --connections 4 --interrupt-at 0.9
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parallel_download
+from fakes import FakeFileSource, expected_bytes
+
+
+def _verify(path, size, part_size):
+    with open(path, "rb") as f:
+        for offset in range(0, size, part_size):
+            chunk = f.read(part_size)
+            if chunk != expected_bytes(offset, len(chunk)):
+                raise AssertionError(f"Corrupted data at offset {offset}")
+
+
+async def run_case(args, connections, directory):
+    source = FakeFileSource(
+        size=args.size_mb * 1024 * 1024,
+        latency=args.latency_ms / 1000,
+        bandwidth=args.bandwidth_mb * 1024 * 1024,
+        failure_rate=args.failure_rate,
+    )
+    path = os.path.join(directory, f"bench_{connections}.bin")
+    fetchers = [source.connection() for _ in range(connections)]
+
+    started = time.perf_counter()
+    await parallel_download.download_parts(fetchers, source.size, path, part_size=args.part_kb * 1024)
+    elapsed = time.perf_counter() - started
+
+    _verify(path, source.size, args.part_kb * 1024)
+    os.remove(path)
+    return {
+        "connections": connections,
+        "seconds": round(elapsed, 3),
+        "mb_per_s": round(source.size / elapsed / 1024 ** 2, 2),
+        "requests": source.requests,
+        "retried_failures": source.failures,
+    }
+
+
+class _LinkDropped(Exception):
+    """The whole download dies, not just one part: no per-part retry can help."""
+
+
+async def run_resume_case(args, connections, directory):
+    size = args.size_mb * 1024 * 1024
+    part_size = args.part_kb * 1024
+    path = os.path.join(directory, "bench_resume.bin")
+    cutoff = int(size * args.interrupt_at)
+
+    def source():
+        return FakeFileSource(size=size, latency=args.latency_ms / 1000, bandwidth=args.bandwidth_mb * 1024 * 1024)
+
+    first = source()
+
+    def dying(fetch):
+        async def fetch_until_cutoff(offset, limit):
+            if first.bytes_served >= cutoff:
+                raise _LinkDropped()
+            return await fetch(offset, limit)
+        return fetch_until_cutoff
+
+    started = time.perf_counter()
+    try:
+        await parallel_download.download_parts([dying(first.connection()) for _ in range(connections)], size, path, part_size=part_size)
+    except _LinkDropped:
+        pass
+    first_seconds = time.perf_counter() - started
+
+    retry = source()
+    started = time.perf_counter()
+    await parallel_download.download_parts([retry.connection() for _ in range(connections)], size, path, part_size=part_size)
+    retry_seconds = time.perf_counter() - started
+
+    _verify(path, size, part_size)
+    os.remove(path)
+    return {
+        "interrupted_at": args.interrupt_at,
+        "first_attempt_mb": round(first.bytes_served / 1024 ** 2, 1),
+        "first_attempt_seconds": round(first_seconds, 3),
+        "retry_mb": round(retry.bytes_served / 1024 ** 2, 1),
+        "retry_seconds": round(retry_seconds, 3),
+        "retry_mb_without_resume": args.size_mb,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=128)
+    parser.add_argument("--part-kb", type=int, default=1024)
+    parser.add_argument("--connections", default="1,2,4,8")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--bandwidth-mb", type=float, default=8, help="Per-connection bandwidth in MB/s.")
+    parser.add_argument("--failure-rate", type=float, default=0.01)
+    parser.add_argument("--interrupt-at", type=float, help="Fraction of the file after which a download dies and is retried.")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for connections in (int(c) for c in args.connections.split(",")):
+            result = await run_case(args, connections, directory)
+            print(f"{connections:>3} connections: {result['mb_per_s']:>8.2f} MB/s ({result['seconds']}s)")
+            results.append(result)
+        report = {"benchmark": "parallel_download", "results": results}
+        if args.interrupt_at:
+            connections = int(args.connections.split(",")[-1])
+            resume = await run_resume_case(args, connections, directory)
+            print(f"Interrupted at {resume['first_attempt_mb']} MB; the retry fetched {resume['retry_mb']} MB "
+                  f"in {resume['retry_seconds']}s instead of {resume['retry_mb_without_resume']} MB.")
+            report["resume"] = resume
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
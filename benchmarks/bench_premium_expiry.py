@@ -0,0 +1,92 @@
+# benchmarks/bench_premium_expiry.py
+"""
+Measures how fast expired premium plans are reverted to the free plan.
+
+--users users are stored in a mongomock database, --expired of them with a
+premium plan that has already ended. They are then downgraded either the
+old way (a cursor over the expired users, one update_one each) or by
+database.check_premium_status, which updates whole batches with
+update_many. --rtt-ms adds a simulated database round-trip to every call.
+
+Usage:
+    python benchmarks/bench_premium_expiry.py --users 10000 --expired 1000 --rtt-ms 1
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+
+import fakes  # noqa: E402
+
+fakes.use_mongomock()
+fakes.use_fakeredis()
+
+import config  # noqa: E402
+import database  # noqa: E402
+import user_cache  # noqa: E402
+
+
+def seed(users, expired):
+    now = datetime.utcnow()
+    database.users.delete_many({})
+    database.users.insert_many([
+        {
+            "user_id": i,
+            "is_premium": i < expired or i % 3 == 0,
+            "premium_expires": now - timedelta(days=1) if i < expired else now + timedelta(days=30),
+            "daily_limit_bytes": config.PREMIUM_DAILY_LIMIT_50GB,
+        }
+        for i in range(users)
+    ])
+
+
+def one_at_a_time():
+    """The previous implementation: one update per expired user."""
+    count = 0
+    for user in database.users.find({"is_premium": True, "premium_expires": {"$lt": datetime.utcnow()}}):
+        database.users.update_one(
+            {"_id": user["_id"]},
+            {"$set": {"is_premium": False, "premium_expires": None, "daily_limit_bytes": config.FREE_DAILY_LIMIT}}
+        )
+        user_cache.cache.invalidate(user["user_id"])
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--expired", type=int, default=1000)
+    parser.add_argument("--rtt-ms", type=float, default=1.0, help="Simulated database round-trip.")
+    args = parser.parse_args()
+
+    # mongomock checks unique indexes by scanning the whole collection on every
+    # write, which would swamp the round-trips being measured; use a copy of
+    # the users collection with just the expiry index.
+    plain = database.db.bench_users
+    plain.create_index([("is_premium", 1), ("premium_expires", 1)])
+    slow = fakes.LatencyCollection(plain, args.rtt_ms / 1000)
+    results = []
+    for name, strategy in (("one at a time", one_at_a_time), ("update_many", database.check_premium_status)):
+        database.users = plain
+        seed(args.users, args.expired)
+        database.users = slow
+        started = time.perf_counter()
+        downgraded = strategy()
+        elapsed = time.perf_counter() - started
+        still_expired = plain.count_documents({"is_premium": True, "premium_expires": {"$lt": datetime.utcnow()}})
+        results.append({"strategy": name, "users_downgraded": downgraded, "seconds": round(elapsed, 3),
+                        "still_expired": still_expired})
+
+    for r in results:
+        print(f"{r['strategy']:>14}: {r['users_downgraded']} users in {r['seconds']}s")
+    print(json.dumps({"benchmark": "premium_expiry", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
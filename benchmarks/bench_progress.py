@@ -0,0 +1,107 @@
+# benchmarks/bench_progress.py
+"""
+Measures progress-message traffic with many jobs downloading at once.
+
+--jobs simulated downloads run concurrently on one event loop, each
+reporting bytes every --callback-ms like a Telethon progress callback.
+Their status edits go to a fake Bot API that enforces Telegram-style
+flood control (--api-limit requests/second, 429 beyond that). Modes:
+
+- every-callback: one edit per callback (the naive approach).
+- interval: progress.ProgressReporter, throttled per job only.
+- interval+bucket: ProgressReporter plus the shared Redis token bucket.
+
+Usage:
+    python benchmarks/bench_progress.py --jobs 300 --seconds 20 --interval 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+
+import fakes
+
+fakes.use_fakeredis()
+
+import redis  # noqa: E402
+import telegram  # noqa: E402
+from telegram.request import HTTPXRequest  # noqa: E402
+
+import progress  # noqa: E402
+import rate_limit  # noqa: E402
+
+_real_try_acquire = rate_limit.try_acquire
+
+
+async def _no_limit(*args, **kwargs):
+    return 0
+
+
+async def download(bot, mode, chat_id, args, stats):
+    total = 100 * 1024 * 1024
+    steps = int(args.seconds * 1000 / args.callback_ms)
+    reporter = progress.ProgressReporter(bot, chat_id, 1, total=total, interval=args.interval)
+    if mode != "every-callback":
+        reporter.start()
+    try:
+        for step in range(1, steps + 1):
+            await asyncio.sleep(args.callback_ms / 1000)
+            reporter.update(total * step // steps, total)
+            if mode == "every-callback":
+                try:
+                    await bot.edit_message_text(chat_id=chat_id, message_id=1, text=reporter.render())
+                    stats["edits"] += 1
+                except telegram.error.RetryAfter:
+                    pass  # Counted by the fake API
+    finally:
+        await reporter.close()
+    stats["edits"] += reporter.edits
+
+
+async def run_case(mode, args, fake_api):
+    redis.Redis().flushall()
+    rate_limit.try_acquire = _real_try_acquire if mode == "interval+bucket" else _no_limit
+    fake_api.rejected = fake_api.peak_rate = 0
+    stats = {"edits": 0}
+
+    request = HTTPXRequest(connection_pool_size=args.jobs, pool_timeout=30, connect_timeout=30)
+    async with telegram.Bot(os.environ["BOT_TOKEN"], base_url=fake_api.base_url, request=request) as bot:
+        started = time.perf_counter()
+        await asyncio.gather(*(download(bot, mode, chat_id, args, stats) for chat_id in range(args.jobs)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "mode": mode,
+        "seconds": round(elapsed, 2),
+        "edits_delivered": stats["edits"],
+        "edits_per_job": round(stats["edits"] / args.jobs, 1),
+        "flood_rejections": fake_api.rejected,
+        "peak_requests_per_s": fake_api.peak_rate,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=300)
+    parser.add_argument("--seconds", type=float, default=20.0, help="Duration of each download.")
+    parser.add_argument("--callback-ms", type=float, default=250.0, help="Interval between progress callbacks.")
+    parser.add_argument("--interval", type=float, default=2.0, help="PROGRESS_INTERVAL for the reporter modes.")
+    parser.add_argument("--api-limit", type=int, default=30, help="Requests per second the fake API accepts.")
+    parser.add_argument("--modes", default="every-callback,interval,interval+bucket")
+    args = parser.parse_args()
+
+    fake_api = fakes.FakeBotApi(rate_limit=args.api_limit).start_in_thread()
+    results = [asyncio.run(run_case(mode, args, fake_api)) for mode in args.modes.split(",")]
+    for r in results:
+        print(f"{r['mode']:>16}: {r['edits_delivered']:>6} edits delivered ({r['edits_per_job']}/job), "
+              f"{r['flood_rejections']:>6} flood rejections, peak {r['peak_requests_per_s']} req/s")
+    print(json.dumps({"benchmark": "progress", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
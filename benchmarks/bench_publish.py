@@ -0,0 +1,106 @@
+# benchmarks/bench_publish.py
+"""
+Measures how long it takes to move a finished download into the blob store.
+
+DOWNLOAD_DIR is put on a different filesystem (--download-dir, tmpfs by
+default) from PUBLIC_FILES_DIR (a temporary directory on disk), the setup
+where the old `shutil.move` silently became a full copy. Cases:
+
+- old move: shutil.move from DOWNLOAD_DIR, the old publish step.
+- staged place: storage.place from storage.STAGING_DIR, where downloads
+  now go when the two directories are on different filesystems.
+- old copy / place(copy=True): local test files, which stay in place.
+
+Hashing is left out, since it costs the same in every case.
+
+Usage:
+    python benchmarks/bench_publish.py --size-mb 512 --rounds 3
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+
+import fakes  # noqa: E402
+
+_CHUNK = 8 * 1024 * 1024
+
+
+def write_file(path, size):
+    with open(path, "wb") as f:
+        for offset in range(0, size, _CHUNK):
+            f.write(fakes.expected_bytes(offset, min(_CHUNK, size - offset)))
+
+
+def time_case(rounds, size, source_dir, dest_dir, publish):
+    timings, method = [], None
+    for i in range(rounds):
+        source = os.path.join(source_dir, f"download{i}.bin")
+        write_file(source, size)
+        dest = os.path.join(dest_dir, f"blob{i}")
+        started = time.perf_counter()
+        method = publish(source, dest)
+        timings.append(time.perf_counter() - started)
+        for path in (source, dest):
+            if os.path.exists(path):
+                os.remove(path)
+    return statistics.median(timings), method
+
+
+def old_move(source, dest):
+    shutil.move(source, dest)
+    return "shutil.move"
+
+
+def old_copy(source, dest):
+    shutil.copy(source, dest)
+    return "shutil.copy"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--download-dir", default="/dev/shm", help="A directory on another filesystem.")
+    args = parser.parse_args()
+
+    public_dir = tempfile.mkdtemp(prefix="bench_publish_")
+    download_dir = tempfile.mkdtemp(prefix="bench_publish_", dir=args.download_dir)
+    os.environ["PUBLIC_FILES_DIR"] = public_dir
+    os.environ["DOWNLOAD_DIR"] = download_dir
+    fakes.use_mongomock()
+    fakes.use_fakeredis()
+    import storage  # noqa: E402  (reads the directories above at import)
+
+    size = args.size_mb * 1024 * 1024
+    cross_device = os.stat(download_dir).st_dev != os.stat(public_dir).st_dev
+    cases = [
+        ("old move", download_dir, old_move),
+        ("staged place", storage.STAGING_DIR, storage.place),
+        ("old copy (local test)", storage.STAGING_DIR, old_copy),
+        ("place(copy=True) (local test)", storage.STAGING_DIR, lambda s, d: storage.place(s, d, copy=True)),
+    ]
+    results = []
+    try:
+        for name, source_dir, publish in cases:
+            seconds, method = time_case(args.rounds, size, source_dir, storage.BLOB_DIR, publish)
+            results.append({"case": name, "method": method, "seconds": round(seconds, 4)})
+    finally:
+        shutil.rmtree(public_dir, ignore_errors=True)
+        shutil.rmtree(download_dir, ignore_errors=True)
+
+    print(f"{args.size_mb} MB file, download dir on {'another' if cross_device else 'the same'} filesystem")
+    for r in results:
+        print(f"{r['case']:>30}: {r['seconds'] * 1000:>9.1f} ms  ({r['method']})")
+    print(json.dumps({"benchmark": "publish", "size_mb": args.size_mb, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
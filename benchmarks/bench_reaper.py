@@ -0,0 +1,95 @@
+# benchmarks/bench_reaper.py
+"""
+Measures how fast expired public files are deleted.
+
+--files public files are published (sharing --blobs blobs, like dedup
+hits) with an expiry in the past, in a temporary directory with a
+mongomock database. They are then deleted either one at a time
+(storage.unlink per file, one database round-trip each) or by
+reaper.reap, which works in indexed batches with bulk updates.
+--rtt-ms adds a simulated database round-trip to every call.
+
+Usage:
+    python benchmarks/bench_reaper.py --files 5000 --blobs 500 --rtt-ms 1
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+_tmp = tempfile.mkdtemp(prefix="bench_reaper_")
+os.environ["DOWNLOAD_DIR"] = os.path.join(_tmp, "downloads")
+os.environ["PUBLIC_FILES_DIR"] = os.path.join(_tmp, "public")
+
+import fakes  # noqa: E402
+
+fakes.use_mongomock()
+fakes.use_fakeredis()
+
+import database  # noqa: E402
+import reaper  # noqa: E402
+import storage  # noqa: E402
+
+
+def publish(files, blobs):
+    expired = datetime.utcnow() - timedelta(days=1)
+    stored = []
+    for i in range(blobs):
+        path = os.path.join(storage.STAGING_DIR, f"blob{i}")
+        with open(path, "wb") as f:
+            f.write(os.urandom(4096))
+        stored.append(storage.ingest(path, f"file{i}.bin"))
+    for i in range(files):
+        storage.link(stored[i % blobs], f"file{i}.bin", owner=i, expires_at=expired)
+
+
+def per_file():
+    count = 0
+    for file in list(database.get_expired_files(datetime.utcnow(), 0)):
+        storage.unlink(file["blob"], file["path"])
+        count += 1
+    return count
+
+
+def batched():
+    expired, _, _ = reaper.reap(pause=0, max_files=10 ** 9)
+    return expired
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--blobs", type=int, default=500)
+    parser.add_argument("--rtt-ms", type=float, default=1.0, help="Simulated database round-trip.")
+    args = parser.parse_args()
+
+    results = []
+    try:
+        for name, strategy in (("one at a time", per_file), ("reaper batches", batched)):
+            publish(args.files, args.blobs)
+            if not results:
+                database.files = fakes.LatencyCollection(database.files, args.rtt_ms / 1000)
+                database.blobs = fakes.LatencyCollection(database.blobs, args.rtt_ms / 1000)
+            started = time.perf_counter()
+            deleted = strategy()
+            elapsed = time.perf_counter() - started
+            left = sum(len(names) for path, _, names in os.walk(os.environ["PUBLIC_FILES_DIR"])
+                       if "/." not in path)  # Public files only, not the blob store
+            results.append({"strategy": name, "files_deleted": deleted, "seconds": round(elapsed, 2),
+                            "files_per_s": round(deleted / elapsed), "public_files_left": left})
+    finally:
+        shutil.rmtree(_tmp, ignore_errors=True)
+
+    for r in results:
+        print(f"{r['strategy']:>15}: {r['files_per_s']:>7} files/s ({r['files_deleted']} in {r['seconds']}s)")
+    print(json.dumps({"benchmark": "reaper", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
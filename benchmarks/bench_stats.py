@@ -0,0 +1,100 @@
+# benchmarks/bench_stats.py
+"""
+Measures what a press of "📊 Statistics" costs, and what the counters
+cost the writes that keep them up to date.
+
+--users users are stored in a mongomock database, a third of them premium
+and half with usage today. The statistics are then read --clicks times,
+either the old way (two count_documents and a $group over every user,
+now database.reconcile_statistics) or from the counters by
+database.get_db_statistics. Finally --charges reserve_usage calls are
+timed with and without their counter update. --rtt-ms adds a simulated
+database round-trip to every call.
+
+Usage:
+    python benchmarks/bench_stats.py --users 5000 --clicks 10 --charges 100 --rtt-ms 1
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+
+import fakes  # noqa: E402
+
+fakes.use_mongomock()
+fakes.use_fakeredis()
+
+import config  # noqa: E402
+import database  # noqa: E402
+
+
+def seed(users):
+    # mongomock checks unique indexes by scanning, so the users are seeded into a collection without one.
+    database.users = database.db.bench_users
+    today = database.utc_day()
+    database.users.insert_many([
+        {
+            "user_id": i,
+            "is_premium": i % 3 == 0,
+            "daily_usage": 1024 * i if i % 2 == 0 else 0,
+            "usage_day": today,
+            "daily_limit_bytes": config.PREMIUM_DAILY_LIMIT_100GB,
+        }
+        for i in range(users)
+    ])
+    database.users.create_index("user_id")
+
+
+def time_reads(read, clicks):
+    started = time.perf_counter()
+    for _ in range(clicks):
+        statistics = read()
+    return (time.perf_counter() - started) / clicks, statistics
+
+
+def time_charges(users, charges):
+    started = time.perf_counter()
+    for i in range(charges):
+        database.reserve_usage(i % users, 1)
+    return (time.perf_counter() - started) / charges
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--clicks", type=int, default=10)
+    parser.add_argument("--charges", type=int, default=100)
+    parser.add_argument("--rtt-ms", type=float, default=1.0, help="Simulated database round-trip.")
+    args = parser.parse_args()
+
+    seed(args.users)
+    rtt = args.rtt_ms / 1000
+    database.users = fakes.LatencyCollection(database.users, rtt)
+    database.stats = fakes.LatencyCollection(database.stats, rtt)
+
+    scan, scanned = time_reads(database.reconcile_statistics, args.clicks)
+    counters, counted = time_reads(database.get_db_statistics, args.clicks)
+    assert scanned == counted, (scanned, counted)
+
+    with_counter = time_charges(args.users, args.charges)
+    count_usage, database._count_usage = database._count_usage, lambda day, nbytes: None
+    without_counter = time_charges(args.users, args.charges)
+    database._count_usage = count_usage
+
+    results = [
+        {"operation": "statistics, full scan", "users": args.users, "ms": round(scan * 1000, 2)},
+        {"operation": "statistics, counters", "users": args.users, "ms": round(counters * 1000, 2)},
+        {"operation": "reserve_usage without counter", "ms": round(without_counter * 1000, 2)},
+        {"operation": "reserve_usage with counter", "ms": round(with_counter * 1000, 2)},
+    ]
+    for r in results:
+        print(f"{r['operation']:>30}: {r['ms']:>8} ms")
+    print(json.dumps({"benchmark": "stats", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
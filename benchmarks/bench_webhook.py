@@ -0,0 +1,185 @@
+# benchmarks/bench_webhook.py
+"""
+Measures how many updates per second one webhook front-end can ingest.
+
+Replays updates through webhook.WebhookApp with the real handlers: each
+file update runs handle_file_upload end to end (user lookup, quota
+reservation, status reply, Dramatiq enqueue). Telegram is a local fake
+Bot API server on its own thread, MongoDB is mongomock and Redis (dedup,
+quota and the Dramatiq queue) is fakeredis, so no external service is
+touched. A share of the updates is delivered twice to exercise
+deduplication.
+
+Updates are synthesized unless --replay points at a JSON-lines file of
+recorded updates (one Telegram Update object per line). With --http the
+app is served by uvicorn and updates are POSTed over real sockets.
+
+Usage:
+    python benchmarks/bench_webhook.py --updates 2000 --concurrency 100 --reply-ms 20
+    python benchmarks/bench_webhook.py --replay updates.jsonl --http
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+
+import fakes
+
+fakes.use_mongomock()
+redis_server = fakes.use_fakeredis()
+
+import redis  # noqa: E402
+import redis.asyncio as aioredis  # noqa: E402
+
+import bot  # noqa: E402
+import fair_queue  # noqa: E402
+import webhook  # noqa: E402
+
+_SECRET = "bench-secret"
+
+
+def load_updates(args):
+    if args.replay:
+        with open(args.replay) as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        rng = random.Random(0)
+        updates = []
+        for update_id in range(1, args.updates + 1):
+            user_id = rng.randrange(1, args.users + 1)
+            if rng.random() < 0.8:
+                updates.append(fakes.file_update(update_id, user_id, file_size=rng.randrange(1, 200) * 1024 * 1024))
+            else:
+                update = fakes.file_update(update_id, user_id)
+                del update["message"]["document"]
+                update["message"]["text"] = "hello"
+                updates.append(update)
+    # Telegram redelivers updates it did not see acknowledged in time.
+    rng = random.Random(1)
+    redelivered = [u for u in updates if rng.random() < args.duplicates]
+    return [json.dumps(u).encode() for u in updates + redelivered]
+
+
+async def post_asgi(app, body):
+    """Delivers one update by calling the ASGI app directly."""
+    scope = {
+        "type": "http", "method": "POST", "path": app.path,
+        "headers": [(b"x-telegram-bot-api-secret-token", _SECRET.encode()), (b"content-type", b"application/json")],
+    }
+    sent = False
+    status = None
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            await asyncio.Event().wait()
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def run(args):
+    fake_api = fakes.FakeBotApi(latency=args.reply_ms / 1000).start_in_thread()
+    app = webhook.WebhookApp(
+        application=bot.build_application(base_url=fake_api.base_url),
+        redis_client=aioredis.Redis(), secret=_SECRET,
+    )
+    await app.startup()
+    bodies = load_updates(args)
+
+    server = client = None
+    if args.http:
+        import httpx
+        import uvicorn
+
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, lifespan="off", log_level="warning"))
+        serve_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+        port = server.servers[0].sockets[0].getsockname()[1]
+        client = httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}", timeout=60,
+            limits=httpx.Limits(max_connections=args.concurrency),
+            headers={"X-Telegram-Bot-Api-Secret-Token": _SECRET, "Content-Type": "application/json"},
+        )
+
+        async def deliver(body):
+            return (await client.post(app.path, content=body)).status_code
+    else:
+        async def deliver(body):
+            return await post_asgi(app, body)
+
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(body):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            status = await deliver(body)
+            latencies.append(time.perf_counter() - started)
+            if status not in (200, 503):
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(body) for body in bodies))
+    elapsed = time.perf_counter() - started
+
+    if client:
+        await client.aclose()
+        server.should_exit = True
+        await serve_task
+    await app.shutdown()
+
+    latencies.sort()
+    queue = redis.Redis()
+    return {
+        "benchmark": "webhook",
+        "transport": "http" if args.http else "asgi",
+        "deliveries": len(bodies),
+        "processed": app.processed,
+        "duplicates_skipped": app.duplicates,
+        "deferred": app.deferred,
+        "errors": errors,
+        "jobs_enqueued": sum(queue.hlen(f"dramatiq:{tier}.msgs") + fair_queue.waiting(tier) for tier in fair_queue.TIERS),
+        "seconds": round(elapsed, 3),
+        "updates_per_s": round(len(bodies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+        "bot_api_calls": fake_api.calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=2000, help="Updates to synthesize (ignored with --replay).")
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--replay", help="JSON-lines file of recorded updates.")
+    parser.add_argument("--duplicates", type=float, default=0.05, help="Share of updates delivered twice.")
+    parser.add_argument("--concurrency", type=int, default=100, help="Concurrent deliveries (Telegram's max_connections).")
+    parser.add_argument("--reply-ms", type=float, default=20.0, help="Simulated Bot API latency.")
+    parser.add_argument("--http", action="store_true", help="Serve with uvicorn and POST over HTTP.")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(f"{result['updates_per_s']} updates/s, p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms")
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
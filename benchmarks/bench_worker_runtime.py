@@ -0,0 +1,109 @@
+# benchmarks/bench_worker_runtime.py
+"""
+Compares per-job event loops with the shared worker runtime.
+
+Several worker threads (like Dramatiq's) each process a stream of jobs.
+A job makes the Bot API calls a real job makes (status edit, final edit)
+around a simulated download. In "per-job" mode every job runs under its
+own asyncio.run with a new telegram.Bot, as tasks.process_file used to.
+In "runtime" mode jobs are submitted to one WorkerRuntime and share its
+Bot and connection pool.
+
+Telegram is a local fake Bot API server whose connections pay
+--connect-ms up front, standing in for TCP + TLS handshakes. Setup
+overhead is a job's wall time minus the time it would take with warm
+connections (two round-trips plus the download).
+
+Usage:
+    python benchmarks/bench_worker_runtime.py --jobs 400 --threads 8 --connect-ms 60 --reply-ms 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+
+import fakes
+
+import telegram  # noqa: E402
+
+from worker_runtime import WorkerRuntime  # noqa: E402
+
+
+async def job(bot, chat_id, download_seconds):
+    """The Telegram traffic of one file job, with the download replaced by a sleep."""
+    await bot.edit_message_text(chat_id=chat_id, message_id=1, text="⏳ File processing started...")
+    await asyncio.sleep(download_seconds)
+    await bot.edit_message_text(chat_id=chat_id, message_id=1, text="✅ File processed successfully!")
+
+
+def run_case(mode, args, fake_api):
+    download = args.download_ms / 1000
+    ideal = 2 * args.reply_ms / 1000 + download
+    durations = []
+    lock = threading.Lock()
+    runtime = WorkerRuntime(base_url=fake_api.base_url).start() if mode == "runtime" else None
+
+    async def per_job(chat_id):
+        bot = telegram.Bot(token=os.environ["BOT_TOKEN"], base_url=fake_api.base_url)
+        async with bot:
+            await job(bot, chat_id, download)
+
+    def worker_thread(thread_id):
+        for i in range(args.jobs // args.threads):
+            started = time.perf_counter()
+            if runtime:
+                runtime.run(job(runtime.bot, thread_id, download))
+            else:
+                asyncio.run(per_job(thread_id))
+            with lock:
+                durations.append(time.perf_counter() - started)
+
+    connections_before = fake_api.connections
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker_thread, args=(t,)) for t in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    if runtime:
+        runtime.stop()
+
+    overheads = sorted(d - ideal for d in durations)
+    return {
+        "mode": mode,
+        "jobs": len(durations),
+        "seconds": round(elapsed, 3),
+        "jobs_per_s": round(len(durations) / elapsed, 1),
+        "p50_setup_overhead_ms": round(statistics.median(overheads) * 1000, 1),
+        "p99_setup_overhead_ms": round(overheads[int(len(overheads) * 0.99) - 1] * 1000, 1),
+        "connections_opened": fake_api.connections - connections_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=8, help="Worker threads, as in `dramatiq --threads`.")
+    parser.add_argument("--connect-ms", type=float, default=60.0, help="Simulated TCP + TLS handshake time.")
+    parser.add_argument("--reply-ms", type=float, default=20.0, help="Simulated Bot API latency.")
+    parser.add_argument("--download-ms", type=float, default=50.0, help="Simulated download time per job.")
+    args = parser.parse_args()
+
+    fake_api = fakes.FakeBotApi(latency=args.reply_ms / 1000, connect_latency=args.connect_ms / 1000).start_in_thread()
+    results = [run_case("per-job", args, fake_api), run_case("runtime", args, fake_api)]
+    for r in results:
+        print(f"{r['mode']:>8}: {r['jobs_per_s']:>7} jobs/s, p50 setup overhead {r['p50_setup_overhead_ms']} ms, "
+              f"{r['connections_opened']} connections opened")
+    print(json.dumps({"benchmark": "worker_runtime", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
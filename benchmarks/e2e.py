@@ -0,0 +1,264 @@
+# benchmarks/e2e.py
+"""
+End-to-end benchmark: from a file arriving at the bot to its published link.
+
+--jobs file updates from --users users are handled by bot.handle_file_upload,
+up to --upload-concurrency at a time, exactly as the bot would handle them.
+The jobs it queues are run by an AsyncWorker (--worker async) or a threaded
+Dramatiq worker (--worker dramatiq) with --concurrency jobs in flight. Each
+job runs the real tasks.handle_job: status and progress edits, download,
+publish into a temporary public directory, and the final link.
+
+Telegram is a local fake Bot API server that answers after --reply-ms and
+streams direct uploads at --bandwidth-mb MB/s. Forwarded files come from a
+fake Telethon client that fetches --telethon-connections parts at a time
+through parallel_download, each connection at --bandwidth-mb MB/s.
+--scenario picks direct uploads, forwarded files, or a mix of both.
+
+MongoDB and Redis are mongomock and fakeredis (--services fake), or the
+daemons configured by MONGO_URI and REDIS_HOST (--services local; the
+database defaults to DATABASE_NAME=morphile_e2e). Fair sharing and the
+other settings come from the environment as in production; only the
+free tier's daily limit is lifted.
+
+Reported as JSON: jobs per second, p50/p99 end-to-end latency (from the
+update arriving to the link being sent), MB/s published and the peak RSS
+of the process, which includes the fakes. --output appends the report,
+with the current commit, to a JSON Lines file so runs can be compared
+across commits.
+
+Usage:
+    python benchmarks/e2e.py --scenario mixed --jobs 100 --users 20 --file-mb 2 --concurrency 32
+    python benchmarks/e2e.py --scenario forwarded --worker dramatiq --output e2e.jsonl
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(_ROOT)
+
+import fakes  # noqa: E402
+
+SCENARIOS = ("direct", "forwarded", "mixed")
+
+
+class Tracker:
+    """Follows each job through the fake Bot API, from its queued message to its final edit."""
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.started = {}  # file name -> time the update arrived
+        self.finished = {}  # file name -> (time, succeeded)
+        self._status_messages = {}  # (chat_id, message_id) -> file name
+        self._lock = threading.Lock()
+        self.all_done = threading.Event()
+
+    def on_call(self, method, params, result):
+        chat_id = int(params.get("chat_id", 0))
+        text = params.get("text", "")
+        if method == "sendMessage":
+            # "✅ Your file 'name' has been added to the queue..."
+            match = re.search(r"'(.+?)'", text)
+            if match:
+                self._status_messages[chat_id, result["message_id"]] = match.group(1)
+        elif method == "editMessageText" and text.startswith(("✅", "❌")):
+            name = self._status_messages.get((chat_id, int(params.get("message_id", 0))))
+            with self._lock:
+                if name and name not in self.finished:
+                    self.finished[name] = (time.perf_counter(), text.startswith("✅"))
+                    if len(self.finished) >= self.expected:
+                        self.all_done.set()
+
+
+def setup(args, directory):
+    """Installs the fakes (or points at local daemons) and imports the code under test."""
+    os.environ.setdefault("BOT_TOKEN", "123456:e2e")
+    os.environ["DOWNLOAD_DIR"] = os.path.join(directory, "downloads")
+    os.environ["PUBLIC_FILES_DIR"] = os.path.join(directory, "public")
+    # Forwarded files are only accepted with userbot credentials; the fake client needs none.
+    os.environ.setdefault("API_ID", "1")
+    os.environ.setdefault("API_HASH", "e2e")
+    for tier in ("FREE", "PREMIUM"):
+        os.environ.setdefault(f"FAIR_QUEUE_{tier}_SLOTS", str(args.concurrency))
+    if args.services == "fake":
+        fakes.use_mongomock()
+        fakes.use_fakeredis()
+    else:
+        os.environ.setdefault("DATABASE_NAME", "morphile_e2e")
+
+    global bot, config, tasks, async_worker, userbot_pool, worker_runtime
+    import async_worker
+    import bot
+    import config
+    import tasks
+    import userbot_pool
+    import worker_runtime
+
+    config.FREE_DAILY_LIMIT = 1 << 50
+    config.WORKER_BOT_POOL_SIZE = args.concurrency + 4
+    config.METRICS_WORKER_PORT = 0
+
+
+def make_updates(args):
+    """Yields (file name, update JSON) for every job; ids are unique per run so nothing is deduplicated."""
+    first = int(time.time() * 1000) % 10 ** 9
+    for i in range(args.jobs):
+        update_id = first + i
+        forwarded = args.scenario == "forwarded" or (args.scenario == "mixed" and i % 2)
+        update = fakes.file_update(update_id, first + i % args.users, file_size=args.file_bytes, forwarded=forwarded)
+        yield update["message"]["document"]["file_name"], update
+
+
+async def upload_all(args, tracker, fake_api):
+    """Feeds every update to bot.handle_file_upload, --upload-concurrency at a time."""
+    from telegram import Bot, Update
+    from telegram.request import HTTPXRequest
+
+    request = HTTPXRequest(connection_pool_size=args.upload_concurrency + 4)
+    async with Bot(token=os.environ["BOT_TOKEN"], base_url=fake_api.base_url, request=request) as front_end:
+        slots = asyncio.Semaphore(args.upload_concurrency)
+
+        async def upload(name, data):
+            async with slots:
+                tracker.started[name] = time.perf_counter()
+                await bot.handle_file_upload(Update.de_json(data, front_end), None)
+
+        await asyncio.gather(*(upload(name, data) for name, data in make_updates(args)))
+        await asyncio.to_thread(tracker.all_done.wait, args.timeout)
+
+
+def make_runtime(fake_api, loop=None):
+    return worker_runtime.WorkerRuntime(base_url=fake_api.base_url, base_file_url=fake_api.base_file_url, loop=loop)
+
+
+async def run_async_worker(args, tracker, fake_api):
+    runtime = await make_runtime(fake_api, loop=asyncio.get_running_loop()).open()
+    worker_runtime.install(runtime)
+    worker = async_worker.AsyncWorker(tasks.redis_broker, concurrency=args.concurrency, runtime=runtime)
+    await worker.start()
+    try:
+        await upload_all(args, tracker, fake_api)
+    finally:
+        await worker.stop()
+        await runtime.aclose()
+
+
+def run_dramatiq_worker(args, tracker, fake_api):
+    import dramatiq
+
+    worker_runtime.install(make_runtime(fake_api).start())
+    worker = dramatiq.Worker(tasks.redis_broker, worker_threads=args.concurrency, worker_timeout=50)
+    worker.start()
+    try:
+        asyncio.run(upload_all(args, tracker, fake_api))
+    finally:
+        worker.stop()
+        worker_runtime.get_runtime().stop()
+
+
+def percentile(values, p):
+    """Nearest-rank percentile, like metrics.percentiles."""
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * p / 100) - 1)] if values else None
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(args, tracker):
+    succeeded = [name for name, (_, ok) in tracker.finished.items() if ok]
+    latencies = [tracker.finished[name][0] - tracker.started[name] for name in succeeded]
+    elapsed = (max(t for t, _ in tracker.finished.values()) - min(tracker.started.values())
+               if tracker.finished else float("nan"))
+    ms = lambda seconds: None if seconds is None else round(seconds * 1000, 1)  # noqa: E731
+    return {
+        "benchmark": "e2e",
+        "commit": current_commit(),
+        "scenario": args.scenario,
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "file_bytes")},
+        "results": {
+            "jobs": args.jobs,
+            "succeeded": len(succeeded),
+            "failed": len(tracker.finished) - len(succeeded),
+            "unfinished": args.jobs - len(tracker.finished),
+            "seconds": round(elapsed, 2),
+            "jobs_per_s": round(len(succeeded) / elapsed, 2),
+            "p50_latency_ms": ms(percentile(latencies, 50)),
+            "p99_latency_ms": ms(percentile(latencies, 99)),
+            "mb_per_s": round(len(succeeded) * args.file_bytes / elapsed / 1024 ** 2, 2),
+            # ru_maxrss is in KB on Linux
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=SCENARIOS, default="mixed")
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--file-mb", type=float, default=2.0, help="Size of every file.")
+    parser.add_argument("--bandwidth-mb", type=float, default=4.0, help="Per-connection bandwidth, MB/s.")
+    parser.add_argument("--reply-ms", type=float, default=20.0, help="Simulated Bot API latency.")
+    parser.add_argument("--telethon-connections", type=int, default=4)
+    parser.add_argument("--upload-concurrency", type=int, default=32, help="Updates the bot handles at once.")
+    parser.add_argument("--worker", choices=("async", "dramatiq"), default="async")
+    parser.add_argument("--concurrency", type=int, default=32, help="Worker jobs in flight (coroutines or threads).")
+    parser.add_argument("--services", choices=("fake", "local"), default="fake",
+                        help="mongomock and fakeredis, or the MongoDB and Redis daemons from the environment.")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for the jobs to finish.")
+    parser.add_argument("--output", help="Append the JSON report to this JSON Lines file.")
+    args = parser.parse_args()
+    args.file_bytes = int(args.file_mb * 1024 * 1024)
+
+    logging.disable(logging.WARNING)
+    directory = tempfile.mkdtemp(prefix="e2e_")
+    try:
+        setup(args, directory)
+        if args.scenario != "forwarded" and args.file_bytes > config.BOT_API_DOWNLOAD_LIMIT:
+            parser.error(f"Direct uploads are limited to {config.BOT_API_DOWNLOAD_LIMIT / 1024 ** 2:.0f} MB; "
+                         "use --scenario forwarded or set BOT_API_LOCAL_MODE.")
+
+        tracker = Tracker(args.jobs)
+        bandwidth = args.bandwidth_mb * 1024 * 1024
+        fake_api = fakes.FakeBotApi(latency=args.reply_ms / 1000, file_size=args.file_bytes, bandwidth=bandwidth,
+                                    on_call=tracker.on_call).start_in_thread()
+        userbot_pool._pool = fakes.FakeUserbotPool(args.file_bytes, connections=args.telethon_connections,
+                                                   latency=args.reply_ms / 1000, bandwidth=bandwidth)
+        if args.worker == "async":
+            asyncio.run(run_async_worker(args, tracker, fake_api))
+        else:
+            run_dramatiq_worker(args, tracker, fake_api)
+        result = report(args, tracker)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    r = result["results"]
+    print(f"{args.scenario} x{args.jobs} ({args.worker} worker): {r['jobs_per_s']} jobs/s, "
+          f"p50 {r['p50_latency_ms']} ms, p99 {r['p99_latency_ms']} ms, {r['mb_per_s']} MB/s, "
+          f"peak RSS {r['peak_rss_mb']} MB, {r['failed']} failed, {r['unfinished']} unfinished")
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+# benchmarks/fakes.py
+"""
+Local stand-ins for Telegram used by the benchmark scripts.
+
+Nothing here talks to the network; latency and bandwidth are simulated
+so results are reproducible on a laptop or in CI.
+"""
+import asyncio
+import collections
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import parse_qs
+
+# A repeating byte pattern whose length (251) is coprime with every part
+# size, so a part written at the wrong offset is always detected.
+_PATTERN = bytes(range(251)) * ((2 * 1024 * 1024) // 251 + 2)
+
+
+def expected_bytes(offset, length):
+    """Returns the content the fake source holds at ``offset``."""
+    start = offset % 251
+    return _PATTERN[start:start + length]
+
+
+class FakeFileSource:
+    """
+    Serves a virtual file of ``size`` bytes over simulated connections.
+
+    Every connection behaves like one MTProto sender: it handles a single
+    request at a time, pays ``latency`` seconds per round-trip and moves
+    data at ``bandwidth`` bytes/second. ``failure_rate`` makes a fraction
+    of requests fail with a ConnectionError so retries get exercised.
+    """
+
+    def __init__(self, size, latency=0.05, bandwidth=8 * 1024 * 1024, failure_rate=0.0, seed=0):
+        self.size = size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failures = 0
+        self.bytes_served = 0
+        self._random = random.Random(seed)
+
+    def connection(self):
+        """Returns an ``async fetch(offset, limit)`` bound to a new connection."""
+        lock = asyncio.Lock()
+
+        async def fetch(offset, limit):
+            async with lock:
+                self.requests += 1
+                length = max(0, min(limit, self.size - offset))
+                await asyncio.sleep(self.latency + length / self.bandwidth)
+                if self._random.random() < self.failure_rate:
+                    self.failures += 1
+                    raise ConnectionError("Simulated connection reset")
+                self.bytes_served += length
+                return expected_bytes(offset, length)
+
+        return fetch
+
+
+# --- MongoDB ---
+def use_mongomock():
+    """
+    Makes database.py use an in-memory mongomock server.
+
+    Must be called before anything imports database.py. Also disables the
+    user cache's Redis pub/sub, since no Redis is running.
+    """
+    import mongomock
+    import pymongo
+
+    os.environ.setdefault("USER_CACHE_PUBSUB", "false")
+    pymongo.MongoClient = mongomock.MongoClient
+
+    # Newer pymongo passes a `sort` option to bulk updates that mongomock doesn't know.
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+
+    def add_update_without_sort(self, *args, sort=None, **kwargs):
+        return add_update(self, *args, **kwargs)
+    mongomock.collection.BulkOperationBuilder.add_update = add_update_without_sort
+
+
+class LatencyCollection:
+    """
+    Wraps a collection so every method call pays a simulated round-trip.
+
+    The sleep happens outside the lock, like network time would, while the
+    lock keeps mongomock (which is not thread-safe) consistent.
+    """
+
+    def __init__(self, collection, rtt):
+        self._collection = collection
+        self._rtt = rtt
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            time.sleep(self._rtt)
+            with self._lock:
+                return attr(*args, **kwargs)
+        return call
+
+
+# --- Redis ---
+def use_fakeredis():
+    """
+    Points every redis / redis.asyncio client created from now on at one
+    shared in-memory fakeredis server (Lua scripts included).
+    """
+    import fakeredis
+    import redis
+    import redis.asyncio as aioredis
+
+    server = fakeredis.FakeServer()
+
+    class Redis(fakeredis.FakeRedis):
+        def __init__(self, *args, **kwargs):
+            super().__init__(server=server)
+
+    class AsyncRedis(fakeredis.FakeAsyncRedis):
+        def __init__(self, *args, **kwargs):
+            super().__init__(server=server)
+
+    redis.Redis = redis.StrictRedis = Redis
+    aioredis.Redis = aioredis.StrictRedis = AsyncRedis
+    return server
+
+
+# --- Bot API ---
+class FakeBotApi:
+    """
+    A local HTTP server that answers Bot API calls the way Telegram would.
+
+    Every method succeeds after ``latency`` seconds; each new connection
+    first pays ``connect_latency`` (standing in for the TCP and TLS
+    handshakes with api.telegram.org). sendMessage and
+    editMessageText echo back a message in the requesting chat; calls are
+    counted per method in ``calls``. getFile describes a ``file_size``
+    byte file, which is then served from ``base_file_url`` at
+    ``bandwidth`` bytes/second. With ``rate_limit``, method calls beyond
+    that many per second are refused with a 429 like Telegram's flood
+    control, and counted in ``rejected``. Point a bot at it with
+    ``base_url=fake.base_url, base_file_url=fake.base_file_url``.
+
+    sendMessage to a chat in ``blocked_chats`` fails with 403 like a user
+    who blocked the bot; messages delivered per chat are counted in
+    ``delivered``.
+
+    With ``local_dir`` it stands in for a server started with --local:
+    getFile writes the file into ``local_dir`` (at disk speed, like the
+    real server fetching it from Telegram) and returns its absolute path.
+
+    ``on_call(method, params, result)``, if given, is called (on the
+    server's thread) for every method call that succeeds.
+    """
+
+    def __init__(self, latency=0.0, connect_latency=0.0, file_size=1024 * 1024, bandwidth=8 * 1024 * 1024,
+                 rate_limit=None, local_dir=None, blocked_chats=(), on_call=None):
+        self.latency = latency
+        self.on_call = on_call
+        self.blocked_chats = set(blocked_chats)
+        self.delivered = collections.Counter()
+        self.local_dir = local_dir
+        self.connect_latency = connect_latency
+        self.file_size = file_size
+        self.bandwidth = bandwidth
+        self.rate_limit = rate_limit
+        self.rejected = 0
+        self.peak_rate = 0
+        self._recent = collections.deque()
+        self.connections = 0
+        self.downloads_active = 0
+        self.peak_downloads = 0
+        self.calls = {}
+        self._message_ids = 0
+        self._server = None
+        self.port = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    @property
+    def base_file_url(self):
+        return f"http://127.0.0.1:{self.port}/file/bot"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def start_in_thread(self):
+        """Runs the server on its own event loop thread, so it does not compete with the code under test."""
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name="fake-bot-api", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.start(), loop).result()
+        return self
+
+    async def _handle(self, reader, writer):
+        import httputil
+
+        self.connections += 1
+        try:
+            if self.connect_latency:
+                await asyncio.sleep(self.connect_latency)
+            while True:
+                request = await httputil.read_request(reader)
+                if request is None:
+                    break
+                length = int(request.headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length else b""
+                if request.path.startswith("/file/"):
+                    await self._serve_file(writer, request)
+                    if not request.keep_alive:
+                        break
+                    continue
+                method = request.path.rsplit("/", 1)[-1]
+                self.calls[method] = self.calls.get(method, 0) + 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                params = _parse_params(request, body)
+                if self._flood_limited():
+                    status, response = 429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 1},
+                                             "description": "Too Many Requests: retry after 1"}
+                elif method == "sendMessage" and int(params.get("chat_id", 0)) in self.blocked_chats:
+                    status, response = 403, {"ok": False, "error_code": 403,
+                                             "description": "Forbidden: bot was blocked by the user"}
+                else:
+                    status, response = 200, {"ok": True, "result": self._result(method, params)}
+                    if self.on_call:
+                        self.on_call(method, params, response["result"])
+                payload = json.dumps(response).encode()
+                writer.write(httputil.response_head(status, {
+                    "Content-Type": "application/json",
+                    "Content-Length": str(len(payload)),
+                }, request.keep_alive) + payload)
+                await writer.drain()
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, httputil.BadRequest):
+            pass
+        finally:
+            writer.close()
+
+    def _flood_limited(self):
+        now = time.monotonic()
+        while self._recent and self._recent[0] < now - 1:
+            self._recent.popleft()
+        if self.rate_limit and len(self._recent) >= self.rate_limit:
+            self.rejected += 1
+            return True
+        self._recent.append(now)
+        self.peak_rate = max(self.peak_rate, len(self._recent))
+        return False
+
+    async def _serve_file(self, writer, request):
+        import httputil
+
+        self.calls["download"] = self.calls.get("download", 0) + 1
+        self.downloads_active += 1
+        self.peak_downloads = max(self.peak_downloads, self.downloads_active)
+        try:
+            writer.write(httputil.response_head(200, {
+                "Content-Type": "application/octet-stream",
+                "Content-Length": str(self.file_size),
+            }, request.keep_alive))
+            chunk = 64 * 1024
+            for offset in range(0, self.file_size, chunk):
+                data = expected_bytes(offset, min(chunk, self.file_size - offset))
+                await asyncio.sleep(len(data) / self.bandwidth)
+                writer.write(data)
+                await writer.drain()
+        finally:
+            self.downloads_active -= 1
+
+    def _result(self, method, params):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Morphile", "username": "morphile_bot",
+                    "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+        if method in ("sendMessage", "editMessageText"):
+            self._message_ids += 1
+            chat_id = int(params.get("chat_id", 1))
+            if method == "sendMessage":
+                self.delivered[chat_id] += 1
+            return {
+                "message_id": int(params.get("message_id", self._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        if method == "getFile":
+            file_id = params.get("file_id", "file")
+            file_path = f"documents/{file_id}.bin"
+            if self.local_dir:
+                file_path = self._write_local_file(file_path)
+            return {"file_id": file_id, "file_unique_id": f"U{file_id}", "file_size": self.file_size,
+                    "file_path": file_path}
+        return True
+
+
+    def _write_local_file(self, file_path):
+        path = os.path.join(os.path.abspath(self.local_dir), file_path)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            chunk = 1024 * 1024
+            with open(path, "wb") as f:
+                for offset in range(0, self.file_size, chunk):
+                    f.write(expected_bytes(offset, min(chunk, self.file_size - offset)))
+        return path
+
+
+# --- Telethon ---
+class FakeUserbotPool:
+    """
+    Stands in for userbot_pool.UserbotPool: ``run(func)`` awaits
+    ``func(client)`` with a FakeTelethonClient. Install it with
+    ``userbot_pool._pool = FakeUserbotPool(...)`` before any job runs.
+    """
+
+    def __init__(self, file_size, connections=4, latency=0.05, bandwidth=8 * 1024 * 1024):
+        self.client = FakeTelethonClient(file_size, connections, latency, bandwidth)
+
+    async def run(self, func, *args, retry=True, **kwargs):
+        return await func(self.client, *args, **kwargs)
+
+    def close_sync(self, timeout=10):
+        pass
+
+
+class FakeTelethonClient:
+    """
+    Answers the calls tasks.py makes on a Telethon client. Every message
+    carries a ``file_size`` byte file, downloaded over ``connections``
+    simulated connections (FakeFileSource) with parallel_download, the way
+    large documents are fetched from a real DC.
+    """
+
+    def __init__(self, file_size, connections=4, latency=0.05, bandwidth=8 * 1024 * 1024):
+        self.file_size = file_size
+        self.connections = connections
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.downloads = 0
+
+    async def get_messages(self, chat_id, ids):
+        from types import SimpleNamespace
+
+        # No `document`, so parallel_download hands the download to download_media below.
+        return SimpleNamespace(id=ids, media=True, document=None,
+                               file=SimpleNamespace(name=f"forwarded{chat_id}_{ids}.bin", size=self.file_size))
+
+    async def download_media(self, message, file, progress_callback=None):
+        import parallel_download
+
+        self.downloads += 1
+        source = FakeFileSource(self.file_size, latency=self.latency, bandwidth=self.bandwidth)
+        await parallel_download.download_parts([source.connection() for _ in range(self.connections)],
+                                               self.file_size, file, progress_callback=progress_callback)
+        return file
+
+
+def _parse_params(request, body):
+    if request.headers.get("content-type", "").startswith("application/json"):
+        return json.loads(body or b"{}")
+    return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+
+def file_update(update_id, user_id, file_size=50 * 1024 * 1024, forwarded=False):
+    """Builds the JSON of an update carrying a document, as Telegram would send it."""
+    now = int(time.time())
+    message = {
+        "message_id": update_id,
+        "date": now,
+        "chat": {"id": user_id, "type": "private", "first_name": f"user{user_id}"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        "document": {
+            "file_id": f"FILE{update_id}",
+            "file_unique_id": f"U{update_id}",
+            "file_name": f"file{update_id}.bin",
+            "mime_type": "application/octet-stream",
+            "file_size": file_size,
+        },
+    }
+    if forwarded:
+        message["forward_date"] = now
+    return {"update_id": update_id, "message": message}
@@ -1,17 +1,26 @@
 # bot.py
+import asyncio
 import os
 import logging
 import traceback
 import json
+import secrets
+from urllib.parse import quote
+
+import redis.asyncio as aioredis
 from telegram import Update
 from telegram.ext import (
     Application, CommandHandler, MessageHandler,
     filters, ContextTypes
 )
 
+import admission
 import config
-from database import get_user, update_usage
-from tasks import process_file
+import metrics
+import async_database as db
+import progress
+import quota
+from tasks import process_file, enqueue_file_job
 
 # --- Logging Setup ---
 log_level = logging.DEBUG if config.DEBUG else logging.INFO
@@ -38,7 +47,10 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler for the /start command."""
     user = update.effective_user
-    get_user(user.id) # Ensure user is in the database
+    db_user = await db.get_user(user.id) # Ensure user is in the database
+    if db_user.get("blocked"):
+        # They unblocked the bot (Telegram sends /start on "Restart"), so include them in broadcasts again.
+        await db.mark_users_blocked([user.id], blocked=False)
     await update.message.reply_text(
         f"Hey {user.first_name}!\n\n"
         "I can process large files for you.\n"
@@ -84,7 +96,7 @@ async def handle_file_upload(update: Update, context: ContextTypes.DEFAULT_TYPE)
     the file for processing.
     """
     user = update.effective_user
-    db_user = get_user(user.id)
+    db_user = await db.get_user(user.id)
     file_obj = update.message.document or update.message.video or update.message.audio
 
     if not file_obj:
@@ -98,41 +110,110 @@ async def handle_file_upload(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return
 
-    # 2. Check daily usage limit
-    if db_user['daily_usage'] + file_obj.file_size > db_user['daily_limit_bytes']:
+    # 2. Reserve the file's size against the daily limit in one atomic step,
+    #    so concurrent uploads cannot overshoot it.
+    reservation = await quota.reserve(db_user, file_obj.file_size)
+    if not reservation:
         await update.message.reply_text("⚠️ You have reached your daily usage limit. Please try again tomorrow or upgrade your account.")
         return
 
-    # 3. Send initial status message that the worker can edit
-    status_message = await update.message.reply_text(
-        f"✅ Your file '{file_obj.file_name}' has been added to the queue.\n"
-        f"You will be notified when the processing is complete."
-    )
-
-    # 4. Enqueue the file for processing
-    chat_id = update.effective_chat.id
-    status_message_id = status_message.message_id
-    original_message_id = update.message.message_id # The ID of the message with the file
-    file_id = file_obj.file_id
+    # 3. In streaming mode, hand out the link right away; nothing is downloaded up front.
+    if config.STREAMING_MODE:
+        issued = False
+        try:
+            issued = await reply_with_stream_link(update, file_obj)
+        finally:
+            await (quota.commit if issued else quota.refund)(reservation)
+        return
 
     # Detect if the message is a forward to use the appropriate download method
     is_forwarded = update.message.forward_date is not None
     if is_forwarded and not (config.API_ID and config.API_HASH):
-        await status_message.edit_text("❌ This bot is not configured to handle forwarded files. Please send the file directly.")
+        await quota.refund(reservation)
+        await update.message.reply_text("❌ This bot is not configured to handle forwarded files. Please send the file directly.")
+        return
+    if not is_forwarded and file_obj.file_size > config.BOT_API_DOWNLOAD_LIMIT:
+        # Only a local Bot API server (BOT_API_LOCAL_MODE) can fetch large direct uploads.
+        await quota.refund(reservation)
+        hint = " Please forward it instead." if config.API_ID and config.API_HASH else ""
+        await update.message.reply_text(
+            f"❌ Files sent directly can be at most {config.BOT_API_DOWNLOAD_LIMIT / 1024**2:.0f} MB.{hint}"
+        )
         return
 
+    # 4. Send initial status message that the worker can edit
+    disk_note = ""
+    if config.ADMISSION_ENABLED and file_obj.file_size:
+        wait = await admission.expected_wait(file_obj.file_size)
+        if wait is None:
+            disk_note = "The server is short on disk space; your file will start once space is freed.\n"
+        elif wait:
+            disk_note = f"The server is short on disk space; expect a wait of about {progress.format_duration(wait)}.\n"
+    try:
+        status_message = await update.message.reply_text(
+            f"✅ Your file '{file_obj.file_name}' has been added to the queue.\n"
+            f"{disk_note}"
+            f"You will be notified when the processing is complete."
+        )
+    except Exception:
+        await quota.refund(reservation)
+        raise
+
+    # 5. Enqueue the file for processing; the worker commits or refunds the reservation.
+    chat_id = update.effective_chat.id
+    status_message_id = status_message.message_id
+    original_message_id = update.message.message_id # The ID of the message with the file
+    file_id = file_obj.file_id
+
     logger.info(
         f"Queueing file for processing: chat_id={chat_id}, file_id={file_id}, "
         f"status_message_id={status_message_id}, original_message_id={original_message_id}, "
         f"is_forwarded={is_forwarded}"
     )
-    process_file.send(
-        chat_id,
-        status_message_id=status_message_id,
-        original_message_id=original_message_id,
-        file_id=file_id,
-        is_forwarded=is_forwarded
+    try:
+        await asyncio.to_thread(
+            enqueue_file_job, user.id, db_user.get('is_premium', False), chat_id,
+            status_message_id=status_message_id,
+            original_message_id=original_message_id,
+            file_id=file_id,
+            is_forwarded=is_forwarded,
+            file_unique_id=file_obj.file_unique_id,
+            file_name=file_obj.file_name,
+            reservation=reservation,
+            file_size=file_obj.file_size
+        )
+    except Exception:
+        await quota.refund(reservation)
+        raise
+
+
+async def reply_with_stream_link(update: Update, file_obj):
+    """Registers a streaming link for the file and sends it to the user. Returns True on success."""
+    is_forwarded = update.message.forward_date is not None
+    if is_forwarded and not (config.API_ID and config.API_HASH):
+        await update.message.reply_text("❌ This bot is not configured to handle forwarded files. Please send the file directly.")
+        return False
+
+    token = secrets.token_urlsafe(16)
+    file_name = file_obj.file_name or f"{file_obj.file_unique_id}.bin"
+    await db.create_stream(
+        token,
+        chat_id=update.effective_chat.id,
+        message_id=update.message.message_id,
+        file_id=file_obj.file_id,
+        is_forwarded=is_forwarded,
+        file_name=file_name,
+        file_size=file_obj.file_size,
+        mime_type=getattr(file_obj, "mime_type", None)
     )
+    logger.info(f"Issued streaming link {token} for chat_id={update.effective_chat.id}, is_forwarded={is_forwarded}")
+
+    stream_link = f"{config.STREAM_BASE_URL}/{token}/{quote(file_name)}"
+    await update.message.reply_text(
+        f"✅ Your file is ready!\n\nYour direct link is:\n{stream_link}",
+        disable_web_page_preview=True
+    )
+    return True
 
 
 # --- Monkey-patch for JobQueue issue ---
@@ -152,14 +233,91 @@ class _DummyJobQueue(JobQueue):
 app_builder.JobQueue = _DummyJobQueue
 
 
+# --- Fallback Handler ---
+async def handle_other_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Fallback for any other text message."""
+    await update.message.reply_text("Please send me a file to process.")
+
+
+# --- Scheduled Jobs ---
+async def run_every(interval, job, description, lock=None):
+    """
+    Awaits ``job()`` every ``interval`` seconds for as long as the bot runs.
+
+    Every webhook replica runs the schedule, so with ``lock`` set a run only
+    happens in the replica that takes the Redis key ``schedule:<lock>``
+    (held for ``interval`` seconds) and the others skip their turn.
+    """
+    redis = aioredis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=0) if lock else None
+    try:
+        while True:
+            if await _take_turn(redis, lock, interval):
+                try:
+                    await job()
+                except Exception as e:
+                    logger.error(f"{description} failed: {e}")
+            await asyncio.sleep(interval)
+    finally:
+        if redis:
+            await redis.aclose()
+
+
+async def _take_turn(redis, lock, interval):
+    if not lock:
+        return True
+    try:
+        return bool(await redis.set(f"schedule:{lock}", 1, nx=True, ex=max(int(interval), 1)))
+    except aioredis.RedisError as e:
+        # Running twice is harmless for these jobs; not running at all is not.
+        logger.warning(f"Could not take the schedule lock {lock}: {e}")
+        return True
+
+
+async def reconcile_statistics():
+    """Corrects the statistics counters and saves a snapshot of them to the history."""
+    statistics = await db.reconcile_statistics()
+    await db.save_statistics_snapshot(statistics)
+
+
+async def start_scheduled_jobs(app: Application):
+    if config.PREMIUM_EXPIRY_INTERVAL:
+        app.bot_data["premium_expiry"] = asyncio.create_task(
+            run_every(config.PREMIUM_EXPIRY_INTERVAL, db.check_premium_status, "Premium expiry check",
+                      lock="premium_expiry"))
+    if config.STATS_RECONCILE_INTERVAL:
+        app.bot_data["stats_reconcile"] = asyncio.create_task(
+            run_every(config.STATS_RECONCILE_INTERVAL, reconcile_statistics, "Statistics reconciliation",
+                      lock="stats_reconcile"))
+
+
+async def stop_scheduled_jobs(app: Application):
+    for name in ("premium_expiry", "stats_reconcile"):
+        task = app.bot_data.pop(name, None)
+        if task:
+            task.cancel()
+
+
 # --- Main Application Setup ---
-def main():
-    """Starts the bot."""
+def build_application(base_url=None):
+    """
+    Builds the Application with all handlers registered.
+
+    Shared by polling mode (main) and webhook mode (webhook.py). ``base_url``
+    points the bot at a different Bot API server, e.g. a local fake; by
+    default BOT_API_SERVER is used if set.
+    """
     # Now, when Application.builder() is called, it will use our _DummyJobQueue
     # inside its __init__, which does nothing and avoids the error.
     # We still call .job_queue(None) to ensure the final Application object
     # correctly has no job queue.
-    app = Application.builder().token(config.BOT_TOKEN).job_queue(None).build()
+    builder = (Application.builder().token(config.BOT_TOKEN).job_queue(None)
+               .post_init(start_scheduled_jobs).post_shutdown(stop_scheduled_jobs))
+    if base_url:
+        builder = builder.base_url(base_url)
+    elif config.BOT_API_SERVER:
+        builder = (builder.base_url(config.BOT_API_BASE_URL).base_file_url(config.BOT_API_BASE_FILE_URL)
+                   .local_mode(config.BOT_API_LOCAL_MODE))
+    app = builder.build()
 
     # --- Error Handling ---
     app.add_error_handler(error_handler)
@@ -176,15 +334,18 @@ def main():
         handle_file_upload
     ))
 
-    # Fallback for any other text message
-    async def handle_other_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        await update.message.reply_text("Please send me a file to process.")
-
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_other_messages))
+    return app
+
+
+def main():
+    """Starts the bot in long-polling mode. For webhook mode, run webhook.py instead."""
+    app = build_application()
 
     # --- Start Polling ---
+    metrics.serve(config.METRICS_BOT_PORT)
     logger.info("Bot is starting up...")
     app.run_polling()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,144 @@
+# broadcast.py
+"""
+Sends a message to every user of the bot, resumably.
+
+Users are read from MongoDB a page at a time (BROADCAST_PAGE_SIZE), in
+user_id order, so the user list is never held in memory. Up to
+BROADCAST_CONCURRENCY messages are in flight, and each one first takes a
+token, in user order, from the broadcast bucket in rate_limit.py, which is
+shared by every process. When Telegram answers with RetryAfter anyway, every sender pauses
+for as long as it asks.
+
+Progress is saved in the `broadcasts` collection every
+BROADCAST_CHECKPOINT_INTERVAL seconds: the user_id up to which every send
+has finished, plus counters. A crashed or interrupted broadcast resumes
+from its checkpoint, so only the sends that were in flight when it was
+saved can reach a user twice. Users who blocked the bot are flagged and
+skipped by later broadcasts.
+"""
+import asyncio
+import collections
+import logging
+import time
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import async_database
+import config
+import rate_limit
+
+logger = logging.getLogger(__name__)
+
+_MAX_ATTEMPTS = 3
+_NETWORK_RETRY_DELAY = 1  # Seconds
+
+
+class Broadcast:
+    """Runs one broadcast document (see database.create_broadcast) to completion."""
+
+    def __init__(self, bot, broadcast, concurrency=None, on_progress=None):
+        self.bot = bot
+        self.id = broadcast["_id"]
+        self.text = broadcast["text"]
+        self.concurrency = concurrency or config.BROADCAST_CONCURRENCY
+        self.on_progress = on_progress
+        # Resumed broadcasts continue their counters; sends repeated after a crash count twice.
+        self.last_user_id = broadcast["last_user_id"]
+        self.sent = broadcast["sent"]
+        self.failed = broadcast["failed"]
+        self.blocked = broadcast["blocked"]
+        self._newly_blocked = []
+        self._paused_until = 0.0
+
+    async def run(self):
+        """Sends the message to every remaining user. Returns (sent, failed, blocked)."""
+        slots = asyncio.Semaphore(self.concurrency)
+        in_flight = collections.deque()  # (user_id, task), in user_id order
+        checkpoint_at = time.monotonic() + config.BROADCAST_CHECKPOINT_INTERVAL
+
+        after = self.last_user_id
+        while True:
+            page = await async_database.get_broadcast_recipients(after, config.BROADCAST_PAGE_SIZE)
+            if not page:
+                break
+            for user_id in page:
+                await slots.acquire()
+                # Tokens are taken here, in user order, so sends finish roughly in order
+                # and the checkpoint keeps up with them.
+                await self._throttle()
+                task = asyncio.create_task(self._send(user_id))
+                task.add_done_callback(lambda _: slots.release())
+                in_flight.append((user_id, task))
+                self._advance(in_flight)
+                if time.monotonic() >= checkpoint_at:
+                    await self._checkpoint()
+                    checkpoint_at = time.monotonic() + config.BROADCAST_CHECKPOINT_INTERVAL
+            after = page[-1]
+
+        await asyncio.gather(*(task for _, task in in_flight))
+        self._advance(in_flight)
+        await self._checkpoint(finished=True)
+        return self.sent, self.failed, self.blocked
+
+    def _advance(self, in_flight):
+        """Moves the checkpoint past the oldest sends that have finished."""
+        while in_flight and in_flight[0][1].done():
+            self.last_user_id = in_flight.popleft()[0]
+
+    async def _checkpoint(self, finished=False):
+        blocked, self._newly_blocked = self._newly_blocked, []
+        await async_database.mark_users_blocked(blocked)
+        await async_database.save_broadcast_progress(
+            self.id, self.last_user_id, self.sent, self.failed, self.blocked, finished=finished
+        )
+        if self.on_progress:
+            self.on_progress(self)
+
+    async def _throttle(self):
+        """Waits out a RetryAfter pause, then for a token from the broadcast bucket."""
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        await rate_limit.acquire(rate_limit.BROADCAST)
+
+    async def _send(self, user_id):
+        """Sends the message to one user; the caller has throttled the first attempt."""
+        network_errors = 0
+        while True:
+            try:
+                await self.bot.send_message(chat_id=user_id, text=self.text)
+                self.sent += 1
+                return
+            except RetryAfter as e:
+                # Telegram's flood control applies to the whole bot, so every sender waits.
+                logger.warning(f"Broadcast {self.id} throttled by Telegram for {e.retry_after}s")
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            except Forbidden:
+                # Blocked the bot or deleted their account.
+                self.blocked += 1
+                self._newly_blocked.append(user_id)
+                return
+            except BadRequest as e:
+                logger.info(f"Broadcast {self.id} could not reach {user_id}: {e}")
+                break
+            except NetworkError as e:
+                network_errors += 1
+                if network_errors >= _MAX_ATTEMPTS:
+                    logger.warning(f"Broadcast {self.id} gave up on {user_id}: {e}")
+                    break
+                await asyncio.sleep(_NETWORK_RETRY_DELAY * network_errors)
+            await self._throttle()
+        self.failed += 1
+
+
+async def start(bot, text, **kwargs):
+    """Creates a broadcast of ``text`` and runs it."""
+    broadcast = await async_database.create_broadcast(text)
+    logger.info(f"Starting broadcast {broadcast['_id']}")
+    return await Broadcast(bot, broadcast, **kwargs).run()
+
+
+async def resume(bot, broadcast, **kwargs):
+    """Continues a broadcast from its last checkpoint."""
+    logger.info(f"Resuming broadcast {broadcast['_id']} after user {broadcast['last_user_id']}")
+    return await Broadcast(bot, broadcast, **kwargs).run()
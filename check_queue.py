@@ -1,18 +1,15 @@
-import redis
-import config
-
-try:
-    # Connect to Redis
-    r = redis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=0)
-    # Check the connection
-    r.ping()
+"""
+Prints every metric once: queue depths, per-stage job timings and counters.
 
-    # Get the length of the default dramatiq queue
-    queue_name = "dramatiq:default"
-    queue_length = r.llen(queue_name)
+This is the same Prometheus text the /metrics endpoints serve (see
+metrics.py); scrape one of those to keep the history.
+"""
+import redis
 
-    print(f"Length of queue '{queue_name}': {queue_length}")
+import metrics
 
+try:
+    print(metrics.render(), end="")
 except redis.exceptions.ConnectionError as e:
     print(f"Error connecting to Redis: {e}")
 except Exception as e:
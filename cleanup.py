@@ -7,7 +7,10 @@ from datetime import datetime
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 try:
-    from database import reset_all_daily_usage, check_premium_status
+    from database import check_premium_status
+    from storage import reclaim_unreferenced_blobs, STAGING_DIR
+    from parallel_download import reap_partials
+    import config
 except ImportError:
     print("Error: Could not import database module. Make sure this script is in the project root.")
     sys.exit(1)
@@ -15,18 +18,14 @@ except ImportError:
 def perform_cleanup():
     """
     Runs the daily cleanup tasks for the database.
-    1. Resets daily usage for all users.
-    2. Checks for and revokes expired premium subscriptions.
+    1. Checks for and revokes expired premium subscriptions.
+    2. Deletes stored file blobs that no public link references anymore.
+    3. Deletes partial downloads that no retry is going to resume.
+
+    Daily usage needs no reset: it is counted per UTC day (see database.py).
     """
     print(f"--- Starting daily cleanup at {datetime.utcnow()} UTC ---")
 
-    # Reset daily usage for all users
-    try:
-        modified_count = reset_all_daily_usage()
-        print(f"✅ Successfully reset daily usage for {modified_count} users.")
-    except Exception as e:
-        print(f"❌ Error resetting daily usage: {e}")
-
     # Check for expired premium plans
     try:
         expired_count = check_premium_status()
@@ -37,6 +36,20 @@ def perform_cleanup():
     except Exception as e:
         print(f"❌ Error checking premium status: {e}")
 
+    # Reclaim deduplicated blobs with no remaining references
+    try:
+        blob_count, reclaimed_bytes = reclaim_unreferenced_blobs()
+        print(f"✅ Reclaimed {blob_count} unreferenced blobs ({reclaimed_bytes / (1024**3):.2f} GB).")
+    except Exception as e:
+        print(f"❌ Error reclaiming unreferenced blobs: {e}")
+
+    # Reap abandoned partial downloads
+    try:
+        partial_count, freed_bytes = reap_partials(STAGING_DIR, config.PARTIAL_DOWNLOAD_MAX_AGE)
+        print(f"✅ Removed {partial_count} abandoned partial downloads ({freed_bytes / (1024**3):.2f} GB).")
+    except Exception as e:
+        print(f"❌ Error removing partial downloads: {e}")
+
     print("--- Daily cleanup finished ---")
 
 if __name__ == "__main__":
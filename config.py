@@ -22,9 +22,21 @@ if not BOT_TOKEN:
 MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017/")
 DATABASE_NAME = "filebot"
 
+# Connection pool tuning. The async layer (async_database.py) runs queries on
+# a bounded thread pool; keep MONGO_EXECUTOR_WORKERS <= MONGO_MAX_POOL_SIZE so
+# threads never queue for a connection.
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", 50))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", 5))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", 300_000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10_000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10_000))
+MONGO_EXECUTOR_WORKERS = int(os.environ.get("MONGO_EXECUTOR_WORKERS", 32))
+
 # --- File Paths ---
 # DOWNLOAD_DIR: Temporary directory for files downloaded from Telegram.
 # PUBLIC_FILES_DIR: Directory where final, processed files are stored to be served publicly.
+# Keep both on the same filesystem if you can: publishing is then a rename. Otherwise
+# downloads are written to PUBLIC_FILES_DIR/.staging instead (see storage.py).
 DOWNLOAD_DIR = os.environ.get("DOWNLOAD_DIR", "downloads")
 PUBLIC_FILES_DIR = os.environ.get("PUBLIC_FILES_DIR", "public_files")
 # Ensure directories exist
@@ -38,9 +50,48 @@ os.makedirs(PUBLIC_FILES_DIR, exist_ok=True)
 # For production, this will be your domain (e.g., http://your-domain.com/files).
 BASE_URL = os.environ.get("BASE_URL", "http://localhost:8080").rstrip('/')
 
-# LOCAL_SERVER_PORT: The port for the simple Python HTTP server for local testing.
+# LOCAL_SERVER_PORT: The port for the Python file server (local_server.py).
 LOCAL_SERVER_PORT = int(os.environ.get("LOCAL_SERVER_PORT", 8080))
 
+# Tuning for local_server.py. A rate limit of 0 means unlimited.
+FILE_SERVER_RATE_LIMIT = int(os.environ.get("FILE_SERVER_RATE_LIMIT_KBPS", 0)) * 1024  # Bytes/second per connection
+FILE_SERVER_KEEPALIVE_TIMEOUT = int(os.environ.get("FILE_SERVER_KEEPALIVE_TIMEOUT", 15))  # Seconds
+FILE_SERVER_KEEPALIVE_REQUESTS = int(os.environ.get("FILE_SERVER_KEEPALIVE_REQUESTS", 1000))
+FILE_SERVER_BACKLOG = int(os.environ.get("FILE_SERVER_BACKLOG", 1024))
+
+
+# --- Streaming Mode ---
+# When enabled, the bot replies with a link immediately instead of queueing a
+# download. stream_server.py then fetches the bytes from Telegram only when
+# someone actually requests the link (with HTTP Range support).
+STREAMING_MODE = os.environ.get("STREAMING_MODE", "False").lower() == "true"
+STREAM_SERVER_PORT = int(os.environ.get("STREAM_SERVER_PORT", 8081))
+# Public base URL of the stream server (e.g. https://your-domain.com/stream).
+STREAM_BASE_URL = os.environ.get("STREAM_BASE_URL", f"http://localhost:{STREAM_SERVER_PORT}").rstrip('/')
+STREAM_LINK_TTL_DAYS = int(os.environ.get("STREAM_LINK_TTL_DAYS", 7))
+
+
+# --- Webhook Mode ---
+# Instead of a single long-polling bot.py, run any number of stateless
+# front-ends (python webhook.py) behind a load balancer. Telegram pushes
+# updates to WEBHOOK_URL + WEBHOOK_PATH; register it once with
+# `python webhook.py --set-webhook`.
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").rstrip('/')  # Public base URL, e.g. https://bot.example.com
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram/webhook")
+# Telegram sends this in X-Telegram-Bot-Api-Secret-Token; requests without it are rejected.
+# Allowed characters: A-Z, a-z, 0-9, _ and -.
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", 8082))
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", 1))  # Front-end processes per host
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", 100))  # Concurrent deliveries from Telegram (1-100)
+# Telegram redelivers an update until it is acknowledged; each update_id is
+# processed once across all replicas within this window (seconds).
+WEBHOOK_DEDUP_TTL = int(os.environ.get("WEBHOOK_DEDUP_TTL", 86400))
+# While an update is being handled its claim only lasts this long, so if the
+# replica dies mid-update, Telegram's redelivery is handled after it expires.
+WEBHOOK_CLAIM_TTL = int(os.environ.get("WEBHOOK_CLAIM_TTL", 60))
+
 
 # --- Userbot (Telethon) Configuration ---
 # To handle forwarded messages and download large files, a userbot is required.
@@ -49,6 +100,25 @@ API_ID = os.environ.get("API_ID")
 API_HASH = os.environ.get("API_HASH")
 SESSION_NAME = os.environ.get("SESSION_NAME", "morphile_userbot") # The name for the .session file
 
+# The worker keeps its userbot clients connected between jobs instead of
+# reconnecting for every file. Each worker process claims its own copy of the
+# session file ("<SESSION_NAME>_slot<N>.session"), so TELETHON_SESSION_SLOTS
+# must be at least the number of worker processes.
+TELETHON_POOL_SIZE = int(os.environ.get("TELETHON_POOL_SIZE", 1))  # Clients per process
+TELETHON_SESSION_SLOTS = int(os.environ.get("TELETHON_SESSION_SLOTS", 16))
+TELETHON_HEALTHCHECK_INTERVAL = int(os.environ.get("TELETHON_HEALTHCHECK_INTERVAL", 60))  # Seconds
+TELETHON_HEALTHCHECK_TIMEOUT = int(os.environ.get("TELETHON_HEALTHCHECK_TIMEOUT", 10))  # Seconds
+
+# Large documents are downloaded over several connections in parallel.
+# The part size must be a multiple of 4 KB that divides 1 MB (e.g. 256, 512, 1024).
+PARALLEL_DOWNLOAD_CONNECTIONS = int(os.environ.get("PARALLEL_DOWNLOAD_CONNECTIONS", 4))
+PARALLEL_DOWNLOAD_PART_SIZE = int(os.environ.get("PARALLEL_DOWNLOAD_PART_SIZE_KB", 1024)) * 1024
+PARALLEL_DOWNLOAD_PART_RETRIES = int(os.environ.get("PARALLEL_DOWNLOAD_PART_RETRIES", 5))
+PARALLEL_DOWNLOAD_MIN_SIZE = int(os.environ.get("PARALLEL_DOWNLOAD_MIN_SIZE_MB", 10)) * 1024 * 1024
+# Interrupted downloads stay in the download directory so a retry can resume them.
+# The daily cleanup deletes partials that have not progressed for this long.
+PARTIAL_DOWNLOAD_MAX_AGE = int(os.environ.get("PARTIAL_DOWNLOAD_MAX_AGE_HOURS", 24)) * 3600  # Seconds
+
 # Check for required userbot variables
 if not all([API_ID, API_HASH]):
     print("Warning: API_ID and API_HASH are not set in the environment. The bot will not be able to handle forwarded files.")
@@ -105,4 +175,146 @@ LOCAL_TEST_MODE = os.environ.get('LOCAL_TEST_MODE', 'False').lower() == 'true'
 # --- Job Queue (Redis) ---
 # Connection settings for the Redis server used by Dramatiq for background tasks.
 REDIS_HOST = os.environ.get("REDIS_HOST", "127.0.0.1")
-REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
\ No newline at end of file
+REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
+
+
+# --- Worker Runtime ---
+# Each worker process runs jobs on one long-lived event loop with a shared
+# telegram.Bot, so connections to the Bot API are reused across jobs.
+WORKER_BOT_POOL_SIZE = int(os.environ.get("WORKER_BOT_POOL_SIZE", 16))  # HTTP connections per worker process
+WORKER_BOT_HTTP_VERSION = os.environ.get("WORKER_BOT_HTTP_VERSION", "2")  # "2" (multiplexed) or "1.1"
+# async_worker.py runs jobs as coroutines instead of threads, so one process
+# can keep many I/O-bound downloads in flight.
+ASYNC_WORKER_CONCURRENCY = int(os.environ.get("ASYNC_WORKER_CONCURRENCY", 32))  # Jobs in flight per process
+ASYNC_WORKER_SHUTDOWN_GRACE = int(os.environ.get("ASYNC_WORKER_SHUTDOWN_GRACE", 30))  # Seconds; unfinished jobs are requeued
+
+
+# --- Bot API Server ---
+# BOT_API_SERVER: a self-hosted telegram-bot-api server (e.g. http://localhost:8090)
+# used by the bot and workers instead of api.telegram.org. Started with --local,
+# it lets bots download files of up to 2 GB instead of 20 MB. Set
+# BOT_API_LOCAL_MODE=True in that case: the server then returns files as paths
+# on its own disk, which workers must see at the same path, and they are
+# hardlinked into the blob store instead of downloaded over HTTP.
+BOT_API_SERVER = os.environ.get("BOT_API_SERVER", "").rstrip("/")
+BOT_API_LOCAL_MODE = os.environ.get("BOT_API_LOCAL_MODE", "False").lower() == "true"
+BOT_API_BASE_URL = f"{BOT_API_SERVER}/bot" if BOT_API_SERVER else None
+BOT_API_BASE_FILE_URL = f"{BOT_API_SERVER}/file/bot" if BOT_API_SERVER else None
+# Largest file the bot can fetch through getFile.
+BOT_API_DOWNLOAD_LIMIT = MAX_FILE_SIZE if BOT_API_LOCAL_MODE else 20 * 1024 * 1024
+# In local mode getFile only answers once the server has fetched the whole file from Telegram.
+BOT_API_GET_FILE_TIMEOUT = int(os.environ.get("BOT_API_GET_FILE_TIMEOUT", 3600 if BOT_API_LOCAL_MODE else 30))  # Seconds
+
+
+# --- Progress Reporting ---
+# Downloads update the user's status message at most once per interval.
+PROGRESS_INTERVAL = float(os.environ.get("PROGRESS_INTERVAL", 5))  # Seconds; 0 disables progress
+# A token bucket in Redis, shared by all processes, keeps progress edits
+# under Telegram's limit of roughly 30 requests per second per bot, with
+# headroom left for the bot's other requests.
+TELEGRAM_RATE_LIMIT = float(os.environ.get("TELEGRAM_RATE_LIMIT", 20))  # Requests per second
+TELEGRAM_RATE_BURST = int(os.environ.get("TELEGRAM_RATE_BURST", 5))
+
+
+# --- Broadcasts ---
+# broadcast.py sends at most BROADCAST_RATE_LIMIT messages per second (Telegram
+# allows about 30 to different users), with up to BROADCAST_CONCURRENCY in
+# flight, and checkpoints its progress every BROADCAST_CHECKPOINT_INTERVAL seconds.
+BROADCAST_RATE_LIMIT = float(os.environ.get("BROADCAST_RATE_LIMIT", 25))  # Messages per second
+BROADCAST_RATE_BURST = int(os.environ.get("BROADCAST_RATE_BURST", 5))
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", 32))
+BROADCAST_PAGE_SIZE = int(os.environ.get("BROADCAST_PAGE_SIZE", 1000))  # Users read from MongoDB at a time
+BROADCAST_CHECKPOINT_INTERVAL = float(os.environ.get("BROADCAST_CHECKPOINT_INTERVAL", 2))  # Seconds
+
+
+# --- Job Queues ---
+# Premium and free jobs go to separate Dramatiq queues ("premium", "free");
+# workers pick premium jobs first. With FAIR_QUEUE_ENABLED, jobs are also
+# released round-robin across users of a tier (see fair_queue.py).
+FAIR_QUEUE_ENABLED = os.environ.get("FAIR_QUEUE_ENABLED", "True").lower() == "true"
+# How many jobs each tier may have queued or running in Dramatiq at once.
+# Together these should roughly match total worker concurrency
+# (processes x threads); their ratio is how capacity is split between tiers.
+FAIR_QUEUE_PREMIUM_SLOTS = int(os.environ.get("FAIR_QUEUE_PREMIUM_SLOTS", 12))
+FAIR_QUEUE_FREE_SLOTS = int(os.environ.get("FAIR_QUEUE_FREE_SLOTS", 4))
+# Let a tier use the other tier's idle slots while nothing of theirs is waiting.
+FAIR_QUEUE_BORROW = os.environ.get("FAIR_QUEUE_BORROW", "True").lower() == "true"
+FAIR_QUEUE_USER_CAP = int(os.environ.get("FAIR_QUEUE_USER_CAP", 2))  # Jobs in flight per user
+# A released job that has not finished after this long (e.g. its worker died) gives its slot back.
+FAIR_QUEUE_JOB_TIMEOUT = int(os.environ.get("FAIR_QUEUE_JOB_TIMEOUT", 3 * 3600))  # Seconds
+FAIR_QUEUE_WAIT_SAMPLES = int(os.environ.get("FAIR_QUEUE_WAIT_SAMPLES", 1000))  # Queue-wait samples kept per tier
+
+
+# --- Job Metrics ---
+# metrics.py keeps this many recent timing samples per metric (e.g. publish
+# latency) in Redis and reports percentiles over them.
+METRICS_SAMPLES = int(os.environ.get("METRICS_SAMPLES", 1000))
+# Histogram observations are added to Redis in one batch per process this often.
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))  # Seconds
+# Prometheus endpoints (/metrics). Workers serve it from whichever process binds
+# the port first and the polling bot from its own port; a port of 0 disables
+# the endpoint. With METRICS_ON_PUBLIC_SERVERS, webhook.py and local_server.py
+# also serve /metrics on their public ports, without authentication.
+METRICS_HOST = os.environ.get("METRICS_HOST", "0.0.0.0")
+METRICS_WORKER_PORT = int(os.environ.get("METRICS_WORKER_PORT", 9191))
+METRICS_BOT_PORT = int(os.environ.get("METRICS_BOT_PORT", 9192))
+METRICS_ON_PUBLIC_SERVERS = os.environ.get("METRICS_ON_PUBLIC_SERVERS", "False").lower() == "true"
+
+
+# --- Daily Quota ---
+# Each file's size is reserved against the daily limit before it is queued,
+# then committed when the job succeeds or refunded when it fails.
+# "redis": one atomic Lua call per file (recommended under load).
+# "mongo": a conditional update on the user document.
+QUOTA_BACKEND = os.environ.get("QUOTA_BACKEND", "redis").lower()
+
+
+# --- User Cache ---
+# get_user serves recently seen users from memory. Writes invalidate entries,
+# and with USER_CACHE_PUBSUB the invalidations are broadcast over Redis so
+# every process (bot, workers, admin CLI, cleanup) stays consistent.
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))  # Max cached users per process
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 60))  # Seconds
+USER_CACHE_PUBSUB = os.environ.get("USER_CACHE_PUBSUB", "True").lower() == "true"
+
+
+# --- Disk Admission ---
+# Before downloading, a job reserves its file's size on the filesystems of the
+# download and public directories (admission.py). A job that doesn't fit is
+# put back in the queue with a delay instead of failing when the disk fills.
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "True").lower() == "true"
+ADMISSION_DISK_MARGIN = int(os.environ.get("ADMISSION_DISK_MARGIN_MB", 1024)) * 1024 * 1024  # Always left free
+ADMISSION_RETRY_MIN = int(os.environ.get("ADMISSION_RETRY_MIN", 30))  # Seconds before a deferred job tries again
+ADMISSION_RETRY_MAX = int(os.environ.get("ADMISSION_RETRY_MAX", 600))
+ADMISSION_MAX_WAIT = int(os.environ.get("ADMISSION_MAX_WAIT_HOURS", 6)) * 3600  # Then the job fails and is refunded
+# A reservation whose job has not finished after this long (e.g. its worker died) is dropped.
+ADMISSION_LEASE = int(os.environ.get("ADMISSION_LEASE", 3 * 3600))  # Seconds
+# Assumed download speed per job; only used to estimate waits for users.
+ADMISSION_ESTIMATED_SPEED = float(os.environ.get("ADMISSION_ESTIMATED_SPEED_MB", 10)) * 1024 * 1024
+
+# --- File Expiry ---
+# Every published file expires this many days after it was sent, depending on
+# the sender's tier at the time (0 keeps files forever). reaper.py deletes
+# expired files incrementally: at most FILE_REAPER_MAX_PER_RUN per run, in
+# batches with a pause in between so it never hogs the disk.
+FILE_TTL_FREE_DAYS = float(os.environ.get("FILE_TTL_FREE_DAYS", 7))
+FILE_TTL_PREMIUM_DAYS = float(os.environ.get("FILE_TTL_PREMIUM_DAYS", 30))
+FILE_REAPER_INTERVAL = int(os.environ.get("FILE_REAPER_INTERVAL", 300))  # Seconds between runs
+FILE_REAPER_BATCH_SIZE = int(os.environ.get("FILE_REAPER_BATCH_SIZE", 200))
+FILE_REAPER_BATCH_PAUSE = float(os.environ.get("FILE_REAPER_BATCH_PAUSE", 0.5))  # Seconds
+FILE_REAPER_MAX_PER_RUN = int(os.environ.get("FILE_REAPER_MAX_PER_RUN", 10000))
+
+# --- Premium Expiry ---
+# The bot downgrades expired premium users every PREMIUM_EXPIRY_INTERVAL
+# seconds, so a plan ends within a minute of its expiry instead of at the
+# next cleanup.py run. Users are updated PREMIUM_EXPIRY_BATCH_SIZE at a time.
+PREMIUM_EXPIRY_INTERVAL = int(os.environ.get("PREMIUM_EXPIRY_INTERVAL", 60))  # Seconds; 0 disables the schedule
+PREMIUM_EXPIRY_BATCH_SIZE = int(os.environ.get("PREMIUM_EXPIRY_BATCH_SIZE", 1000))
+
+# --- Statistics ---
+# The admin statistics are counters kept up to date by every write. Every
+# STATS_RECONCILE_INTERVAL seconds one bot replica recounts them from the
+# users collection, corrects any drift and saves a snapshot to the history,
+# which is kept for STATS_HISTORY_DAYS days.
+STATS_RECONCILE_INTERVAL = int(os.environ.get("STATS_RECONCILE_INTERVAL", 3600))  # Seconds; 0 disables the schedule
+STATS_HISTORY_DAYS = int(os.environ.get("STATS_HISTORY_DAYS", 365))
@@ -1,14 +1,25 @@
 # database.py
-from pymongo import MongoClient, ASCENDING
+from pymongo import MongoClient, ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime, timedelta
 import config
 import logging
+import time
+import metrics
+import user_cache
 
 # --- Database Connection ---
 # The connection is established based on the MONGO_URI from the config.
 # A log message indicates whether a local or remote (Atlas) DB is used.
 logging.info("Initializing database connection...")
-client = MongoClient(config.MONGO_URI)
+client = MongoClient(
+    config.MONGO_URI,
+    maxPoolSize=config.MONGO_MAX_POOL_SIZE,
+    minPoolSize=config.MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=config.MONGO_MAX_IDLE_TIME_MS,
+    waitQueueTimeoutMS=config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    serverSelectionTimeoutMS=config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+)
 db = client[config.DATABASE_NAME]
 users = db.users
 
@@ -25,13 +36,50 @@ except Exception as e:
     logging.error(f"MongoDB connection failed: {e}")
 payments = db.payments
 pending_payments = db.pending_payments
+blobs = db.blobs
+files = db.files
+streams = db.streams
+broadcasts = db.broadcasts
+stats = db.stats
+stats_history = db.stats_history
 
 # --- Database Indexing ---
 # Create an index on user_id for faster lookups.
 users.create_index([("user_id", ASCENDING)], unique=True)
+# Lets check_premium_status find expired plans without a collection scan.
+users.create_index([("is_premium", ASCENDING), ("premium_expires", ASCENDING)])
 pending_payments.create_index([("authority", ASCENDING)], unique=True)
+# Blobs are keyed by their SHA-256 (_id); every Telegram file_unique_id seen
+# for a blob is kept in an indexed array so repeat uploads skip the download.
+blobs.create_index([("file_unique_ids", ASCENDING)])
+blobs.create_index([("refcount", ASCENDING)])
+# Public files are keyed by their random id (_id); the path is derived from it.
+files.create_index([("owner", ASCENDING)])
+files.create_index([("blob", ASCENDING)])
+files.create_index([("expires_at", ASCENDING)])
+# Streaming links are only kept for STREAM_LINK_TTL_DAYS.
+streams.create_index([("created_at", ASCENDING)], expireAfterSeconds=config.STREAM_LINK_TTL_DAYS * 86400)
+# Statistics snapshots are only kept for STATS_HISTORY_DAYS.
+stats_history.create_index([("at", ASCENDING)], expireAfterSeconds=config.STATS_HISTORY_DAYS * 86400)
 
 def get_user(user_id):
+    """
+    Fetches a user, serving hot users from the in-process user cache.
+    On a miss, the user is loaded (and created if needed) by `_load_user`.
+    """
+    user = user_cache.cache.get(user_id)
+    if user is not None:
+        return user
+    return load_user(user_id)
+
+def load_user(user_id):
+    """Reads a user from MongoDB (creating it if needed) and caches the result."""
+    generation = user_cache.cache.generation()
+    user = _load_user(user_id)
+    user_cache.cache.put(user_id, user, generation)
+    return user
+
+def _load_user(user_id):
     """
     Fetches a user from the database.
     - If the user doesn't exist, it creates a new free user.
@@ -52,129 +100,296 @@ def get_user(user_id):
         if user:
             # If user exists but is not premium, upgrade them
             if not user.get('is_premium'):
-                users.update_one(
+                user = users.find_one_and_update(
                     {"user_id": user_id},
-                    {"$set": permanent_premium_status}
+                    {"$set": permanent_premium_status},
+                    return_document=ReturnDocument.AFTER
                 )
+                _count_users(premium=1)
                 logging.info(f"Upgraded user {user_id} to permanent premium via manual list.")
-        else:
-            # If user does not exist, create them as a premium user
-            user = {
-                "user_id": user_id,
-                "daily_usage": 0,
-                "last_reset_day": datetime.utcnow(),
-                "created_at": datetime.utcnow(),
-                **permanent_premium_status
-            }
-            users.insert_one(user)
-            logging.info(f"Created new permanent premium user {user_id} via manual list.")
-
-        # Fetch the latest user data to return
-        return users.find_one({"user_id": user_id})
+            return user
+
+        # If user does not exist, create them as a premium user
+        user = _insert_user({
+            "user_id": user_id,
+            "daily_usage": 0,
+            "usage_day": utc_day(),
+            "last_reset_day": datetime.utcnow(),
+            "created_at": datetime.utcnow(),
+            **permanent_premium_status
+        })
+        logging.info(f"Created new permanent premium user {user_id} via manual list.")
+        return user
 
     # --- Standard User Logic ---
     user = users.find_one({"user_id": user_id})
     if not user:
-        user = {
+        user = _insert_user({
             "user_id": user_id,
             "is_premium": False,
             "premium_expires": None,
             "daily_usage": 0,
+            "usage_day": utc_day(),
             "daily_limit_bytes": config.FREE_DAILY_LIMIT,
             "last_reset_day": datetime.utcnow(),
             "created_at": datetime.utcnow()
-        }
-        users.insert_one(user)
+        })
 
     return user
 
-def update_usage(user_id, added_bytes):
-    """Updates a user's daily usage and returns their new total usage."""
-    # The daily reset is now handled by the cleanup.py script.
-    # This function now only increments the usage.
+def _insert_user(user):
+    """Inserts a new user, returning the existing one if a concurrent request created it first."""
+    try:
+        users.insert_one(user)
+        _count_users(total=1, premium=1 if user.get("is_premium") else 0)
+        return user
+    except DuplicateKeyError:
+        return users.find_one({"user_id": user["user_id"]})
+
+# --- Daily Usage ---
+# Usage is counted per UTC day without a nightly reset: `daily_usage` only
+# counts while `usage_day` is today, and the first charge on a new day starts
+# it again from zero. Users stored before `usage_day` existed fall back to
+# the day of their `last_reset_day`.
+_USAGE_DAY = {"$ifNull": ["$usage_day", {"$dateToString": {"format": "%Y-%m-%d", "date": "$last_reset_day"}}]}
+
+def utc_day(when=None):
+    """Returns the UTC day usage is counted under, as 'YYYY-MM-DD'."""
+    return (when or datetime.utcnow()).strftime("%Y-%m-%d")
+
+def _stored_usage_day(user):
+    """The day a user document's `daily_usage` counts for, like `_USAGE_DAY`."""
+    day = user.get("usage_day")
+    if day is None and user.get("last_reset_day"):
+        day = utc_day(user["last_reset_day"])
+    return day
+
+def current_usage(user):
+    """Returns the bytes a user document has used today; usage from an earlier day counts as zero."""
+    return user.get("daily_usage", 0) if _stored_usage_day(user) == utc_day() else 0
+
+def _usage_on(day):
+    """Aggregation expression for a user's usage on ``day``."""
+    return {"$cond": [{"$eq": [_USAGE_DAY, day]}, "$daily_usage", 0]}
+
+def update_usage(user_id, added_bytes, day=None):
+    """
+    Adds ``added_bytes`` to a user's usage on ``day`` (default today) and
+    returns their usage. Bytes for a day older than the stored one are
+    dropped; a newer day replaces the stored usage.
+    """
+    day = day or utc_day()
     result = users.find_one_and_update(
         {"user_id": user_id},
-        {"$inc": {"daily_usage": added_bytes}},
-        return_document=True
+        [{"$set": {
+            "daily_usage": {"$cond": [
+                {"$lt": [_USAGE_DAY, day]}, added_bytes,
+                {"$add": ["$daily_usage", {"$cond": [{"$eq": [_USAGE_DAY, day]}, added_bytes, 0]}]},
+            ]},
+            "usage_day": {"$max": [_USAGE_DAY, day]},
+        }}],
+        return_document=ReturnDocument.AFTER
     )
+    if result:
+        _count_usage(day, added_bytes)
+    user_cache.cache.invalidate(user_id)
     return result['daily_usage'] if result else 0
 
+def reserve_usage(user_id, added_bytes, day=None):
+    """
+    Atomically charges ``added_bytes`` to a user's usage on ``day`` (default
+    today) if it fits within their limit. Returns the updated user, or None
+    if it does not fit.
+    """
+    today = day or utc_day()
+    result = users.find_one_and_update(
+        {
+            "user_id": user_id,
+            "$expr": {"$lte": [{"$add": [_usage_on(today), added_bytes]}, "$daily_limit_bytes"]},
+        },
+        [{"$set": {"daily_usage": {"$add": [_usage_on(today), added_bytes]}, "usage_day": today}}],
+        return_document=ReturnDocument.AFTER
+    )
+    if result:
+        _count_usage(today, added_bytes)
+        user_cache.cache.invalidate(user_id)
+    return result
+
+def refund_usage(user_id, refunded_bytes, day=None):
+    """
+    Gives back bytes charged by `reserve_usage` on ``day`` (default today),
+    never taking usage below zero. A refund for an earlier day is a no-op.
+    """
+    day = day or utc_day()
+    before = users.find_one_and_update(
+        {"user_id": user_id},
+        [{"$set": {"daily_usage": {"$cond": [
+            {"$eq": [_USAGE_DAY, day]},
+            {"$max": [0, {"$subtract": ["$daily_usage", refunded_bytes]}]},
+            "$daily_usage",
+        ]}}}],
+        projection={"daily_usage": 1, "usage_day": 1, "last_reset_day": 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    if before and _stored_usage_day(before) == day:
+        _count_usage(day, -min(refunded_bytes, before.get("daily_usage", 0)))
+    user_cache.cache.invalidate(user_id)
+
 def set_premium(user_id, duration_days, limit_bytes):
     """Grants premium status to a user with a specified duration and daily limit."""
     expires = datetime.utcnow() + timedelta(days=duration_days)
-    users.update_one(
+    before = users.find_one_and_update(
         {"user_id": user_id},
         {"$set": {
             "is_premium": True,
             "premium_expires": expires,
             "daily_limit_bytes": limit_bytes,
             "daily_usage": 0,  # Reset usage on upgrade
+            "usage_day": utc_day(),
             "last_reset_day": datetime.utcnow()
-        }}
+        }},
+        projection={"is_premium": 1, "daily_usage": 1, "usage_day": 1, "last_reset_day": 1}
     )
+    if before:
+        if not before.get("is_premium"):
+            _count_users(premium=1)
+        _count_usage(utc_day(), -current_usage(before))
+    user_cache.cache.invalidate(user_id)
 
-def check_premium_status():
+def check_premium_status(batch_size=None):
     """
-    Scans for expired premium users and reverts them to free users.
-    This is intended to be run periodically by a cleanup script.
+    Reverts expired premium users to free users and returns how many.
+
+    Expired users are found through the (is_premium, premium_expires) index
+    and downgraded with one update_many per batch instead of one update per
+    user. Runs every PREMIUM_EXPIRY_INTERVAL seconds in the bot (see bot.py)
+    and once a day from the cleanup script.
     """
-    now = datetime.utcnow()
-    expired_users = users.find({
-        "is_premium": True,
-        "premium_expires": {"$lt": now}
-    })
+    batch_size = batch_size or config.PREMIUM_EXPIRY_BATCH_SIZE
+    started = time.perf_counter()
+    expired = {"is_premium": True, "premium_expires": {"$lt": datetime.utcnow()}}
 
     count = 0
-    for user in expired_users:
-        users.update_one(
-            {"_id": user["_id"]},
+    while True:
+        user_ids = [user["user_id"] for user in users.find(expired, {"user_id": 1, "_id": 0}).limit(batch_size)]
+        if not user_ids:
+            break
+        result = users.update_many(
+            {**expired, "user_id": {"$in": user_ids}},
             {"$set": {
                 "is_premium": False,
                 "premium_expires": None,
                 "daily_limit_bytes": config.FREE_DAILY_LIMIT
             }}
         )
-        count += 1
+        user_cache.cache.invalidate_many(user_ids)
+        _count_users(premium=-result.modified_count)
+        count += result.modified_count
+        if len(user_ids) < batch_size:
+            break
+
+    elapsed = time.perf_counter() - started
+    metrics.record("premium_expiry", elapsed)
+    metrics.incr("premium_expiry", "users_downgraded", count)
+    if count:
+        logging.info(f"Downgraded {count} expired premium users in {elapsed * 1000:.0f} ms.")
     return count
 
 def get_all_users():
     """Returns a cursor for all users in the database."""
     return users.find()
 
-def reset_all_daily_usage():
-    """Resets the daily_usage for all users to 0."""
-    result = users.update_many({}, {"$set": {"daily_usage": 0, "last_reset_day": datetime.utcnow()}})
-    return result.modified_count
-
 def revoke_premium(user_id):
     """Revokes premium status from a user, reverting them to the free plan."""
-    users.update_one(
+    before = users.find_one_and_update(
         {"user_id": user_id},
         {"$set": {
             "is_premium": False,
             "premium_expires": None,
             "daily_limit_bytes": config.FREE_DAILY_LIMIT
-        }}
+        }},
+        projection={"is_premium": 1}
     )
+    if before and before.get("is_premium"):
+        _count_users(premium=-1)
+    user_cache.cache.invalidate(user_id)
+
+# --- Statistics ---
+# Totals are counters in the `stats` collection, $inc'ed by the writes that
+# change them, so reading them is one lookup instead of scanning users.
+# `reconcile_statistics` recounts them from the users collection now and
+# then and corrects any drift, e.g. from a process that died between a user
+# update and its counter update.
+_USER_TOTALS = "users"
+
+def _usage_stats_id(day):
+    return f"usage:{day}"
+
+def _count_users(total=0, premium=0):
+    if total or premium:
+        stats.update_one({"_id": _USER_TOTALS}, {"$inc": {"total": total, "premium": premium}}, upsert=True)
+
+def _count_usage(day, nbytes):
+    if nbytes:
+        stats.update_one({"_id": _usage_stats_id(day)}, {"$inc": {"bytes": nbytes}}, upsert=True)
 
 def get_db_statistics():
-    """Returns a dictionary with database statistics."""
+    """Returns a dictionary with database statistics, read from the counters."""
+    day = utc_day()
+    counters = {doc["_id"]: doc for doc in stats.find({"_id": {"$in": [_USER_TOTALS, _usage_stats_id(day)]}})}
+    if _USER_TOTALS not in counters:
+        # First read after an upgrade: nothing has been counted yet.
+        return reconcile_statistics()
+    return {
+        "total_users": counters[_USER_TOTALS].get("total", 0),
+        "premium_users": counters[_USER_TOTALS].get("premium", 0),
+        "total_daily_usage_bytes": counters.get(_usage_stats_id(day), {}).get("bytes", 0),
+    }
+
+def reconcile_statistics():
+    """
+    Recounts the statistics from the users collection, overwrites the
+    counters with the result and returns it. This scans every user, so it
+    only runs every STATS_RECONCILE_INTERVAL seconds (see bot.py).
+    """
+    day = utc_day()
+    started = time.perf_counter()
     total_users = users.count_documents({})
     premium_users = users.count_documents({"is_premium": True})
 
-    # To get total usage, we need to aggregate the daily_usage field
+    # To get total usage, we need to aggregate today's daily_usage fields
     pipeline = [
+        {"$match": {"usage_day": day}},
         {"$group": {"_id": None, "total_usage": {"$sum": "$daily_usage"}}}
     ]
     result = list(users.aggregate(pipeline))
     total_daily_usage = result[0]['total_usage'] if result else 0
 
+    before = stats.find_one_and_update(
+        {"_id": _USER_TOTALS}, {"$set": {"total": total_users, "premium": premium_users}}, upsert=True
+    )
+    stats.update_one({"_id": _usage_stats_id(day)}, {"$set": {"bytes": total_daily_usage}}, upsert=True)
+    if before and (before.get("total"), before.get("premium")) != (total_users, premium_users):
+        logging.warning(f"Corrected user counters from {before.get('total')} total/{before.get('premium')} premium "
+                        f"to {total_users}/{premium_users}.")
+    metrics.record("stats_reconcile", time.perf_counter() - started)
+
     return {
         "total_users": total_users,
         "premium_users": premium_users,
         "total_daily_usage_bytes": total_daily_usage,
     }
 
+def save_statistics_snapshot(statistics=None):
+    """Stores the current statistics (or ``statistics``) in the history and returns the snapshot."""
+    snapshot = {"at": datetime.utcnow(), **(statistics or get_db_statistics())}
+    stats_history.insert_one(snapshot)
+    return snapshot
+
+def get_statistics_history(since: datetime, limit: int = 0):
+    """Returns up to ``limit`` (0 for all) snapshots taken since ``since``, oldest first."""
+    return list(stats_history.find({"at": {"$gte": since}}, {"_id": 0}).sort("at", ASCENDING).limit(limit))
+
 def create_pending_payment(authority: str, user_id: int, plan: str, amount: int):
     """Stores a pending payment authority from Zarinpal."""
     pending_payments.insert_one({
@@ -187,4 +402,196 @@ def create_pending_payment(authority: str, user_id: int, plan: str, amount: int)
 
 def get_and_delete_pending_payment(authority: str):
     """Retrieves and deletes a pending payment, ensuring it's used only once."""
-    return pending_payments.find_one_and_delete({"authority": authority})
\ No newline at end of file
+    return pending_payments.find_one_and_delete({"authority": authority})
+
+# --- Deduplicated File Blobs ---
+def find_blob_by_unique_id(file_unique_id: str):
+    """Returns the blob previously stored for a Telegram file_unique_id, if any."""
+    return blobs.find_one({"file_unique_ids": file_unique_id})
+
+def find_blob(sha256: str):
+    """Returns the blob with the given content hash, if any."""
+    return blobs.find_one({"_id": sha256})
+
+def create_blob(sha256: str, path: str, size: int, filename: str, file_unique_id: str = None):
+    """
+    Records a newly stored blob with no references yet.
+    If another worker stored the same content first, its blob is returned instead.
+    """
+    blob = {
+        "_id": sha256,
+        "path": path,
+        "size": size,
+        "filename": filename,
+        "file_unique_ids": [file_unique_id] if file_unique_id else [],
+        "refcount": 0,
+        "aliases": [],
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+    }
+    try:
+        blobs.insert_one(blob)
+        return blob
+    except DuplicateKeyError:
+        return add_blob_unique_id(sha256, file_unique_id)
+
+def add_blob_unique_id(sha256: str, file_unique_id: str = None):
+    """Associates another file_unique_id with an existing blob and returns it."""
+    update = {"$set": {"updated_at": datetime.utcnow()}}
+    if file_unique_id:
+        update["$addToSet"] = {"file_unique_ids": file_unique_id}
+    return blobs.find_one_and_update({"_id": sha256}, update, return_document=ReturnDocument.AFTER)
+
+def add_blob_reference(sha256: str, alias: str):
+    """Registers a public alias (hardlink) of a blob and increments its refcount."""
+    blobs.update_one(
+        {"_id": sha256},
+        {"$inc": {"refcount": 1}, "$addToSet": {"aliases": alias}, "$set": {"updated_at": datetime.utcnow()}}
+    )
+
+def release_blob_reference(sha256: str, alias: str):
+    """Drops a public alias of a blob and returns the updated blob document."""
+    return blobs.find_one_and_update(
+        {"_id": sha256, "aliases": alias},
+        {"$inc": {"refcount": -1}, "$pull": {"aliases": alias}, "$set": {"updated_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+
+def replace_blob_alias(sha256: str, old_alias: str, new_alias: str):
+    """Renames a public alias of a blob, keeping its refcount."""
+    blobs.update_one({"_id": sha256, "aliases": old_alias}, {"$addToSet": {"aliases": new_alias}})
+    blobs.update_one({"_id": sha256, "aliases": new_alias}, {"$pull": {"aliases": old_alias}})
+
+def find_blob_by_alias(alias: str):
+    """Returns the blob a public alias points to, if any."""
+    return blobs.find_one({"aliases": alias})
+
+def release_blob_references(references):
+    """Drops many (sha256, alias) references at once, like `release_blob_reference`."""
+    if not references:
+        return
+    now = datetime.utcnow()
+    blobs.bulk_write([
+        UpdateOne({"_id": sha256, "aliases": alias},
+                  {"$inc": {"refcount": -1}, "$pull": {"aliases": alias}, "$set": {"updated_at": now}})
+        for sha256, alias in references
+    ], ordered=False)
+
+def get_unreferenced_blobs(idle_for: timedelta, limit: int = 0):
+    """
+    Returns a cursor of blobs that no public alias has pointed to for at least
+    `idle_for`. The grace period keeps freshly ingested blobs safe until linked.
+    """
+    cutoff = datetime.utcnow() - idle_for
+    return blobs.find({"refcount": {"$lte": 0}, "updated_at": {"$lt": cutoff}}, limit=limit)
+
+def delete_blob(sha256: str, idle_for: timedelta):
+    """Deletes a blob record, but only if it is still unreferenced and idle."""
+    cutoff = datetime.utcnow() - idle_for
+    result = blobs.delete_one({"_id": sha256, "refcount": {"$lte": 0}, "updated_at": {"$lt": cutoff}})
+    return result.deleted_count
+
+# --- Public Files ---
+def create_file(file_id: str, path: str, filename: str, size: int, owner: int = None,
+                blob: str = None, expires_at: datetime = None):
+    """Records a public file; ``path`` is relative to PUBLIC_FILES_DIR, ``blob`` its content hash."""
+    file = {
+        "_id": file_id,
+        "path": path,
+        "filename": filename,
+        "size": size,
+        "owner": owner,
+        "blob": blob,
+        "expires_at": expires_at,
+        "created_at": datetime.utcnow(),
+    }
+    files.insert_one(file)
+    return file
+
+def find_file(file_id: str):
+    """Returns the public file with the given id, if any."""
+    return files.find_one({"_id": file_id})
+
+def delete_file(file_id: str):
+    """Deletes a public file record. Returns whether it existed."""
+    return files.delete_one({"_id": file_id}).deleted_count
+
+def get_expired_files(now: datetime, limit: int):
+    """Returns up to `limit` public files whose expiry has passed, oldest first (uses the expires_at index)."""
+    return files.find({"expires_at": {"$lte": now}}, sort=[("expires_at", ASCENDING)], limit=limit)
+
+def delete_files(file_ids):
+    """Deletes many public file records. Returns how many existed."""
+    return files.delete_many({"_id": {"$in": list(file_ids)}}).deleted_count
+
+# --- Streaming Links ---
+def create_stream(token: str, chat_id: int, message_id: int, file_id: str, is_forwarded: bool,
+                  file_name: str, file_size: int, mime_type: str = None):
+    """Records everything the stream server needs to fetch a file from Telegram on demand."""
+    streams.insert_one({
+        "_id": token,
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "file_id": file_id,
+        "is_forwarded": is_forwarded,
+        "file_name": file_name,
+        "file_size": file_size,
+        "mime_type": mime_type,
+        "created_at": datetime.utcnow(),
+    })
+
+def get_stream(token: str):
+    """Returns the streaming link with the given token, if it exists and hasn't expired."""
+    return streams.find_one({"_id": token})
+
+# --- Broadcasts ---
+def create_broadcast(text: str):
+    """Records a new broadcast that has not reached anyone yet and returns it."""
+    broadcast = {
+        "text": text,
+        "last_user_id": None,  # Every user up to and including this one has been handled
+        "sent": 0,
+        "failed": 0,
+        "blocked": 0,
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+        "finished_at": None,
+    }
+    broadcast["_id"] = broadcasts.insert_one(broadcast).inserted_id
+    return broadcast
+
+def get_broadcast(broadcast_id):
+    return broadcasts.find_one({"_id": broadcast_id})
+
+def get_unfinished_broadcast():
+    """Returns the most recent broadcast that has not finished, if any."""
+    return broadcasts.find_one({"finished_at": None}, sort=[("created_at", -1)])
+
+def save_broadcast_progress(broadcast_id, last_user_id, sent: int, failed: int, blocked: int, finished: bool = False):
+    update = {"last_user_id": last_user_id, "sent": sent, "failed": failed, "blocked": blocked,
+              "updated_at": datetime.utcnow()}
+    if finished:
+        update["finished_at"] = datetime.utcnow()
+    broadcasts.update_one({"_id": broadcast_id}, {"$set": update})
+
+def count_users():
+    """Returns the approximate number of users, from collection metadata rather than a scan."""
+    return users.estimated_document_count()
+
+def get_broadcast_recipients(after_user_id, limit: int):
+    """
+    Returns the next ``limit`` user ids after ``after_user_id`` (None to start
+    at the beginning), in order, skipping users who blocked the bot.
+    """
+    query = {"blocked": {"$ne": True}}
+    if after_user_id is not None:
+        query["user_id"] = {"$gt": after_user_id}
+    cursor = users.find(query, {"user_id": 1, "_id": 0}).sort("user_id", ASCENDING).limit(limit)
+    return [user["user_id"] for user in cursor]
+
+def mark_users_blocked(user_ids, blocked: bool = True):
+    """Flags users who blocked the bot (or clears the flag) so broadcasts skip them."""
+    if not user_ids:
+        return
+    users.update_many({"user_id": {"$in": list(user_ids)}}, {"$set": {"blocked": blocked}})
+    user_cache.cache.invalidate_many(user_ids)
@@ -0,0 +1,285 @@
+# fair_queue.py
+"""
+Per-user fair-share scheduling in front of the Dramatiq queues.
+
+Jobs are split into two tiers, premium and free, each with its own Dramatiq
+queue. With fair sharing on (config.FAIR_QUEUE_ENABLED), a job is not sent
+to Dramatiq straight away. It waits in its owner's list in Redis, and a
+dispatcher releases jobs round-robin across the users of a tier, so one
+user's 50 files interleave with everyone else's instead of queueing ahead
+of them. A user never has more than FAIR_QUEUE_USER_CAP jobs in flight, and
+a tier never has more than its slot count released at once. The slot
+counts set how worker capacity is shared between the tiers; with
+FAIR_QUEUE_BORROW a tier may also use the other tier's idle slots while
+the other tier has nothing waiting.
+
+Dispatch runs when a job is submitted, when one finishes and periodically
+in every worker. Each run is a single Lua script, so bot front-ends and
+workers can dispatch concurrently without releasing a job twice. In-flight
+jobs carry a deadline, so a worker that dies mid-job frees its slot once
+the deadline passes.
+
+FairShareMiddleware also samples how long each job waited before a worker
+picked it up; `queue_wait_percentiles` reports them per tier, and the
+queue_wait_seconds histogram in metrics.py keeps them for Prometheus.
+"""
+import logging
+import threading
+import time
+
+import dramatiq
+import redis
+from dramatiq.middleware import Retries
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PREMIUM = "premium"
+FREE = "free"
+TIERS = (PREMIUM, FREE)
+
+_SLOTS = {PREMIUM: config.FAIR_QUEUE_PREMIUM_SLOTS, FREE: config.FAIR_QUEUE_FREE_SLOTS}
+_DISPATCH_INTERVAL = 30  # Seconds between periodic dispatches in each worker
+
+# KEYS[1] = user's job list, KEYS[2] = tier ring
+# ARGV[1] = entry, ARGV[2] = user id, ARGV[3] = "1" to put the entry at the head
+_SUBMIT_SCRIPT = """
+local length
+if ARGV[3] == '1' then
+    length = redis.call('LPUSH', KEYS[1], ARGV[1])
+else
+    length = redis.call('RPUSH', KEYS[1], ARGV[1])
+end
+if length == 1 then
+    redis.call('RPUSH', KEYS[2], ARGV[2])
+end
+return length
+"""
+
+# KEYS[1] = tier ring, KEYS[2] = tier running set,
+# KEYS[3] = other tier's ring, KEYS[4] = other tier's running set
+# ARGV = tier, now, deadline, tier slots, per-user cap, other tier's slots, borrow
+# The ring holds every user with waiting jobs, exactly once. Each turn pops
+# the user at the front, releases one of their jobs unless they are at their
+# cap, and sends them to the back if they still have jobs waiting.
+_DISPATCH_SCRIPT = """
+local tier = ARGV[1]
+local now, deadline = tonumber(ARGV[2]), tonumber(ARGV[3])
+local cap = tonumber(ARGV[5])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+local slots = tonumber(ARGV[4])
+-- Slots the other tier is not using may be borrowed while nothing of theirs is waiting.
+if ARGV[7] == '1' and redis.call('LLEN', KEYS[3]) == 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[4], '-inf', now)
+    slots = slots + math.max(0, tonumber(ARGV[6]) - redis.call('ZCARD', KEYS[4]))
+end
+local free = slots - redis.call('ZCARD', KEYS[2])
+local released = {}
+local skipped = 0
+while free > 0 and skipped < redis.call('LLEN', KEYS[1]) do
+    local user = redis.call('LPOP', KEYS[1])
+    local running = 'fq:running:' .. user
+    local jobs = 'fq:' .. tier .. ':user:' .. user
+    redis.call('ZREMRANGEBYSCORE', running, '-inf', now)
+    if redis.call('ZCARD', running) < cap then
+        local entry = redis.call('LPOP', jobs)
+        local message_id = string.sub(entry, 1, string.find(entry, '|', 1, true) - 1)
+        redis.call('ZADD', KEYS[2], deadline, message_id)
+        redis.call('ZADD', running, deadline, message_id)
+        redis.call('EXPIRE', running, math.ceil(deadline - now))
+        table.insert(released, entry)
+        free = free - 1
+        skipped = 0
+    else
+        skipped = skipped + 1
+    end
+    if redis.call('LLEN', jobs) > 0 then
+        redis.call('RPUSH', KEYS[1], user)
+    end
+end
+return released
+"""
+
+_redis = None
+_scripts = {}
+
+
+def _get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=0)
+        _scripts["submit"] = _redis.register_script(_SUBMIT_SCRIPT)
+        _scripts["dispatch"] = _redis.register_script(_DISPATCH_SCRIPT)
+    return _redis
+
+
+def _user_key(tier, user_id):
+    return f"fq:{tier}:user:{user_id}"
+
+
+def _ring_key(tier):
+    return f"fq:{tier}:ring"
+
+
+def _running_key(tier):
+    return f"fq:{tier}:running"
+
+
+def _user_running_key(user_id):
+    return f"fq:running:{user_id}"
+
+
+def tier_of(is_premium):
+    return PREMIUM if is_premium else FREE
+
+
+# --- Scheduling ---
+def submit(message, user_id, tier):
+    """Parks a Dramatiq message in its owner's list and dispatches whatever may run now."""
+    _park(message, user_id, tier)
+    dispatch(tier)
+
+
+def _park(message, user_id, tier, head=False):
+    _get_redis()
+    entry = f"{message.message_id}|".encode() + message.encode()
+    _scripts["submit"](keys=[_user_key(tier, user_id), _ring_key(tier)], args=[entry, user_id, int(head)])
+
+
+def dispatch(tier):
+    """Releases waiting jobs of ``tier`` into Dramatiq while slots are free. Returns how many were released."""
+    _get_redis()
+    now = time.time()
+    other = FREE if tier == PREMIUM else PREMIUM
+    released = _scripts["dispatch"](
+        keys=[_ring_key(tier), _running_key(tier), _ring_key(other), _running_key(other)],
+        args=[tier, now, now + config.FAIR_QUEUE_JOB_TIMEOUT, _SLOTS[tier], config.FAIR_QUEUE_USER_CAP,
+              _SLOTS[other], int(config.FAIR_QUEUE_BORROW)],
+    )
+    broker = dramatiq.get_broker()
+    failed = []
+    for entry in released:
+        message = dramatiq.Message.decode(entry.split(b"|", 1)[1])
+        try:
+            broker.enqueue(message)
+        except Exception as e:
+            logger.error(f"Could not enqueue job {message.message_id}, putting it back: {e}")
+            failed.append(message)
+    # Put them back at the front, last first so each user's jobs keep their order;
+    # the next dispatch will try again.
+    for message in reversed(failed):
+        user_id = message.options["user_id"]
+        release(message.message_id, user_id, tier, redispatch=False)
+        _park(message, user_id, tier, head=True)
+    return len(released) - len(failed)
+
+
+def release(message_id, user_id, tier, redispatch=True):
+    """Frees the slot held by a finished job and lets the next job of the tier run."""
+    client = _get_redis()
+    pipe = client.pipeline()
+    pipe.zrem(_running_key(tier), message_id)
+    pipe.zrem(_user_running_key(user_id), message_id)
+    pipe.execute()
+    if redispatch and config.FAIR_QUEUE_ENABLED:
+        dispatch(tier)
+        if config.FAIR_QUEUE_BORROW:
+            # The freed slot may be borrowable by the other tier.
+            dispatch(FREE if tier == PREMIUM else PREMIUM)
+
+
+def waiting(tier):
+    """Returns the number of jobs of ``tier`` parked in users' lists."""
+    client = _get_redis()
+    users = client.lrange(_ring_key(tier), 0, -1)
+    if not users:
+        return 0
+    pipe = client.pipeline()
+    for user_id in users:
+        pipe.llen(_user_key(tier, user_id.decode()))
+    return sum(pipe.execute())
+
+
+def running(tier):
+    """Returns the number of jobs of ``tier`` released to Dramatiq and not yet finished."""
+    return _get_redis().zcount(_running_key(tier), time.time(), "+inf")
+
+
+# --- Queue-wait Statistics ---
+def record_wait(tier, seconds):
+    metrics.record(f"queue_wait:{tier}", seconds, keep=config.FAIR_QUEUE_WAIT_SAMPLES)
+    metrics.observe("queue_wait_seconds", seconds, tier=tier)
+
+
+def queue_wait_percentiles(tier, percentiles=(50, 90, 99)):
+    """Returns {percentile: seconds} over the most recent queue-wait samples of ``tier``."""
+    return metrics.percentiles(f"queue_wait:{tier}", percentiles)
+
+
+# --- Worker Integration ---
+def _gives_up(broker, message, exception, middleware):
+    """
+    Whether ``exception`` ends ``message`` for good rather than being retried.
+
+    after_* hooks run in reverse middleware order, so when Retries was added
+    before ``middleware`` it has not run yet and ``message.failed`` is not
+    set on the last attempt; its decision is worked out the same way here.
+    """
+    retries = next((m for m in broker.middleware if isinstance(m, Retries)), None)
+    if message.failed or retries is None:
+        return True
+    if broker.middleware.index(retries) > broker.middleware.index(middleware):
+        return False  # Retries already ran and chose to retry.
+
+    actor = broker.get_actor(message.actor_name)
+    throws = message.options.get("throws") or actor.options.get("throws")
+    if throws and isinstance(exception, throws):
+        return True
+    attempts = message.options.get("retries", 0)
+    retry_when = actor.options.get("retry_when", retries.retry_when)
+    if retry_when is not None:
+        return not retry_when(attempts, exception)
+    max_retries = message.options.get("max_retries", actor.options.get("max_retries", retries.max_retries))
+    return max_retries is not None and attempts >= max_retries
+
+
+class FairShareMiddleware(dramatiq.Middleware):
+    """Records queue waits and frees fair-share slots when jobs finish for good."""
+
+    def after_worker_boot(self, broker, worker):
+        if config.FAIR_QUEUE_ENABLED:
+            threading.Thread(target=self._dispatch_forever, name="fair-queue-dispatch", daemon=True).start()
+
+    def before_process_message(self, broker, message):
+        tier = message.options.get("tier")
+        # Retries and jobs deferred for disk space (tasks.py) were already counted.
+        if tier and not message.options.get("retries") and not message.options.get("deferred"):
+            record_wait(tier, time.time() - message.message_timestamp / 1000)
+
+    def after_process_message(self, broker, message, *, result=None, exception=None):
+        # A failed attempt that will be retried keeps its slot.
+        if exception is None or _gives_up(broker, message, exception, self):
+            self._release(message)
+
+    def after_skip_message(self, broker, message):
+        self._release(message)
+
+    def _release(self, message):
+        tier, user_id = message.options.get("tier"), message.options.get("user_id")
+        if tier and user_id is not None:
+            try:
+                release(message.message_id, user_id, tier)
+            except redis.exceptions.RedisError as e:
+                logger.warning(f"Could not release fair-share slot for {message.message_id}: {e}")
+
+    def _dispatch_forever(self):
+        """Picks up slots freed by expired deadlines even when nothing else triggers a dispatch."""
+        while True:
+            time.sleep(_DISPATCH_INTERVAL)
+            for tier in TIERS:
+                try:
+                    dispatch(tier)
+                except Exception as e:
+                    logger.warning(f"Periodic dispatch of the {tier} tier failed: {e}")
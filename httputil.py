@@ -0,0 +1,137 @@
+# httputil.py
+"""
+Minimal HTTP/1.1 helpers for the project's asyncio file servers.
+
+Only what serving files needs is implemented: parsing request heads,
+keep-alive detection, byte-range parsing and building response heads.
+"""
+import asyncio
+from email.utils import formatdate
+from http import HTTPStatus
+from urllib.parse import quote, unquote, urlsplit
+
+MAX_HEADER_BYTES = 16 * 1024
+
+
+class BadRequest(Exception):
+    """Raised when a request head cannot be parsed."""
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when none of the requested byte ranges overlap the resource."""
+
+
+class Request:
+    """A parsed request head. Header names are lower-cased."""
+
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+        self.path = unquote(urlsplit(target).path)
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+
+async def read_request(reader, timeout=None):
+    """Reads one request head from ``reader``. Returns None if the client closed the connection."""
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise BadRequest("Connection closed mid-request.")
+    except asyncio.LimitOverrunError:
+        raise BadRequest("Request head too large.")
+
+    if len(head) > MAX_HEADER_BYTES:
+        raise BadRequest("Request head too large.")
+
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ", 2)
+    except ValueError:
+        raise BadRequest(f"Malformed request line: {lines[0]!r}")
+
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(":")
+        if not sep:
+            raise BadRequest(f"Malformed header: {line!r}")
+        headers[name.strip().lower()] = value.strip()
+    return Request(method.upper(), target, version, headers)
+
+
+def parse_range(header, size):
+    """
+    Parses a ``Range`` header into a list of inclusive ``(start, end)`` pairs.
+
+    Returns None when the header is absent or not a byte range (the caller
+    should then send the whole resource) and raises RangeNotSatisfiable if
+    no requested range overlaps a resource of ``size`` bytes.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        first, dash, last = part.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+            else:
+                # Suffix range: the last N bytes.
+                length = int(last)
+                if length == 0:
+                    continue
+                start, end = max(size - length, 0), size - 1
+        except ValueError:
+            return None
+        if start > end and first and last:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+    return ranges
+
+
+def content_disposition(filename, disposition="attachment"):
+    """Builds a Content-Disposition value that survives non-ASCII filenames."""
+    ascii_name = filename.encode("ascii", "replace").decode().replace('"', "").replace("?", "_")
+    return f"{disposition}; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def response_head(status, headers=None, keep_alive=True):
+    """Serialises a status line and headers into bytes."""
+    status = HTTPStatus(status)
+    lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+    headers = dict(headers or {})
+    headers.setdefault("Date", formatdate(usegmt=True))
+    headers.setdefault("Connection", "keep-alive" if keep_alive else "close")
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def simple_response(status, message=None, keep_alive=True, headers=None):
+    """Builds a complete plain-text response (head and body)."""
+    body = (message or HTTPStatus(status).phrase).encode() + b"\n"
+    headers = dict(headers or {})
+    headers.update({"Content-Type": "text/plain; charset=utf-8", "Content-Length": str(len(body))})
+    return response_head(status, headers, keep_alive) + body
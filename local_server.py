@@ -1,42 +1,246 @@
-import http.server
-import socketserver
+"""
+Asyncio file server for PUBLIC_FILES_DIR.
+
+Every connection is handled concurrently, so one slow client never blocks
+another. File bodies are sent with os.sendfile (via loop.sendfile) so data
+goes from the page cache to the socket without passing through Python.
+Supported: keep-alive, HEAD, single and multi-range requests
+(multipart/byteranges), ETag with If-None-Match / If-Range, and an optional
+per-connection bandwidth limit. Hidden paths (such as the .blobs store)
+and directory listings are never served. With METRICS_ON_PUBLIC_SERVERS,
+GET /metrics reports metrics.py in the Prometheus format.
+"""
+import asyncio
+import mimetypes
 import os
+import secrets
+import socket
+import time
+from email.utils import formatdate
+
+import redis
+
 import config
+import httputil
+import metrics
 
 # --- Configuration ---
 PORT = config.LOCAL_SERVER_PORT
 DIRECTORY = config.PUBLIC_FILES_DIR
 
-# --- Server Handler ---
-# We use functools.partial to change the directory of the SimpleHTTPRequestHandler
-# as recommended in the official Python documentation.
-class Handler(http.server.SimpleHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, directory=DIRECTORY, **kwargs)
+# Multi-range requests with more parts than this are answered with the whole file.
+MAX_RANGES = 16
+# Pacing granularity for rate-limited connections, in seconds.
+_RATE_TICK = 0.1
 
-# --- Main Server Logic ---
-def run_server():
-    """
-    Starts a simple HTTP server to serve files from the public directory.
-    """
-    with socketserver.TCPServer(("", PORT), Handler) as httpd:
-        # Ensure the directory exists
-        if not os.path.isdir(DIRECTORY):
-            print(f"Error: Public directory '{DIRECTORY}' not found.")
-            print("Please create it or check your .env configuration.")
+
+class FileServer:
+    """Serves files from ``directory`` over HTTP/1.1."""
+
+    def __init__(self, directory=DIRECTORY, rate_limit=None, keepalive_timeout=None, max_keepalive_requests=None):
+        self.root = os.path.realpath(directory)
+        self.rate_limit = config.FILE_SERVER_RATE_LIMIT if rate_limit is None else rate_limit
+        self.keepalive_timeout = keepalive_timeout or config.FILE_SERVER_KEEPALIVE_TIMEOUT
+        self.max_keepalive_requests = max_keepalive_requests or config.FILE_SERVER_KEEPALIVE_REQUESTS
+
+    async def start(self, host="", port=PORT):
+        return await asyncio.start_server(self.handle_connection, host, port, backlog=config.FILE_SERVER_BACKLOG)
+
+    # --- Connection Handling ---
+    async def handle_connection(self, reader, writer):
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        served = 0
+        try:
+            while served < self.max_keepalive_requests:
+                try:
+                    request = await httputil.read_request(reader, timeout=self.keepalive_timeout)
+                except httputil.BadRequest as e:
+                    writer.write(httputil.simple_response(400, str(e), keep_alive=False))
+                    break
+                if request is None:
+                    break
+
+                served += 1
+                keep_alive = request.keep_alive and served < self.max_keepalive_requests
+                await self.handle_request(request, writer, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, request, writer, keep_alive):
+        if request.method not in ("GET", "HEAD"):
+            writer.write(httputil.simple_response(405, keep_alive=keep_alive, headers={"Allow": "GET, HEAD"}))
             return
 
-        print("--- Local File Server ---")
-        print(f"Serving files from directory: ./{DIRECTORY}")
-        print(f"Access your files at: http://localhost:{PORT}")
-        print("-------------------------")
-        print("Press Ctrl+C to stop the server.")
+        if request.path == "/metrics" and config.METRICS_ON_PUBLIC_SERVERS:
+            await self.send_metrics(request, writer, keep_alive)
+            return
 
+        path = self.resolve(request.path)
         try:
-            httpd.serve_forever()
-        except KeyboardInterrupt:
-            print("\nServer stopped.")
-            httpd.shutdown()
+            fd = os.open(path, os.O_RDONLY) if path else None
+        except OSError:
+            fd = None
+        if fd is None:
+            writer.write(httputil.simple_response(404, keep_alive=keep_alive))
+            return
+
+        with os.fdopen(fd, "rb") as f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            etag = f'"{st.st_ino:x}-{size:x}-{st.st_mtime_ns:x}"'
+            headers = {
+                "Accept-Ranges": "bytes",
+                "ETag": etag,
+                "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+                "Keep-Alive": f"timeout={self.keepalive_timeout}, max={self.max_keepalive_requests}",
+                # The last path segment is the original filename (see storage.py).
+                "Content-Disposition": httputil.content_disposition(request.path.rsplit("/", 1)[-1]),
+            }
+
+            if _etag_matches(request.headers.get("if-none-match"), etag):
+                writer.write(httputil.response_head(304, headers, keep_alive))
+                return
+
+            ranges = None
+            if_range = request.headers.get("if-range")
+            if not if_range or if_range == etag:
+                try:
+                    ranges = httputil.parse_range(request.headers.get("range"), size)
+                except httputil.RangeNotSatisfiable:
+                    headers["Content-Range"] = f"bytes */{size}"
+                    writer.write(httputil.simple_response(416, keep_alive=keep_alive, headers=headers))
+                    return
+            if ranges and len(ranges) > MAX_RANGES:
+                ranges = None
+
+            # Guessed from the URL: a symlinked alias resolves to a blob without an extension.
+            content_type = mimetypes.guess_type(request.path)[0] or "application/octet-stream"
+            send_body = request.method == "GET"
+
+            if not ranges:
+                headers.update({"Content-Type": content_type, "Content-Length": str(size)})
+                writer.write(httputil.response_head(200, headers, keep_alive))
+                if send_body:
+                    await self.send_range(writer, f, 0, size)
+            elif len(ranges) == 1:
+                start, end = ranges[0]
+                headers.update({
+                    "Content-Type": content_type,
+                    "Content-Length": str(end - start + 1),
+                    "Content-Range": f"bytes {start}-{end}/{size}",
+                })
+                writer.write(httputil.response_head(206, headers, keep_alive))
+                if send_body:
+                    await self.send_range(writer, f, start, end - start + 1)
+            else:
+                await self.send_multirange(writer, f, ranges, size, content_type, headers, keep_alive, send_body)
+
+    async def send_metrics(self, request, writer, keep_alive):
+        try:
+            body = (await asyncio.to_thread(metrics.render)).encode()
+        except redis.exceptions.RedisError as e:
+            writer.write(httputil.simple_response(503, f"Redis unavailable: {e}", keep_alive=keep_alive))
+            return
+        headers = {"Content-Type": metrics.CONTENT_TYPE, "Content-Length": str(len(body))}
+        writer.write(httputil.response_head(200, headers, keep_alive))
+        if request.method == "GET":
+            writer.write(body)
+
+    def resolve(self, url_path):
+        """Maps a URL path to a file inside the root, or None if it must not be served."""
+        parts = [part for part in url_path.split("/") if part]
+        if not parts or any(part.startswith(".") for part in parts):
+            return None
+        path = os.path.realpath(os.path.join(self.root, *parts))
+        if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    # --- Body Transfer ---
+    async def send_range(self, writer, f, offset, count):
+        """Sends ``count`` bytes of ``f`` from ``offset`` with sendfile, honouring the rate limit."""
+        await writer.drain()
+        loop = asyncio.get_running_loop()
+        if not self.rate_limit:
+            await loop.sendfile(writer.transport, f, offset, count)
+            return
+
+        chunk = max(int(self.rate_limit * _RATE_TICK), 16 * 1024)
+        started = time.monotonic()
+        sent = 0
+        while sent < count:
+            n = min(chunk, count - sent)
+            await loop.sendfile(writer.transport, f, offset + sent, n)
+            sent += n
+            # Sleep until the connection is back under its byte budget.
+            ahead = sent / self.rate_limit - (time.monotonic() - started)
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+
+    async def send_multirange(self, writer, f, ranges, size, content_type, headers, keep_alive, send_body):
+        boundary = secrets.token_hex(12)
+        preambles = [
+            (f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+             f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode("latin-1")
+            for start, end in ranges
+        ]
+        closing = f"--{boundary}--\r\n".encode("latin-1")
+        length = sum(len(p) + (end - start + 1) + 2 for p, (start, end) in zip(preambles, ranges)) + len(closing)
+
+        headers.update({
+            "Content-Type": f"multipart/byteranges; boundary={boundary}",
+            "Content-Length": str(length),
+        })
+        writer.write(httputil.response_head(206, headers, keep_alive))
+        if not send_body:
+            return
+        for preamble, (start, end) in zip(preambles, ranges):
+            writer.write(preamble)
+            await self.send_range(writer, f, start, end - start + 1)
+            writer.write(b"\r\n")
+        writer.write(closing)
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison, as RFC 9110 requires for If-None-Match.
+    candidates = (tag.strip().removeprefix("W/") for tag in header.split(","))
+    return etag in candidates
+
+
+# --- Main Server Logic ---
+async def run_server():
+    """
+    Starts the asyncio file server for the public directory.
+    """
+    # Ensure the directory exists
+    if not os.path.isdir(DIRECTORY):
+        print(f"Error: Public directory '{DIRECTORY}' not found.")
+        print("Please create it or check your .env configuration.")
+        return
+
+    server = await FileServer().start()
+    print("--- Local File Server ---")
+    print(f"Serving files from directory: ./{DIRECTORY}")
+    print(f"Access your files at: http://localhost:{PORT}")
+    print("-------------------------")
+    print("Press Ctrl+C to stop the server.")
+    async with server:
+        await server.serve_forever()
 
 if __name__ == "__main__":
-    run_server()
+    try:
+        asyncio.run(run_server())
+    except KeyboardInterrupt:
+        print("\nServer stopped.")
@@ -0,0 +1,311 @@
+# metrics.py
+"""
+Lightweight job metrics kept in Redis, shared by every worker process.
+
+Timings are stored as a capped list of recent samples per metric, so
+percentiles reflect current behaviour rather than all-time averages.
+Counters are Redis hashes. Recording never raises: a metric lost while
+Redis is unavailable is not worth failing a job over.
+
+Per-stage timings of file jobs (queue wait, download, publish, Bot API
+requests) are histograms with fixed buckets. `observe` only adds to
+in-process totals; a background thread adds them to Redis every
+METRICS_FLUSH_INTERVAL seconds in one round-trip, so the hot path never
+waits for Redis. `render` reports everything, plus the depth of every
+queue, in the Prometheus text format; `serve` exposes it on /metrics.
+Since the numbers live in Redis, every endpoint reports the same totals
+for the whole deployment.
+"""
+import atexit
+import collections
+import http.server
+import logging
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+
+import redis
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_redis = None
+
+
+def _get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=0)
+    return _redis
+
+
+def _samples_key(name):
+    return f"metrics:{name}:samples"
+
+
+def _counters_key(name):
+    return f"metrics:{name}:counts"
+
+
+def _histogram_key(name):
+    return f"metrics:{name}:histogram"
+
+
+_TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+_THROUGHPUT_BUCKETS = tuple(mb * 1024 * 1024 for mb in (0.0625, 0.25, 1, 2, 5, 10, 20, 50, 100, 250))
+
+# name -> (help text, bucket upper bounds)
+HISTOGRAMS = {
+    "queue_wait_seconds": ("Time from enqueueing a job until a worker picked it up.", _TIME_BUCKETS),
+    "download_seconds": ("Download duration by method.", _TIME_BUCKETS),
+    "download_bytes_per_second": ("Download throughput by method.", _THROUGHPUT_BUCKETS),
+    "publish_seconds": ("Hashing, placing and linking a downloaded file.", _TIME_BUCKETS),
+    "telegram_request_seconds": ("Bot API request latency by method, e.g. editMessageText.", _TIME_BUCKETS),
+}
+
+# The label the field of an `incr` counter is reported under.
+_COUNTER_LABELS = {
+    "job_failures": "exception",
+    "job_retries": "exception",
+    "publish_method": "method",
+    "bot_api_handoff": "method",
+}
+
+
+# --- Recording ---
+def record(name, seconds, keep=None):
+    """Adds a timing sample to ``name``, keeping the most recent ``keep`` samples."""
+    keep = keep or config.METRICS_SAMPLES
+    try:
+        pipe = _get_redis().pipeline()
+        pipe.lpush(_samples_key(name), round(seconds, 3))
+        pipe.ltrim(_samples_key(name), 0, keep - 1)
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.warning(f"Could not record metric {name}: {e}")
+
+
+def incr(name, field, amount=1):
+    """Increments the counter ``field`` of ``name``."""
+    try:
+        _get_redis().hincrby(_counters_key(name), field, amount)
+    except redis.exceptions.RedisError as e:
+        logger.warning(f"Could not record metric {name}: {e}")
+
+
+# --- Histograms ---
+class _Buffer:
+    """Histogram observations not yet added to Redis, for one process."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()  # (name, labels, bucket) -> observations
+        self.sums = collections.Counter()  # (name, labels) -> total
+        self.thread = threading.Thread(target=self._flush_forever, name="metrics-flush", daemon=True)
+        self.thread.start()
+
+    def add(self, name, value, labels):
+        bounds = HISTOGRAMS[name][1]
+        index = bisect_left(bounds, value)
+        bucket = repr(float(bounds[index])) if index < len(bounds) else "+Inf"
+        with self.lock:
+            self.counts[name, labels, bucket] += 1
+            self.sums[name, labels] += value
+
+    def flush(self):
+        with self.lock:
+            counts, self.counts = self.counts, collections.Counter()
+            sums, self.sums = self.sums, collections.Counter()
+        if not counts:
+            return
+        try:
+            pipe = _get_redis().pipeline(transaction=False)
+            for (name, labels, bucket), n in counts.items():
+                pipe.hincrby(_histogram_key(name), f"{labels}|{bucket}", n)
+            for (name, labels), total in sums.items():
+                pipe.hincrbyfloat(_histogram_key(name), f"{labels}|sum", total)
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Could not flush {sum(counts.values())} metric observations: {e}")
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(config.METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def _get_buffer():
+    global _buffer
+    # A forked worker process starts its own buffer and flush thread.
+    if _buffer is None or _buffer.pid != os.getpid():
+        with _buffer_lock:
+            if _buffer is None or _buffer.pid != os.getpid():
+                _buffer = _Buffer()
+                atexit.register(_buffer.flush)
+    return _buffer
+
+
+def observe(name, value, **labels):
+    """Adds ``value`` to the histogram ``name`` (see HISTOGRAMS). Cheap enough for every chunk of a job."""
+    _get_buffer().add(name, value, _format_labels(labels))
+
+
+def flush():
+    """Adds this process's pending observations to Redis now."""
+    if _buffer is not None and _buffer.pid == os.getpid():
+        _buffer.flush()
+
+
+def _format_labels(labels):
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# --- Reporting ---
+def percentiles(name, percentiles=(50, 90, 99)):
+    """Returns {percentile: seconds} over the recent samples of ``name`` (None when there are none)."""
+    samples = sorted(float(s) for s in _get_redis().lrange(_samples_key(name), 0, -1))
+    if not samples:
+        return {p: None for p in percentiles}
+    # Nearest-rank percentiles.
+    return {p: samples[max(0, math.ceil(len(samples) * p / 100) - 1)] for p in percentiles}
+
+
+def counters(name):
+    """Returns the counters of ``name`` as {field: count}."""
+    return {k.decode(): int(v) for k, v in _get_redis().hgetall(_counters_key(name)).items()}
+
+
+# --- Prometheus Exposition ---
+def queue_depths():
+    """Returns {(queue, state): messages} for every Dramatiq queue."""
+    import fair_queue  # fair_queue records its waits through this module
+
+    client = _get_redis()
+    pipe = client.pipeline(transaction=False)
+    for queue in fair_queue.TIERS:
+        pipe.llen(f"dramatiq:{queue}")
+        pipe.hlen(f"dramatiq:{queue}.msgs")
+        pipe.hlen(f"dramatiq:{queue}.DQ.msgs")
+        pipe.zcard(f"dramatiq:{queue}.XQ")
+    results = iter(pipe.execute())
+
+    depths = {}
+    for queue in fair_queue.TIERS:
+        ready, stored, delayed, dead = (next(results) for _ in range(4))
+        depths[queue, "ready"] = ready
+        # Fetched by a worker but not acknowledged yet
+        depths[queue, "in_progress"] = max(0, stored - ready)
+        depths[queue, "delayed"] = delayed
+        depths[queue, "dead"] = dead
+        if config.FAIR_QUEUE_ENABLED:
+            depths[queue, "fair_share_waiting"] = fair_queue.waiting(queue)
+            depths[queue, "fair_share_running"] = fair_queue.running(queue)
+    return depths
+
+
+def _metric_name(name):
+    return "morphile_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def _join_labels(*parts):
+    labels = ",".join(part for part in parts if part)
+    return f"{{{labels}}}" if labels else ""
+
+
+def render():
+    """Returns every metric in the Prometheus text exposition format."""
+    flush()
+    client = _get_redis()
+    lines = []
+
+    for name, (help_text, bounds) in HISTOGRAMS.items():
+        metric = _metric_name(name)
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+        series = collections.defaultdict(dict)  # labels -> {bucket or "sum": value}
+        for field, value in client.hgetall(_histogram_key(name)).items():
+            labels, bucket = field.decode().rsplit("|", 1)
+            series[labels][bucket] = float(value)
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound in [repr(float(b)) for b in bounds] + ["+Inf"]:
+                cumulative += values.get(bound, 0)
+                le = _format_labels({"le": bound})
+                lines.append(f"{metric}_bucket{_join_labels(labels, le)} {cumulative:.0f}")
+            lines.append(f"{metric}_sum{_join_labels(labels)} {values.get('sum', 0)}")
+            lines.append(f"{metric}_count{_join_labels(labels)} {cumulative:.0f}")
+
+    for key in sorted(client.scan_iter(match=_counters_key("*"))):
+        name = key.decode()[len("metrics:"):-len(":counts")]
+        metric = _metric_name(name) + "_total"
+        label = _COUNTER_LABELS.get(name, "event")
+        lines.append(f"# TYPE {metric} counter")
+        for field, count in sorted(counters(name).items()):
+            lines.append(f"{metric}{_join_labels(_format_labels({label: field}))} {count}")
+
+    # Percentiles over the recent samples kept by `record`
+    lines.append("# TYPE morphile_recent_seconds summary")
+    for key in sorted(client.scan_iter(match=_samples_key("*"))):
+        name = key.decode()[len("metrics:"):-len(":samples")]
+        for p, seconds in percentiles(name).items():
+            if seconds is not None:
+                labels = _format_labels({"metric": name, "quantile": p / 100})
+                lines.append(f"morphile_recent_seconds{{{labels}}} {seconds}")
+
+    lines += ["# HELP morphile_queue_messages Messages per Dramatiq queue and state.",
+              "# TYPE morphile_queue_messages gauge"]
+    for (queue, state), n in sorted(queue_depths().items()):
+        lines.append(f"morphile_queue_messages{{{_format_labels({'queue': queue, 'state': state})}}} {n}")
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        try:
+            body, status = render().encode(), 200
+        except redis.exceptions.RedisError as e:
+            body, status = f"Redis unavailable: {e}\n".encode(), 503
+        self.send_response(status)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host=None):
+    """
+    Serves /metrics on ``port`` from a background thread. Returns the server,
+    or None if ``port`` is 0 or already taken, e.g. by another worker
+    process on this host, which reports the same numbers.
+    """
+    if not port:
+        return None
+    try:
+        server = http.server.ThreadingHTTPServer((host or config.METRICS_HOST, port), _MetricsHandler)
+    except OSError as e:
+        logger.info(f"Not serving metrics on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Serving metrics on port {port}")
+    return server
@@ -0,0 +1,112 @@
+# migrate_storage.py
+"""
+Moves public files from the old flat layout (PUBLIC_FILES_DIR/<prefix>_<name>)
+into the sharded one (PUBLIC_FILES_DIR/ab/cd/<id>/<name>) and records each in
+the `files` collection.
+
+By default every old path is replaced by a relative symlink to the new one,
+so links already sent to users keep working. Run again with
+--drop-old-links once they no longer need to (e.g. after they would have
+expired); the flat directory is then emptied. The script can be re-run
+safely: entries that were already migrated are skipped.
+
+Usage:
+    python3 migrate_storage.py --dry-run
+    python3 migrate_storage.py
+    python3 migrate_storage.py --drop-old-links
+"""
+import argparse
+import os
+import re
+import secrets
+import sys
+
+# Add the project root to the Python path to allow running this script standalone
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import config
+import database
+import storage
+
+# Old aliases were "<8 hex chars>_<sanitised name>".
+_OLD_ALIAS = re.compile(r"^[0-9a-f]{8}_(.+)$")
+_NEW_PATH = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{32}/")
+
+
+def _is_migrated(path):
+    return os.path.islink(path) and _NEW_PATH.match(os.readlink(path)) is not None
+
+
+def _link_into_place(old_path, new_path):
+    """Creates ``new_path`` as another name for the file at ``old_path``."""
+    os.makedirs(os.path.dirname(new_path))
+    if os.path.islink(old_path):
+        # Re-point relative symlinks from their new directory.
+        target = os.path.realpath(old_path)
+        os.symlink(os.path.relpath(target, os.path.dirname(new_path)), new_path)
+    else:
+        os.link(old_path, new_path)
+
+
+def _replace_with_symlink(old_path, new_alias):
+    temp_path = os.path.join(config.PUBLIC_FILES_DIR, f".{secrets.token_hex(8)}.tmp")
+    os.symlink(new_alias, temp_path)
+    os.replace(temp_path, old_path)
+
+
+def migrate(dry_run=False, keep_old_links=True):
+    migrated = skipped = dropped = 0
+    for name in sorted(os.listdir(config.PUBLIC_FILES_DIR)):
+        old_path = os.path.join(config.PUBLIC_FILES_DIR, name)
+        if name.startswith(".") or os.path.isdir(old_path):
+            continue  # Hidden stores and the new shard directories
+        if _is_migrated(old_path):
+            if not keep_old_links:
+                if not dry_run:
+                    os.remove(old_path)
+                dropped += 1
+            continue
+        if not os.path.exists(old_path):
+            print(f"⚠️ Skipping {name}: it points at a file that no longer exists.")
+            skipped += 1
+            continue
+
+        match = _OLD_ALIAS.match(name)
+        filename = match.group(1) if match else name
+        blob = database.find_blob_by_alias(name)
+        file_id = secrets.token_hex(16)
+        new_alias = storage.public_path(file_id, storage.public_filename(filename))
+        print(f"{name} -> {new_alias}" + ("" if blob else " (not in the blob store)"))
+        migrated += 1
+        if dry_run:
+            continue
+
+        new_path = os.path.join(config.PUBLIC_FILES_DIR, new_alias)
+        _link_into_place(old_path, new_path)
+        size = blob["size"] if blob else os.path.getsize(new_path)
+        database.create_file(file_id, new_alias, filename, size, blob=blob["_id"] if blob else None)
+        if blob:
+            database.replace_blob_alias(blob["_id"], name, new_alias)
+        if keep_old_links:
+            _replace_with_symlink(old_path, new_alias)
+        else:
+            os.remove(old_path)
+            dropped += 1
+
+    return migrated, skipped, dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move public files into the sharded ab/cd/<id>/<name> layout")
+    parser.add_argument("--dry-run", action="store_true", help="Only print what would be moved")
+    parser.add_argument("--drop-old-links", action="store_true",
+                        help="Remove the old flat paths instead of leaving symlinks (old links stop working)")
+    args = parser.parse_args()
+
+    migrated, skipped, dropped = migrate(dry_run=args.dry_run, keep_old_links=not args.drop_old_links)
+    verb = "Would migrate" if args.dry_run else "Migrated"
+    print(f"✅ {verb} {migrated} files; skipped {skipped}; removed {dropped} old paths.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+# parallel_download.py
+"""
+Multi-connection chunked downloads for large Telegram documents.
+
+A single MTProto connection caps a download at that connection's
+throughput. This module splits a document into fixed-size parts, fetches
+them concurrently over several sender connections to the file's home DC
+and writes each part with a positional write into a preallocated file.
+Failed parts are retried on their own instead of restarting the file.
+
+Progress is checkpointed in a sidecar manifest ("<path>.parts") listing
+the parts already on disk. If the download dies (connection loss, time
+limit, worker restart), the next attempt at the same path only fetches
+the missing parts.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import stat
+import time
+
+from telethon import utils
+from telethon.errors import FloodWaitError
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
+from telethon.tl.functions.upload import GetFileRequest
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# upload.getFile requires limit to be a multiple of 4 KB that divides 1 MB.
+_MAX_PART_SIZE = 1024 * 1024
+MANIFEST_SUFFIX = ".parts"
+_CHECKPOINT_PARTS = 16  # Parts written between manifest checkpoints
+# Download paths are "<chat id>_<message id or timestamp>_<file name>" (see tasks.py).
+_JOB_FILE_NAME = re.compile(r"-?\d+_\d+_")
+
+
+class PartFetchError(Exception):
+    """Raised when a part could not be downloaded after all retries."""
+
+
+def _validate_part_size(part_size):
+    if part_size <= 0 or part_size % 4096 or _MAX_PART_SIZE % part_size:
+        raise ValueError(f"Part size must be a multiple of 4 KB that divides 1 MB, got {part_size}.")
+
+
+# --- Generic Part Engine ---
+async def download_parts(fetchers, file_size, path, part_size=None, retries=None, progress_callback=None,
+                         allocated_callback=None):
+    """
+    Downloads ``file_size`` bytes into ``path`` using one worker per fetcher.
+
+    Each fetcher is an ``async fetch(offset, limit) -> bytes`` callable bound
+    to its own connection. Parts are handed out from a shared queue, so fast
+    connections naturally take on more of the file. Parts recorded in the
+    manifest of an earlier attempt are skipped; the manifest is removed
+    once the file is complete. ``progress_callback(done, total)`` is called
+    after every part, like Telethon's. ``allocated_callback(nbytes)`` is
+    awaited once the file is preallocated, with the bytes actually allocated
+    on disk (fewer than ``file_size`` if the filesystem made it sparse).
+    """
+    part_size = part_size or config.PARALLEL_DOWNLOAD_PART_SIZE
+    retries = config.PARALLEL_DOWNLOAD_PART_RETRIES if retries is None else retries
+    _validate_part_size(part_size)
+
+    part_count = (file_size + part_size - 1) // part_size
+    manifest = _Manifest(path + MANIFEST_SUFFIX, file_size, part_size)
+    done = manifest.load()
+    pending = asyncio.Queue()
+    for index in range(part_count):
+        if index not in done:
+            pending.put_nowait(index)
+    if done:
+        logger.info(f"Resuming {path}: {len(done)} of {part_count} parts already on disk.")
+    received = sum(min(part_size, file_size - index * part_size) for index in done)
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if not done:
+            # Without a manifest, whatever is in the file can't be trusted.
+            os.ftruncate(fd, 0)
+            manifest.start()
+        _preallocate(fd, file_size)
+        if allocated_callback:
+            await allocated_callback(min(os.fstat(fd).st_blocks * 512, file_size))
+
+        async def worker(fetch):
+            nonlocal received
+            while True:
+                try:
+                    index = pending.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                offset = index * part_size
+                expected = min(part_size, file_size - offset)
+                data = await _fetch_part(fetch, offset, part_size, expected, retries)
+                os.pwrite(fd, data, offset)
+                manifest.written(index)
+                received += len(data)
+                if progress_callback:
+                    progress_callback(received, file_size)
+                if manifest.unsaved >= _CHECKPOINT_PARTS:
+                    manifest.checkpoint(fd)
+
+        tasks = [asyncio.create_task(worker(fetch)) for fetch in fetchers]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Keep what made it to disk for the next attempt.
+            manifest.checkpoint(fd)
+            raise
+    finally:
+        os.close(fd)
+    manifest.remove()
+
+
+class _Manifest:
+    """
+    The sidecar record of which parts of a download are on disk.
+
+    The first line describes the download; each further line is the index
+    of a finished part. A part is only recorded after the data file has
+    been synced, so every listed part survives a crash.
+    """
+
+    def __init__(self, path, file_size, part_size):
+        self.path = path
+        self.header = {"file_size": file_size, "part_size": part_size}
+        self._unsaved = []
+
+    @property
+    def unsaved(self):
+        return len(self._unsaved)
+
+    def load(self):
+        """Returns the indexes of finished parts, or an empty set if there is no usable manifest."""
+        try:
+            with open(self.path) as f:
+                if json.loads(f.readline()) != self.header:
+                    return set()
+                # A torn last line (crash mid-append) is simply ignored.
+                return {int(line) for line in f if line.strip().isdigit() and line.endswith("\n")}
+        except (OSError, ValueError):
+            return set()
+
+    def start(self):
+        with open(self.path, "w") as f:
+            f.write(json.dumps(self.header) + "\n")
+
+    def written(self, index):
+        self._unsaved.append(index)
+
+    def checkpoint(self, fd):
+        if not self._unsaved:
+            return
+        os.fsync(fd)
+        with open(self.path, "a") as f:
+            f.write("".join(f"{index}\n" for index in self._unsaved))
+        self._unsaved = []
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def reap_partials(directory, max_age):
+    """
+    Deletes partial downloads in ``directory`` that have not been touched
+    for ``max_age`` seconds, i.e. downloads nobody will resume. Returns
+    (files removed, bytes freed).
+
+    Parallel downloads are judged by their manifest. Single-stream ones
+    (forwarded files below the parallel threshold, Bot API downloads) have
+    none, so job files named "<chat>_<id>_..." without a manifest are
+    judged by their own timestamps.
+    """
+    removed, freed = 0, 0
+    cutoff = time.time() - max_age
+    names = set(os.listdir(directory))
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if name.endswith(MANIFEST_SUFFIX):
+                if os.path.getmtime(path) > cutoff:
+                    continue
+                data_path = path[:-len(MANIFEST_SUFFIX)]
+                if os.path.exists(data_path):
+                    freed += os.path.getsize(data_path)
+                    os.remove(data_path)
+                os.remove(path)
+                removed += 1
+            elif name + MANIFEST_SUFFIX not in names and _JOB_FILE_NAME.match(name):
+                st = os.stat(path)
+                # ctime too: a file hardlinked from a local Bot API server keeps its old mtime.
+                if not stat.S_ISREG(st.st_mode) or max(st.st_mtime, st.st_ctime) > cutoff:
+                    continue
+                os.remove(path)
+                freed += st.st_size
+                removed += 1
+        except FileNotFoundError:
+            continue  # Finished or reaped concurrently
+    return removed, freed
+
+
+def discard_partial(path):
+    """Deletes a partial download and its manifest, e.g. once its job has given up."""
+    for candidate in (path, path + MANIFEST_SUFFIX):
+        try:
+            os.remove(candidate)
+        except FileNotFoundError:
+            pass
+
+
+async def _fetch_part(fetch, offset, limit, expected, retries):
+    for attempt in range(retries + 1):
+        try:
+            data = await fetch(offset, limit)
+            if len(data) < expected:
+                raise PartFetchError(f"Short read at offset {offset}: got {len(data)} of {expected} bytes.")
+            return data[:expected]
+        except FloodWaitError as e:
+            logger.warning(f"Flood wait of {e.seconds}s while fetching part at offset {offset}.")
+            await asyncio.sleep(e.seconds)
+        except (ConnectionError, asyncio.TimeoutError, PartFetchError) as e:
+            if attempt == retries:
+                raise PartFetchError(f"Giving up on part at offset {offset} after {retries + 1} attempts: {e}") from e
+            logger.warning(f"Retrying part at offset {offset} (attempt {attempt + 1}): {e}")
+            await asyncio.sleep(min(2 ** attempt, 10))
+    raise PartFetchError(f"Giving up on part at offset {offset} after {retries + 1} attempts.")
+
+
+def _preallocate(fd, size):
+    """Reserves the full file size up front so positional writes never extend it."""
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        # Not every filesystem supports fallocate; a sparse file still works.
+        os.ftruncate(fd, size)
+
+
+# --- Telethon Transport ---
+class _DcSenders:
+    """Opens extra MTProto senders to one DC, exporting auth when it isn't the session's DC."""
+
+    def __init__(self, client, dc_id):
+        self.client = client
+        self.dc_id = dc_id
+        self.auth_key = client.session.auth_key if dc_id == client.session.dc_id else None
+        self.senders = []
+
+    async def open(self, count):
+        # The first sender to a foreign DC imports an exported authorization;
+        # the rest reuse the auth key it negotiated.
+        self.senders.append(await self._create_sender())
+        self.senders.extend(await asyncio.gather(*(self._create_sender() for _ in range(count - 1))))
+        return self.senders
+
+    async def close(self):
+        await asyncio.gather(*(sender.disconnect() for sender in self.senders), return_exceptions=True)
+        self.senders = []
+
+    async def _create_sender(self):
+        client = self.client
+        dc = await client._get_dc(self.dc_id)
+        sender = MTProtoSender(self.auth_key, loggers=client._log)
+        await sender.connect(client._connection(
+            dc.ip_address, dc.port, dc.id,
+            loggers=client._log, proxy=client._proxy, local_addr=client._local_addr
+        ))
+        if not self.auth_key:
+            auth = await client(ExportAuthorizationRequest(self.dc_id))
+            client._init_request.query = ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+            await sender.send(InvokeWithLayerRequest(LAYER, client._init_request))
+            self.auth_key = sender.auth_key
+        return sender
+
+
+async def download_message_media(client, message, path, connections=None, progress_callback=None,
+                                 allocated_callback=None):
+    """
+    Downloads the media of ``message`` into ``path``.
+
+    Documents above PARALLEL_DOWNLOAD_MIN_SIZE are fetched over several
+    connections; anything else falls back to Telethon's own downloader.
+    ``allocated_callback`` is passed on to `download_parts`.
+    """
+    connections = connections or config.PARALLEL_DOWNLOAD_CONNECTIONS
+    document = message.document
+    if not document or document.size < config.PARALLEL_DOWNLOAD_MIN_SIZE or connections <= 1:
+        await client.download_media(message, file=path, progress_callback=progress_callback)
+        return path
+
+    dc_id, location = utils.get_input_location(document)
+    dc_senders = _DcSenders(client, dc_id)
+    try:
+        senders = await dc_senders.open(connections)
+
+        def make_fetch(sender):
+            async def fetch(offset, limit):
+                result = await sender.send(GetFileRequest(location, offset=offset, limit=limit))
+                return result.bytes
+            return fetch
+
+        logger.info(f"Downloading {document.size} bytes from DC {dc_id} over {len(senders)} connections.")
+        await download_parts([make_fetch(sender) for sender in senders], document.size, path,
+                             progress_callback=progress_callback, allocated_callback=allocated_callback)
+    finally:
+        await dc_senders.close()
+    return path
@@ -0,0 +1,147 @@
+# progress.py
+"""
+Download progress in the user's status message.
+
+Downloaders report bytes through `ProgressReporter.update`, as often as
+they like; it only records numbers. A background task turns the latest
+numbers into one `edit_message_text` every PROGRESS_INTERVAL seconds at
+most, showing percentage, speed and ETA. Each edit also needs a token
+from the shared Telegram rate limiter (rate_limit.py); without one the
+update is skipped, and the next tick shows newer numbers anyway. With
+hundreds of jobs in flight, progress messages therefore slow down
+instead of pushing the bot into Telegram's flood limits.
+"""
+import asyncio
+import logging
+import random
+import time
+
+from telegram.error import BadRequest, RetryAfter
+
+import config
+import rate_limit
+
+logger = logging.getLogger(__name__)
+
+_SPEED_SMOOTHING = 0.3  # Weight of the latest interval in the speed estimate
+
+
+def format_size(nbytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if nbytes < 1024 or unit == "GB":
+            return f"{nbytes:.0f} {unit}" if unit == "B" else f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds // 60 % 60:02d}m"
+
+
+class ProgressReporter:
+    """Coalesces progress updates for one job into throttled status edits."""
+
+    def __init__(self, bot, chat_id, message_id, total=None, interval=None, label="⏬ Downloading"):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.total = total
+        self.interval = config.PROGRESS_INTERVAL if interval is None else interval
+        self.label = label
+        self.done = 0
+        self.edits = 0
+        self._speed = None
+        self._sample = None  # (time, bytes) when the speed was last updated
+        self._shown = None
+        self._task = None
+        self._closed = False
+
+    # --- Lifecycle ---
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def close(self):
+        # The flag backs up cancel(): the Redis client can swallow a cancellation mid-command.
+        self._closed = True
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    # --- Callbacks ---
+    def update(self, done, total=None):
+        """Records that ``done`` bytes are downloaded. Matches Telethon's progress_callback signature."""
+        self.done = done
+        if total:
+            self.total = total
+
+    def add(self, nbytes):
+        self.update(self.done + nbytes)
+
+    # --- Reporting ---
+    def render(self, now=None):
+        now = time.monotonic() if now is None else now
+        if self._sample:
+            elapsed = now - self._sample[0]
+            if elapsed > 0:
+                speed = (self.done - self._sample[1]) / elapsed
+                self._speed = speed if self._speed is None else (
+                    _SPEED_SMOOTHING * speed + (1 - _SPEED_SMOOTHING) * self._speed)
+        self._sample = (now, self.done)
+
+        lines = []
+        if self.total:
+            percent = min(100, self.done * 100 // self.total)
+            lines.append(f"{self.label}... {percent}% ({format_size(self.done)} of {format_size(self.total)})")
+        else:
+            lines.append(f"{self.label}... {format_size(self.done)}")
+        if self._speed:
+            speed_line = f"{format_size(self._speed)}/s"
+            if self.total and self.total > self.done:
+                speed_line += f", about {format_duration((self.total - self.done) / self._speed)} left"
+            lines.append(speed_line)
+        return "\n".join(lines)
+
+    async def _run(self):
+        self._sample = (time.monotonic(), self.done)
+        delay = self.interval
+        while not self._closed:
+            await asyncio.sleep(delay)
+            delay = self.interval
+            if self.done == self._sample[1]:
+                continue
+            wait = await rate_limit.try_acquire()
+            if self._closed:
+                return
+            if wait:
+                # Out of tokens: try again at a random point of the next interval, so
+                # jobs that started together don't keep competing for the same refill.
+                delay = random.uniform(0, self.interval)
+                continue
+            text = self.render()
+            if text == self._shown:
+                continue
+            try:
+                await self.bot.edit_message_text(chat_id=self.chat_id, message_id=self.message_id, text=text)
+                self._shown = text
+                self.edits += 1
+            except RetryAfter as e:
+                logger.warning(f"[{self.chat_id}] Progress edits flood-limited for {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                # e.g. the user deleted the status message; the job itself carries on.
+                logger.debug(f"[{self.chat_id}] Could not update progress: {e}")
+            except Exception as e:
+                logger.warning(f"[{self.chat_id}] Could not update progress: {e}")
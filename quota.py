@@ -0,0 +1,135 @@
+# quota.py
+"""
+Atomic daily-quota reservations.
+
+Before a file is queued, its size is reserved against the user's daily
+limit in a single atomic step, so concurrent uploads from one user can
+never overshoot the limit. The worker commits the reservation when the
+job succeeds and refunds it when the job fails.
+
+Two backends are available (config.QUOTA_BACKEND):
+- "redis": one Lua call per file against a counter seeded from MongoDB.
+  The counter is keyed by the start of the user's usage period: the UTC
+  day, or a later `last_reset_day` such as a premium upgrade. A new day
+  therefore starts a fresh counter on first use, with no nightly reset.
+  The MongoDB `daily_usage` field is brought up to date when the job commits.
+- "mongo": a conditional update whose filter contains the limit, so the
+  reservation itself is the charge and commit has nothing left to do.
+
+Either way usage is charged to the UTC day the reservation was made, which
+travels with it, so a job that finishes after midnight neither counts
+against the new day nor refunds it.
+"""
+import asyncio
+import logging
+import weakref
+from datetime import datetime, timezone
+
+import redis.asyncio as aioredis
+
+import async_database
+import config
+
+logger = logging.getLogger(__name__)
+
+# Counters outlive a usage period so a late refund still finds its counter.
+_KEY_TTL = 2 * 86400
+
+# KEYS[1] = counter, ARGV = bytes, limit, seed (usage already recorded in MongoDB), ttl
+_RESERVE_SCRIPT = """
+local used = redis.call('GET', KEYS[1])
+if not used then
+    used = tonumber(ARGV[3])
+else
+    used = tonumber(used)
+end
+local total = used + tonumber(ARGV[1])
+if total > tonumber(ARGV[2]) then
+    return -1
+end
+redis.call('SET', KEYS[1], total, 'EX', tonumber(ARGV[4]))
+return total
+"""
+
+# KEYS[1] = counter, ARGV[1] = bytes. Never lets the counter go negative.
+_REFUND_SCRIPT = """
+local used = tonumber(redis.call('GET', KEYS[1]) or '0')
+local remaining = math.max(used - tonumber(ARGV[1]), 0)
+redis.call('SET', KEYS[1], remaining, 'KEEPTTL')
+return remaining
+"""
+
+# redis.asyncio clients are bound to the loop they were created on.
+_clients = weakref.WeakKeyDictionary()
+
+
+def _get_redis():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = aioredis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=0)
+        client.reserve_script = client.register_script(_RESERVE_SCRIPT)
+        client.refund_script = client.register_script(_REFUND_SCRIPT)
+        _clients[loop] = client
+    return client
+
+
+def _usage_period(db_user):
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    started = max(db_user.get("last_reset_day") or today, today)
+    return int(started.replace(tzinfo=timezone.utc).timestamp())
+
+
+def _counter_key(user_id, period):
+    return f"quota:{user_id}:{period}"
+
+
+async def reserve(db_user, nbytes):
+    """
+    Atomically reserves ``nbytes`` of the user's daily quota.
+
+    Returns a reservation dict (JSON-serialisable, so it can travel with
+    the job) or None if the file would exceed the daily limit.
+    """
+    user_id = db_user["user_id"]
+    day = async_database.utc_day()
+    if config.QUOTA_BACKEND == "redis":
+        period = _usage_period(db_user)
+        total = await _get_redis().reserve_script(
+            keys=[_counter_key(user_id, period)],
+            args=[nbytes, db_user["daily_limit_bytes"], async_database.current_usage(db_user), _KEY_TTL],
+        )
+        if total < 0:
+            return None
+        return {"user_id": user_id, "bytes": nbytes, "backend": "redis", "period": period, "day": day}
+
+    if not await async_database.reserve_usage(user_id, nbytes, day):
+        return None
+    return {"user_id": user_id, "bytes": nbytes, "backend": "mongo", "day": day}
+
+
+async def commit(reservation):
+    """Makes a reservation permanent once its job has succeeded."""
+    if not reservation:
+        return
+    if reservation["backend"] == "redis":
+        # The Redis counter already includes these bytes; record them in MongoDB too.
+        await async_database.update_usage(reservation["user_id"], reservation["bytes"], reservation.get("day"))
+    logger.debug(f"Committed {reservation['bytes']} bytes of quota for user {reservation['user_id']}")
+
+
+async def refund(reservation):
+    """Returns a reservation's bytes to the user's quota after a failed job."""
+    if not reservation:
+        return
+    try:
+        if reservation["backend"] == "redis":
+            await _get_redis().refund_script(
+                keys=[_counter_key(reservation["user_id"], reservation["period"])],
+                args=[reservation["bytes"]],
+            )
+        else:
+            await async_database.refund_usage(reservation["user_id"], reservation["bytes"], reservation.get("day"))
+        logger.info(f"Refunded {reservation['bytes']} bytes of quota to user {reservation['user_id']}")
+    except Exception as e:
+        logger.error(f"Failed to refund quota for user {reservation['user_id']}: {e}")
@@ -0,0 +1,99 @@
+# rate_limit.py
+"""
+A token bucket shared by every process through Redis.
+
+Telegram throttles a bot as a whole (roughly 30 requests per second), no
+matter how many worker processes send them. Each bucket is one Redis
+hash refilled lazily by a Lua script, so all processes draw from the same
+tokens without a central coordinator.
+
+If Redis is unreachable, `acquire` lets the request through (fails open):
+an occasional 429 from Telegram is better than a stalled job.
+"""
+import asyncio
+import logging
+import time
+import weakref
+
+import redis.asyncio as aioredis
+
+import config
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM = "telegram"
+BROADCAST = "broadcast"
+# Every job asks the limiter on its own, so cap the calls in flight per
+# loop below the Redis client's connection limit (100 by default).
+_MAX_CONCURRENT_CALLS = 16
+
+# KEYS[1] = bucket, ARGV = rate (tokens/s), burst, now (ms), cost.
+# Returns 0 when the tokens were taken, otherwise the ms until they would be available.
+_ACQUIRE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = math.ceil((cost - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return wait
+"""
+
+# redis.asyncio clients are bound to the loop they were created on.
+_clients = weakref.WeakKeyDictionary()
+
+
+def _get_redis():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = aioredis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=0)
+        client.acquire_script = client.register_script(_ACQUIRE_SCRIPT)
+        client.call_slots = asyncio.Semaphore(_MAX_CONCURRENT_CALLS)
+        _clients[loop] = client
+    return client
+
+
+def _limits(name):
+    if name == TELEGRAM:
+        return config.TELEGRAM_RATE_LIMIT, config.TELEGRAM_RATE_BURST
+    if name == BROADCAST:
+        return config.BROADCAST_RATE_LIMIT, config.BROADCAST_RATE_BURST
+    raise ValueError(f"Unknown rate limit bucket: {name}")
+
+
+async def try_acquire(name=TELEGRAM, cost=1):
+    """
+    Takes ``cost`` tokens from the bucket if it has them. Returns 0 on
+    success, otherwise the seconds until the tokens would be available.
+    """
+    rate, burst = _limits(name)
+    client = _get_redis()
+    try:
+        async with client.call_slots:
+            wait_ms = await client.acquire_script(
+                keys=[f"ratelimit:{name}"], args=[rate, burst, int(time.time() * 1000), cost]
+            )
+    except aioredis.RedisError as e:
+        logger.warning(f"Rate limiter unavailable, letting the request through: {e}")
+        return 0
+    return wait_ms / 1000
+
+
+async def acquire(name=TELEGRAM, cost=1):
+    """Waits until ``cost`` tokens could be taken from the bucket."""
+    while True:
+        wait = await try_acquire(name, cost)
+        if not wait:
+            return
+        await asyncio.sleep(wait)
@@ -0,0 +1,83 @@
+# reaper.py
+"""
+Deletes public files once their expiry (files.expires_at) has passed.
+
+Each run reads expired files oldest first through the expires_at index,
+so it never scans PUBLIC_FILES_DIR. They are removed in batches of
+FILE_REAPER_BATCH_SIZE, with one bulk database update per batch and a
+pause between batches so downloads being served keep their disk
+bandwidth. A run stops after FILE_REAPER_MAX_PER_RUN files; a backlog is
+worked off over the following runs. Blobs that lose their last link are
+deleted after storage.BLOB_RECLAIM_GRACE, by a later run.
+
+Usage:
+    python3 reaper.py           # runs every FILE_REAPER_INTERVAL seconds
+    python3 reaper.py --once    # a single run, e.g. from cron
+"""
+import argparse
+import logging
+import time
+from datetime import datetime
+
+import config
+import database
+import metrics
+import storage
+
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def reap(batch_size=None, pause=None, max_files=None):
+    """Runs one pass. Returns (expired files, blobs reclaimed, bytes freed)."""
+    batch_size = batch_size or config.FILE_REAPER_BATCH_SIZE
+    pause = config.FILE_REAPER_BATCH_PAUSE if pause is None else pause
+    max_files = max_files or config.FILE_REAPER_MAX_PER_RUN
+    now = datetime.utcnow()
+
+    expired, freed = 0, 0
+    while expired < max_files:
+        batch = list(database.get_expired_files(now, min(batch_size, max_files - expired)))
+        if not batch:
+            break
+        freed += storage.expire_files(batch)
+        expired += len(batch)
+        if len(batch) == batch_size:
+            time.sleep(pause)
+
+    blob_count, blob_bytes = storage.reclaim_unreferenced_blobs(limit=max_files)
+    freed += blob_bytes
+
+    metrics.incr("reaper", "files_expired", expired)
+    metrics.incr("reaper", "blobs_reclaimed", blob_count)
+    metrics.incr("reaper", "bytes_reclaimed", freed)
+    return expired, blob_count, freed
+
+
+def run_forever(interval=None):
+    interval = interval or config.FILE_REAPER_INTERVAL
+    while True:
+        started = time.monotonic()
+        try:
+            expired, blob_count, freed = reap()
+            logger.info(f"Expired {expired} files, reclaimed {blob_count} blobs, "
+                        f"freed {freed / (1024 ** 2):.1f} MB in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            logger.error(f"Reaper run failed: {e}", exc_info=True)
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deletes expired public files")
+    parser.add_argument("--once", action="store_true", help="Run once and exit")
+    args = parser.parse_args()
+
+    if args.once:
+        expired, blob_count, freed = reap()
+        print(f"✅ Expired {expired} files, reclaimed {blob_count} blobs ({freed / (1024 ** 3):.2f} GB).")
+    else:
+        run_forever()
+
+
+if __name__ == "__main__":
+    main()
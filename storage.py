@@ -0,0 +1,274 @@
+# storage.py
+"""
+Content-addressed storage for public files.
+
+Every downloaded file is stored once as a blob under PUBLIC_FILES_DIR/.blobs,
+named by its SHA-256. Users get public aliases (hardlinks, or symlinks where
+hardlinks are unsupported) pointing at the blob, and MongoDB keeps a refcount
+per blob so unreferenced blobs can be reclaimed. Each alias lives at
+ab/cd/<id>/<name>: the id is random, so links can't be guessed, and its first
+characters shard the tree so no directory grows too large. The `files`
+collection maps each id to its path, owner, size, original name and expiry. Telegram's stable
+file_unique_id is remembered for each blob, so the same file sent again is
+linked without being downloaded at all.
+
+Files are published into the blob store without copying where possible:
+by rename when the download is on the same filesystem, otherwise by
+reflink or hardlink. If DOWNLOAD_DIR is on a different filesystem from
+PUBLIC_FILES_DIR, downloads go to STAGING_DIR on the public volume
+instead, so publishing is still a rename. A file only appears under its
+final name once it is complete.
+"""
+import errno
+import hashlib
+import logging
+import os
+import secrets
+import shutil
+import time
+from datetime import timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows; reflinks are skipped there.
+    fcntl = None
+
+import config
+import database
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = os.path.join(config.PUBLIC_FILES_DIR, ".blobs")
+os.makedirs(BLOB_DIR, exist_ok=True)
+
+# Blobs must stay unreferenced this long before cleanup may delete them.
+BLOB_RECLAIM_GRACE = timedelta(hours=1)
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+_FILE_ID_BYTES = 16  # Public file ids are 32 hex characters, too many to guess
+_MAX_NAME_BYTES = 200  # Leaves room below the usual 255-byte filename limit
+_FICLONE = 0x40049409  # Linux ioctl that shares a file's extents (btrfs, XFS)
+
+
+def _same_filesystem(a, b):
+    return os.stat(a).st_dev == os.stat(b).st_dev
+
+
+# Where downloads are written: DOWNLOAD_DIR if publishing from it is a rename,
+# otherwise a hidden staging directory on the public volume.
+if _same_filesystem(config.DOWNLOAD_DIR, config.PUBLIC_FILES_DIR):
+    STAGING_DIR = config.DOWNLOAD_DIR
+else:
+    STAGING_DIR = os.path.join(config.PUBLIC_FILES_DIR, ".staging")
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    logger.info(f"{config.DOWNLOAD_DIR} is on another filesystem; downloading into {STAGING_DIR} instead.")
+
+
+def sanitize_filename(filename):
+    """Reduces a filename to characters that are safe in a URL path."""
+    return "".join(c for c in filename if c.isalnum() or c in ('.', '_', '-')) or "file"
+
+
+def file_sha256(path):
+    """Returns the hex SHA-256 of a file, reading it in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _blob_path(sha256):
+    return os.path.join(BLOB_DIR, sha256[:2], sha256)
+
+
+# --- Publishing ---
+def _reflink(source_path, dest_path):
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(source_path, "rb") as src, open(dest_path, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+
+def _copy(source_path, dest_path):
+    shutil.copyfile(source_path, dest_path)
+    with open(dest_path, "rb+") as f:
+        os.fsync(f.fileno())
+
+
+def place(source_path, dest_path, copy=False):
+    """
+    Puts a file at ``dest_path`` atomically and returns how it got there:
+    "rename", "reflink", "hardlink" or "copy".
+
+    The file is moved unless ``copy=True``, in which case the source is left
+    in place. Anything other than a rename goes through a temporary name in
+    the destination directory, so ``dest_path`` never holds a partial file.
+    """
+    if not copy:
+        try:
+            os.replace(source_path, dest_path)
+            return "rename"
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        # Links and reflinks can't cross filesystems either; only a real copy can.
+        methods = (("copy", _copy),)
+    else:
+        methods = (("reflink", _reflink), ("hardlink", os.link), ("copy", _copy))
+
+    temp_path = os.path.join(os.path.dirname(dest_path), f".{secrets.token_hex(8)}.tmp")
+    try:
+        for method, func in methods:
+            try:
+                func(source_path, temp_path)
+                break
+            except OSError:
+                if method == "copy":
+                    raise
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        os.replace(temp_path, dest_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    if not copy:
+        os.remove(source_path)
+    return method
+
+
+# --- Lookup and Ingest ---
+def find_blob(file_unique_id):
+    """Returns the stored blob for a Telegram file_unique_id, or None on a miss."""
+    if not file_unique_id:
+        return None
+    blob = database.find_blob_by_unique_id(file_unique_id)
+    if blob and not os.path.exists(blob["path"]):
+        logger.warning(f"Blob {blob['_id']} is recorded but missing on disk; treating as a miss.")
+        return None
+    return blob
+
+
+def ingest(source_path, filename, file_unique_id=None, copy=False):
+    """
+    Stores a downloaded file as a blob and returns the blob document.
+
+    If a blob with the same content already exists, the new download is
+    discarded and the existing blob is returned. With ``copy=True`` the
+    source is left in place (used for local test files).
+    """
+    sha256 = file_sha256(source_path)
+    existing = database.find_blob(sha256)
+    if existing and os.path.exists(existing["path"]):
+        logger.info(f"Content hash {sha256[:12]} already stored; discarding duplicate download.")
+        if not copy:
+            os.remove(source_path)
+        return database.add_blob_unique_id(sha256, file_unique_id)
+
+    blob_path = _blob_path(sha256)
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    started = time.monotonic()
+    method = place(source_path, blob_path, copy=copy)
+    logger.info(f"Placed blob {sha256[:12]} by {method} in {time.monotonic() - started:.3f}s.")
+    metrics.incr("publish_method", method)
+
+    size = os.path.getsize(blob_path)
+    return database.create_blob(sha256, blob_path, size, filename, file_unique_id)
+
+
+# --- Public Files ---
+def public_filename(filename):
+    """Keeps a user-supplied filename as intact as a single URL path segment allows."""
+    name = "".join(c for c in filename if c.isprintable() and c not in "/\\").strip().lstrip(".")
+    name = name.encode()[:_MAX_NAME_BYTES].decode(errors="ignore")
+    return name or "file"
+
+
+def public_path(file_id, filename):
+    """Returns the path of a public file relative to PUBLIC_FILES_DIR: ab/cd/<id>/<name>."""
+    return "/".join((file_id[:2], file_id[2:4], file_id, filename))
+
+
+def link(blob, filename, owner=None, expires_at=None):
+    """
+    Publishes a blob under a new random file id and returns its path
+    relative to PUBLIC_FILES_DIR. The file is recorded in the `files`
+    collection with its original name, for Content-Disposition, and is
+    deleted by the reaper after ``expires_at`` (never if None).
+    """
+    file_id = secrets.token_hex(_FILE_ID_BYTES)
+    alias = public_path(file_id, public_filename(filename))
+    alias_path = os.path.join(config.PUBLIC_FILES_DIR, alias)
+    os.makedirs(os.path.dirname(alias_path))
+    try:
+        os.link(blob["path"], alias_path)
+    except FileNotFoundError:
+        os.rmdir(os.path.dirname(alias_path))
+        raise
+    except OSError:
+        # Some filesystems refuse hardlinks; a relative symlink works anywhere.
+        os.symlink(os.path.relpath(blob["path"], os.path.dirname(alias_path)), alias_path)
+
+    database.add_blob_reference(blob["_id"], alias)
+    database.create_file(file_id, alias, filename, blob.get("size"), owner=owner, blob=blob["_id"],
+                         expires_at=expires_at)
+    return alias
+
+
+def _remove_public_path(alias):
+    alias_path = os.path.join(config.PUBLIC_FILES_DIR, alias)
+    if os.path.lexists(alias_path):
+        os.remove(alias_path)
+    if alias.count("/") == 3:
+        try:
+            os.rmdir(os.path.dirname(alias_path))  # The file's own <id> directory
+        except OSError:
+            pass
+
+
+def unlink(sha256, alias):
+    """Removes a public file and its record, and drops its reference on the blob."""
+    _remove_public_path(alias)
+    parts = alias.split("/")
+    if len(parts) == 4:
+        database.delete_file(parts[2])
+    return database.release_blob_reference(sha256, alias)
+
+
+def expire_files(files):
+    """
+    Removes a batch of public files (documents from the `files` collection)
+    with one bulk update per collection. Returns the bytes freed directly;
+    files backed by a blob free their space once the blob is reclaimed.
+    """
+    freed = 0
+    for file in files:
+        _remove_public_path(file["path"])
+        if not file.get("blob"):
+            freed += file.get("size") or 0
+    database.release_blob_references([(f["blob"], f["path"]) for f in files if f.get("blob")])
+    database.delete_files(f["_id"] for f in files)
+    return freed
+
+
+def reclaim_unreferenced_blobs(limit=0):
+    """
+    Deletes blobs that no alias has referenced for BLOB_RECLAIM_GRACE, at most
+    ``limit`` of them (0 for no limit). Returns (count, bytes).
+    """
+    count, reclaimed = 0, 0
+    for blob in database.get_unreferenced_blobs(BLOB_RECLAIM_GRACE, limit=limit):
+        if not database.delete_blob(blob["_id"], BLOB_RECLAIM_GRACE):
+            continue  # Re-referenced since we looked.
+        if os.path.exists(blob["path"]):
+            os.remove(blob["path"])
+            reclaimed += blob.get("size", 0)
+            try:
+                os.rmdir(os.path.dirname(blob["path"]))
+            except OSError:
+                pass  # Shard directory still holds other blobs.
+        count += 1
+    return count, reclaimed
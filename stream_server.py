@@ -0,0 +1,237 @@
+# stream_server.py
+"""
+Streams files straight from Telegram to HTTP clients.
+
+In streaming mode (config.STREAMING_MODE) the bot hands out links of the
+form STREAM_BASE_URL/<token>/<filename> without downloading anything.
+When a link is requested, this server looks up the token and relays the
+requested byte range from Telegram: forwarded files through a Telethon
+client, direct uploads through the Bot API file endpoint. Nothing is
+written to disk, so files nobody downloads cost nothing.
+
+Run it with: python stream_server.py
+"""
+import asyncio
+import logging
+import math
+
+import httpx
+import telegram
+from cachetools import TTLCache
+
+import async_database
+import config
+import httputil
+from userbot_pool import UserbotPool
+
+# --- Logging Setup ---
+log_level = logging.DEBUG if config.DEBUG else logging.INFO
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=log_level
+)
+logger = logging.getLogger(__name__)
+
+# Telethon requests must be a multiple of 4 KB, at most 512 KB.
+_TELETHON_REQUEST_SIZE = 512 * 1024
+_IDLE_TIMEOUT = 30
+
+# Stream records and resolved Bot API file URLs are cached briefly so a
+# player issuing many Range requests does not hit MongoDB or Telegram each time.
+_stream_cache = TTLCache(maxsize=10_000, ttl=300)
+_file_url_cache = TTLCache(maxsize=10_000, ttl=1800)
+
+
+class ClientDisconnected(Exception):
+    """
+    The HTTP client went away mid-relay. Deliberately not a ConnectionError,
+    which the userbot pool takes to mean its Telethon connection died.
+    """
+
+
+class StreamServer:
+    """An asyncio HTTP/1.1 server that proxies Telegram files on demand."""
+
+    def __init__(self):
+        self.bot = telegram.Bot(token=config.BOT_TOKEN)
+        self.http = None
+        self.userbot = None
+
+    async def start(self, host="", port=None):
+        self.http = httpx.AsyncClient(timeout=httpx.Timeout(30, read=120))
+        if config.API_ID and config.API_HASH:
+            self.userbot = UserbotPool(loop=asyncio.get_running_loop()).start()
+        server = await asyncio.start_server(self.handle_connection, host, port or config.STREAM_SERVER_PORT)
+        return server
+
+    async def close(self):
+        if self.userbot:
+            await self.userbot.close()
+        if self.http:
+            await self.http.aclose()
+
+    # --- Connection Handling ---
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await httputil.read_request(reader, timeout=_IDLE_TIMEOUT)
+                except httputil.BadRequest as e:
+                    writer.write(httputil.simple_response(400, str(e), keep_alive=False))
+                    break
+                if request is None:
+                    break
+                await self.handle_request(request, writer)
+                await writer.drain()
+                if not request.keep_alive:
+                    break
+        except (asyncio.TimeoutError, ConnectionError, ClientDisconnected):
+            pass
+        except Exception as e:
+            logger.error(f"Unhandled error while streaming: {e}", exc_info=True)
+        finally:
+            writer.close()
+
+    async def handle_request(self, request, writer):
+        keep_alive = request.keep_alive
+        if request.method not in ("GET", "HEAD"):
+            writer.write(httputil.simple_response(405, keep_alive=keep_alive, headers={"Allow": "GET, HEAD"}))
+            return
+
+        token = request.path.strip("/").split("/", 1)[0]
+        stream = await self.get_stream(token) if token else None
+        if not stream:
+            writer.write(httputil.simple_response(404, keep_alive=keep_alive))
+            return
+        if stream["is_forwarded"] and not self.userbot:
+            writer.write(httputil.simple_response(503, "Userbot is not configured.", keep_alive=keep_alive))
+            return
+
+        size = stream["file_size"]
+        try:
+            ranges = httputil.parse_range(request.headers.get("range"), size)
+        except httputil.RangeNotSatisfiable:
+            writer.write(httputil.simple_response(416, keep_alive=keep_alive, headers={"Content-Range": f"bytes */{size}"}))
+            return
+
+        headers = {
+            "Content-Type": stream.get("mime_type") or "application/octet-stream",
+            "Content-Disposition": httputil.content_disposition(stream["file_name"]),
+            "Accept-Ranges": "bytes",
+        }
+        # Multi-range requests are answered with the first range only.
+        if ranges:
+            start, end = ranges[0]
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        else:
+            start, end, status = 0, size - 1, 200
+        headers["Content-Length"] = str(end - start + 1)
+
+        file_url = None
+        if not stream["is_forwarded"]:
+            try:
+                file_url = await self.get_file_url(stream["file_id"])
+            except telegram.error.TelegramError as e:
+                logger.warning(f"Could not resolve Bot API file for stream {token}: {e}")
+                writer.write(httputil.simple_response(502, keep_alive=keep_alive))
+                return
+
+        writer.write(httputil.response_head(status, headers, keep_alive))
+        if request.method == "HEAD" or end < start:
+            return
+
+        # Once the head is sent, an upstream failure can only be signalled by
+        # cutting the connection short, which clients treat as an incomplete body.
+        if stream["is_forwarded"]:
+            # Not retried: part of the body may already be on the wire.
+            await self.userbot.run(_relay_telethon, stream, start, end, writer, retry=False)
+        else:
+            await self.relay_bot_api(file_url, start, end, writer)
+
+    # --- Lookups ---
+    async def get_stream(self, token):
+        stream = _stream_cache.get(token)
+        if stream is None:
+            stream = await async_database.get_stream(token)
+            if stream:
+                _stream_cache[token] = stream
+        return stream
+
+    async def get_file_url(self, file_id):
+        url = _file_url_cache.get(file_id)
+        if url is None:
+            tg_file = await self.bot.get_file(file_id)
+            url = _file_url_cache[file_id] = tg_file.file_path
+        return url
+
+    # --- Upstream Relays ---
+    async def relay_bot_api(self, url, start, end, writer):
+        remaining = end - start + 1
+        async with self.http.stream("GET", url, headers={"Range": f"bytes={start}-{end}"}) as response:
+            response.raise_for_status()
+            # If the upstream ignored our Range header, skip to the start ourselves.
+            skip = start if response.status_code == 200 else 0
+            async for chunk in response.aiter_bytes():
+                if skip:
+                    dropped = min(skip, len(chunk))
+                    chunk, skip = chunk[dropped:], skip - dropped
+                chunk = chunk[:remaining]
+                writer.write(chunk)
+                await writer.drain()
+                remaining -= len(chunk)
+                if remaining <= 0:
+                    break
+
+
+async def _relay_telethon(client, stream, start, end, writer):
+    """Relays bytes ``start..end`` of a forwarded file using a Telethon client."""
+    message = await client.get_messages(stream["chat_id"], ids=stream["message_id"])
+    if not message or not message.media:
+        raise ValueError(f"Stream {stream['_id']} points at a message without media.")
+
+    aligned = start - start % _TELETHON_REQUEST_SIZE
+    skip = start - aligned
+    remaining = end - start + 1
+    chunks = math.ceil((end + 1 - aligned) / _TELETHON_REQUEST_SIZE)
+
+    async for chunk in client.iter_download(
+        message.media, offset=aligned, limit=chunks,
+        request_size=_TELETHON_REQUEST_SIZE, file_size=stream["file_size"]
+    ):
+        if skip:
+            chunk, skip = chunk[skip:], 0
+        chunk = chunk[:remaining]
+        try:
+            writer.write(chunk)
+            await writer.drain()
+        except ConnectionError as e:
+            # Players abort Range requests all the time; that must not look
+            # like a dead Telethon connection to the pool.
+            raise ClientDisconnected(str(e)) from e
+        remaining -= len(chunk)
+        if remaining <= 0:
+            break
+
+
+# --- Main Server Logic ---
+async def run_server():
+    """Starts the stream server and serves until cancelled."""
+    stream_server = StreamServer()
+    server = await stream_server.start()
+    print("--- Stream Server ---")
+    print(f"Listening on port {config.STREAM_SERVER_PORT}")
+    print(f"Public links start with: {config.STREAM_BASE_URL}")
+    print("---------------------")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await stream_server.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run_server())
+    except KeyboardInterrupt:
+        print("\nServer stopped.")
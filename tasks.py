@@ -1,14 +1,26 @@
 import dramatiq
 from dramatiq.brokers.redis import RedisBroker
-from telethon import TelegramClient
-import telegram
 import asyncio
+import functools
 import os
 import logging
 import time
-import shutil
+from datetime import datetime, timedelta
+from urllib.parse import quote, urlsplit
 
+import httpx
+from telegram.error import BadRequest, NetworkError
+
+import admission
 import config
+import fair_queue
+import metrics
+import parallel_download
+import progress
+import quota
+import storage
+import userbot_pool
+import worker_runtime
 
 # --- Logging Setup ---
 log_level = logging.DEBUG if config.DEBUG else logging.INFO
@@ -20,54 +32,128 @@ logger = logging.getLogger(__name__)
 
 
 # --- Dramatiq Broker Setup ---
+class MetricsEndpoint(dramatiq.Middleware):
+    """Serves /metrics on METRICS_WORKER_PORT from the first worker process on this host to bind it."""
+
+    def after_worker_boot(self, broker, worker):
+        metrics.serve(config.METRICS_WORKER_PORT)
+
+
 redis_broker = RedisBroker(host=config.REDIS_HOST, port=config.REDIS_PORT)
+redis_broker.add_middleware(fair_queue.FairShareMiddleware())
+redis_broker.add_middleware(MetricsEndpoint())
 dramatiq.set_broker(redis_broker)
 
 
 # --- File Handling Logic ---
-def _move_and_get_link(source_path, chat_id, is_local_test=False):
-    """Moves or copies the file to the public directory and returns the public link."""
-    filename = os.path.basename(source_path)
-    safe_filename = "".join(c for c in filename if c.isalnum() or c in ('.', '_', '-'))
-    destination_path = os.path.join(config.PUBLIC_FILES_DIR, safe_filename)
-
-    if is_local_test:
-        shutil.copy(source_path, destination_path)
-        logger.info(f"[{chat_id}] Copied test file to public dir: {destination_path}")
-    else:
-        # For Telethon downloads, the file is already in its final-named temp location.
-        # For Bot API, it's a generic name. In both cases, we move it.
-        shutil.move(source_path, destination_path)
-        logger.info(f"[{chat_id}] Moved file to public dir: {destination_path}")
+def _public_link(alias):
+    return f"{config.BASE_URL}/{quote(alias)}"
+
+def _expires_at(is_premium):
+    """Returns when a file published now for this tier expires, or None if it doesn't."""
+    days = config.FILE_TTL_PREMIUM_DAYS if is_premium else config.FILE_TTL_FREE_DAYS
+    return datetime.utcnow() + timedelta(days=days) if days > 0 else None
 
-    public_link = f"{config.BASE_URL}/{safe_filename}"
-    return public_link
+def _move_and_get_link(source_path, chat_id, is_local_test=False, file_unique_id=None, file_name=None,
+                       owner=None, expires_at=None):
+    """Stores the file in the deduplicated blob store and returns a public link to it."""
+    filename = file_name or os.path.basename(source_path)
+    started = time.monotonic()
+
+    # Local test files are copied so the original stays where the user left it.
+    blob = storage.ingest(source_path, filename, file_unique_id=file_unique_id, copy=is_local_test)
+    alias = storage.link(blob, filename, owner=owner, expires_at=expires_at)
+    elapsed = time.monotonic() - started
+    metrics.observe("publish_seconds", elapsed)
+    logger.info(f"[{chat_id}] Published blob {blob['_id'][:12]} as: {alias} ({elapsed:.2f}s)")
+
+    return _public_link(alias)
+
+def _link_existing(file_unique_id, chat_id, file_name=None, owner=None, expires_at=None):
+    """Returns a link to an already stored copy of the file, or None on a dedup miss."""
+    blob = storage.find_blob(file_unique_id)
+    if not blob:
+        return None
+    try:
+        alias = storage.link(blob, file_name or blob["filename"], owner=owner, expires_at=expires_at)
+    except FileNotFoundError:
+        logger.warning(f"[{chat_id}] Blob {blob['_id'][:12]} vanished while linking; downloading instead.")
+        return None
+    logger.info(f"[{chat_id}] Dedup hit for {file_unique_id}; linked blob {blob['_id'][:12]} as: {alias}")
+    return _public_link(alias)
 
 
 # --- Asynchronous Download Logic ---
-async def _download_with_bot_api(bot, file_id, chat_id):
-    """Downloads a file using the python-telegram-bot library (for direct uploads)."""
+_STREAM_CHUNK_SIZE = 256 * 1024
+
+def _record_download(method, started, path):
+    elapsed = time.monotonic() - started
+    metrics.observe("download_seconds", elapsed, method=method)
+    if elapsed > 0:
+        metrics.observe("download_bytes_per_second", os.path.getsize(path) / elapsed, method=method)
+
+async def _download_with_bot_api(bot, file_id, chat_id, reporter):
+    """
+    Downloads a file from the Bot API file endpoint (for direct uploads).
+    With a local Bot API server the file is already on disk and is only
+    linked into the staging directory.
+    """
     logger.info(f"[{chat_id}] Downloading via Bot API for file_id: {file_id}")
-    tg_file = await bot.get_file(file_id)
+    started = time.monotonic()
+    tg_file = await bot.get_file(file_id, read_timeout=config.BOT_API_GET_FILE_TIMEOUT)
 
     unique_filename = f"{chat_id}_{int(time.time())}_{os.path.basename(tg_file.file_path or 'unknown_file')}"
-    temp_filepath = os.path.join(config.DOWNLOAD_DIR, unique_filename)
+    temp_filepath = os.path.join(storage.STAGING_DIR, unique_filename)
 
     logger.info(f"[{chat_id}] Bot API downloading to: {temp_filepath}")
-    await tg_file.download_to_drive(temp_filepath)
+    if urlsplit(tg_file.file_path or "").scheme not in ("http", "https"):
+        # A local Bot API server (--local) hands out paths on its own disk. The
+        # server keeps its file, so take it over by hardlink rather than a copy.
+        method = await asyncio.to_thread(storage.place, tg_file.file_path, temp_filepath, True)
+        metrics.incr("bot_api_handoff", method)
+        _record_download("bot_api_local", started, temp_filepath)
+        logger.info(f"[{chat_id}] Took the file over from the local Bot API server by {method}.")
+    else:
+        # Streamed in chunks (rather than File.download_to_drive) so progress can be reported.
+        reporter.update(0, tg_file.file_size)
+        http = worker_runtime.get_runtime().http
+        try:
+            async with http.stream("GET", tg_file.file_path) as response:
+                response.raise_for_status()
+                with open(temp_filepath, "wb") as f:
+                    async for chunk in response.aiter_bytes(_STREAM_CHUNK_SIZE):
+                        f.write(chunk)
+                        reporter.add(len(chunk))
+        except BaseException:
+            # Bot API files are small enough to fetch again; don't leave the partial behind.
+            if os.path.exists(temp_filepath):
+                os.remove(temp_filepath)
+            raise
+        _record_download("bot_api", started, temp_filepath)
     logger.info(f"[{chat_id}] Bot API download finished.")
     return temp_filepath
 
-async def _download_with_telethon(chat_id, original_message_id):
-    """Downloads a forwarded file using the Telethon (userbot) library."""
-    logger.info(f"[{chat_id}] Downloading via Telethon for message_id: {original_message_id}")
+def _partial_download_prefix(chat_id, original_message_id):
+    return f"{chat_id}_{original_message_id}_"
 
-    client = TelegramClient(config.SESSION_NAME, config.API_ID, config.API_HASH)
-    temp_filepath = None
-    try:
-        await client.connect()
-        logger.info(f"[{chat_id}] Telethon client connected.")
+def _partial_download_path(chat_id, original_message_id, filename):
+    """
+    Where a forwarded file is downloaded. The path only depends on the job,
+    so a retried job finds and resumes the previous attempt's partial file.
+    """
+    name = _partial_download_prefix(chat_id, original_message_id) + storage.sanitize_filename(filename)
+    return os.path.join(storage.STAGING_DIR, name)
+
+async def _download_with_telethon(chat_id, original_message_id, reporter, disk=None):
+    """
+    Downloads a forwarded file using a pooled, already-connected Telethon
+    (userbot) client. Returns the local path and the file's original name.
+    Once the file is preallocated, ``disk`` (an admission reservation)
+    shrinks by the space it already takes up.
+    """
+    logger.info(f"[{chat_id}] Downloading via Telethon for message_id: {original_message_id}")
 
+    async def _download(client):
         # Get the message object using its ID in the bot's chat
         message = await client.get_messages(chat_id, ids=original_message_id)
         if not message or not message.media:
@@ -76,51 +162,120 @@ async def _download_with_telethon(chat_id, original_message_id):
         # Define a path for the downloaded file in the temp directory
         # The filename from Telethon is usually reliable.
         filename = message.file.name if message.file and message.file.name else f"telethon_{chat_id}_{original_message_id}.dat"
-        temp_filepath = os.path.join(config.DOWNLOAD_DIR, filename)
+        temp_filepath = _partial_download_path(chat_id, original_message_id, filename)
 
         # Download the media from the message
         logger.info(f"[{chat_id}] Telethon downloading to: {temp_filepath}")
-        await client.download_media(message, file=temp_filepath)
+        started = time.monotonic()
+        await parallel_download.download_message_media(
+            client, message, temp_filepath, progress_callback=reporter.update,
+            allocated_callback=functools.partial(admission.allocated, disk, temp_filepath)
+        )
+        _record_download("telethon", started, temp_filepath)
         logger.info(f"[{chat_id}] Telethon download finished.")
-        return temp_filepath
-    finally:
-        if client.is_connected():
-            await client.disconnect()
-            logger.info(f"[{chat_id}] Telethon client disconnected.")
+        return temp_filepath, filename
+
+    return await userbot_pool.get_pool().run(_download)
 
 
 # --- Main Processing Logic ---
-async def _run_processing_logic(bot_token, chat_id, status_message_id, original_message_id, file_id=None, local_path=None, is_forwarded=False):
-    """This async function contains all the logic that interacts with the Telegram API."""
-    bot = telegram.Bot(token=bot_token)
+def _is_transient(error):
+    """True for errors a later attempt may not hit again, like a dropped connection."""
+    if isinstance(error, NetworkError):
+        # BadRequest is a NetworkError too, but retrying won't change Telegram's answer.
+        return not isinstance(error, BadRequest)
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, (parallel_download.PartFetchError, ConnectionError, asyncio.TimeoutError,
+                              httpx.TransportError))
+
+async def handle_job(bot, chat_id, status_message_id, original_message_id, file_id=None, local_path=None, is_forwarded=False,
+                     file_unique_id=None, file_name=None, reservation=None, user_id=None, is_premium=False,
+                     file_size=None, deferred_since=None):
+    """
+    Processes one file job: download (or dedup hit), publish, and report the
+    link to the user. ``bot`` is an initialized telegram.Bot on the running loop.
+
+    Transient errors are re-raised so Dramatiq retries the job; the retry
+    resumes a partial download and keeps the quota reservation. Once the
+    retries run out, ``handle_job_failure`` reports the error instead.
+
+    Before downloading, the file's size is reserved on disk (see
+    admission.py). If it doesn't fit yet, the job is queued again with a
+    delay, keeping its quota reservation, and this attempt ends quietly.
+    """
     temp_filepath = None
+    disk = None
     is_local_test = bool(local_path)
+    owner = user_id or chat_id  # Jobs queued before user_id was passed along only have the chat
+    expires_at = _expires_at(is_premium)
 
     try:
         await bot.edit_message_text(chat_id=chat_id, message_id=status_message_id, text="⏳ File processing started...")
 
-        if is_forwarded:
-            temp_filepath = await _download_with_telethon(chat_id, original_message_id)
-        elif file_id:
-            temp_filepath = await _download_with_bot_api(bot, file_id, chat_id)
-        elif local_path and config.LOCAL_TEST_MODE:
-            logger.info(f"[{chat_id}] Using local file: {local_path}")
-            if not os.path.exists(local_path):
-                raise FileNotFoundError(f"Local test file not found: {local_path}")
-            temp_filepath = local_path
-        else:
-            raise ValueError("Task called with invalid parameters.")
+        # The same Telegram file may already be stored; if so, skip the download entirely.
+        direct_link = await asyncio.to_thread(
+            _link_existing, file_unique_id, chat_id, file_name, owner=owner, expires_at=expires_at
+        )
 
-        direct_link = _move_and_get_link(temp_filepath, chat_id, is_local_test)
+        if not direct_link and config.ADMISSION_ENABLED and file_size:
+            disk = await admission.reserve(file_size)
+            if disk is None:
+                await _defer_for_disk(
+                    bot, chat_id, status_message_id, file_size, deferred_since,
+                    dict(status_message_id=status_message_id, original_message_id=original_message_id,
+                         file_id=file_id, local_path=local_path, is_forwarded=is_forwarded,
+                         file_unique_id=file_unique_id, file_name=file_name, reservation=reservation,
+                         file_size=file_size),
+                    user_id=user_id, is_premium=is_premium,
+                )
+                return  # Skips the quota commit below; the deferred job carries the reservation
+
+        if not direct_link:
+            # Progress edits stop before the final status edit below.
+            async with progress.ProgressReporter(bot, chat_id, status_message_id) as reporter:
+                if is_forwarded:
+                    temp_filepath, original_name = await _download_with_telethon(
+                        chat_id, original_message_id, reporter, disk)
+                    file_name = file_name or original_name
+                elif file_id:
+                    temp_filepath = await _download_with_bot_api(bot, file_id, chat_id, reporter)
+                elif local_path and config.LOCAL_TEST_MODE:
+                    logger.info(f"[{chat_id}] Using local file: {local_path}")
+                    if not os.path.exists(local_path):
+                        raise FileNotFoundError(f"Local test file not found: {local_path}")
+                    temp_filepath = local_path
+                else:
+                    raise ValueError("Task called with invalid parameters.")
+
+            direct_link = await asyncio.to_thread(
+                _move_and_get_link, temp_filepath, chat_id, is_local_test, file_unique_id, file_name,
+                owner=owner, expires_at=expires_at
+            )
 
         await bot.edit_message_text(
             chat_id=chat_id, message_id=status_message_id,
-            text=f"✅ File processed successfully!\n\nYour direct link is:\n{direct_link}",
+            text=f"✅ File processed successfully!\n\nYour direct link is:\n{direct_link}"
+                 + (f"\n\nThe link works until {expires_at:%Y-%m-%d}." if expires_at else ""),
             disable_web_page_preview=True
         )
 
     except Exception as e:
+        if _is_transient(e):
+            metrics.incr("job_retries", type(e).__name__)
+            logger.warning(f"[{chat_id}] Transient error, the job will be retried: {e}")
+            try:
+                await bot.edit_message_text(
+                    chat_id=chat_id, message_id=status_message_id,
+                    text="⚠️ Connection problem. Retrying shortly; the download will continue where it stopped..."
+                )
+            except Exception:
+                pass
+            raise
+
+        metrics.incr("job_failures", type(e).__name__)
         logger.error(f"[{chat_id}] A critical error occurred in processing task: {e}", exc_info=True)
+        await quota.refund(reservation)
         try:
             await bot.edit_message_text(
                 chat_id=chat_id, message_id=status_message_id,
@@ -129,24 +284,129 @@ async def _run_processing_logic(bot_token, chat_id, status_message_id, original_
         except Exception as notify_error:
             logger.error(f"[{chat_id}] Failed to notify user of the error: {notify_error}")
 
+    else:
+        try:
+            await quota.commit(reservation)
+        except Exception as e:
+            # The user already has their link; don't report the job as failed.
+            logger.error(f"[{chat_id}] Failed to commit quota reservation: {e}")
+
     finally:
+        await admission.release(disk)
         # Cleanup temp file if it's not a local test file and was actually downloaded
         if not is_local_test and temp_filepath and os.path.exists(temp_filepath):
             if file_id or is_forwarded:
                  os.remove(temp_filepath)
                  logger.info(f"[{chat_id}] Cleaned up temporary file: {temp_filepath}")
 
-# --- Dramatiq Actor Definition ---
-@dramatiq.actor(max_retries=3, time_limit=7200_000) # 2-hour time limit
-def process_file(chat_id, status_message_id, original_message_id, file_id=None, local_path=None, is_forwarded=False):
-    """Synchronous Dramatiq actor that runs the async processing logic."""
+async def _defer_for_disk(bot, chat_id, status_message_id, file_size, deferred_since, job_kwargs, user_id, is_premium):
+    """Queues the job again once disk space is likely to be free, or raises DiskFull if it never will be."""
+    now = time.time()
+    deferred_since = deferred_since or now
+    if not admission.fits_at_all(file_size):
+        raise admission.DiskFull("The file is larger than the server's free storage.")
+    if now - deferred_since > config.ADMISSION_MAX_WAIT:
+        raise admission.DiskFull("The server has been out of disk space for too long. Please try again later.")
+
+    wait = await admission.expected_wait(file_size)
+    delay = min(max(wait or config.ADMISSION_RETRY_MAX, config.ADMISSION_RETRY_MIN), config.ADMISSION_RETRY_MAX)
+    enqueue_file_job(user_id, is_premium, chat_id, delay=delay, deferred_since=deferred_since, **job_kwargs)
+    logger.info(f"[{chat_id}] Not enough disk space for {file_size} bytes; retrying in {delay:.0f}s")
+
+    eta = f"about {progress.format_duration(wait)}" if wait else "once space is freed"
+    try:
+        await bot.edit_message_text(
+            chat_id=chat_id, message_id=status_message_id,
+            text=f"⏳ Waiting for free disk space on the server. Your file will start {eta}."
+        )
+    except Exception:
+        pass
+
+async def handle_job_failure(bot, message_data, retry_info):
+    """Gives up on a file job whose retries ran out: refunds the quota, discards partials and tells the user."""
+    (chat_id,), kwargs = message_data["args"], message_data["kwargs"]
+    metrics.incr("job_failures", "RetriesExhausted")
+    logger.error(f"[{chat_id}] Giving up on job {message_data['message_id']} after {retry_info['retries'] + 1} attempts.")
+
+    await quota.refund(kwargs.get("reservation"))
+    if kwargs.get("is_forwarded"):
+        prefix = _partial_download_prefix(chat_id, kwargs["original_message_id"])
+        for name in os.listdir(storage.STAGING_DIR):
+            if name.startswith(prefix) and not name.endswith(parallel_download.MANIFEST_SUFFIX):
+                parallel_download.discard_partial(os.path.join(storage.STAGING_DIR, name))
+    try:
+        await bot.edit_message_text(
+            chat_id=chat_id, message_id=kwargs["status_message_id"],
+            text="❌ The download kept failing and was cancelled. Please try sending the file again later."
+        )
+    except Exception as e:
+        logger.error(f"[{chat_id}] Failed to notify user of the error: {e}")
+
+# --- Dramatiq Actor Definitions ---
+def process_file_job(chat_id, status_message_id, original_message_id, file_id=None, local_path=None, is_forwarded=False,
+                     file_unique_id=None, file_name=None, reservation=None, user_id=None, is_premium=False,
+                     file_size=None, deferred_since=None):
+    """Synchronous Dramatiq actor body; runs the job on this process's shared event loop."""
     logger.info(f"Worker picked up job for chat_id={chat_id}, is_forwarded={is_forwarded}")
 
-    asyncio.run(_run_processing_logic(
-        bot_token=config.BOT_TOKEN,
+    runtime = worker_runtime.get_runtime()
+    runtime.run(handle_job(
+        runtime.bot,
         chat_id=chat_id, status_message_id=status_message_id,
         original_message_id=original_message_id,
-        file_id=file_id, local_path=local_path, is_forwarded=is_forwarded
+        file_id=file_id, local_path=local_path, is_forwarded=is_forwarded,
+        file_unique_id=file_unique_id, file_name=file_name,
+        reservation=reservation, user_id=user_id, is_premium=is_premium,
+        file_size=file_size, deferred_since=deferred_since
     ))
 
     logger.info(f"Worker finished job for chat_id={chat_id}")
+
+def process_file_failed_job(message_data, retry_info):
+    """Synchronous Dramatiq actor body for jobs whose retries ran out."""
+    runtime = worker_runtime.get_runtime()
+    runtime.run(handle_job_failure(runtime.bot, message_data, retry_info))
+
+# Runs on the premium queue so it is picked up quickly; it only makes a couple of API calls.
+process_file_failed = dramatiq.actor(
+    process_file_failed_job, actor_name="process_file_failed", queue_name=fair_queue.PREMIUM, priority=0, max_retries=3
+)
+
+# One actor per tier, each on its own queue. When a worker has jobs from both
+# waiting, the premium one runs first (lower priority value wins).
+_ACTOR_OPTIONS = dict(max_retries=3, time_limit=7200_000, on_retry_exhausted="process_file_failed")  # 2-hour time limit
+process_file = dramatiq.actor(
+    process_file_job, actor_name="process_file", queue_name=fair_queue.FREE, priority=10, **_ACTOR_OPTIONS
+)
+process_premium_file = dramatiq.actor(
+    process_file_job, actor_name="process_premium_file", queue_name=fair_queue.PREMIUM, priority=0, **_ACTOR_OPTIONS
+)
+
+
+# The coroutine behind each actor body, so async_worker.py can await it directly.
+ASYNC_HANDLERS = {
+    process_file_job: handle_job,
+    process_file_failed_job: handle_job_failure,
+}
+
+
+def enqueue_file_job(user_id, is_premium, chat_id, delay=None, **kwargs):
+    """
+    Queues a file job on the user's tier. With fair sharing enabled the job
+    waits its turn among the tier's users before it reaches Dramatiq.
+
+    A ``delay`` (seconds) is used for jobs deferred for disk space: they
+    already waited their turn, so they go straight to Dramatiq's delay queue.
+    """
+    tier = fair_queue.tier_of(is_premium)
+    actor = process_premium_file if tier == fair_queue.PREMIUM else process_file
+    kwargs.update(user_id=user_id, is_premium=is_premium)
+    message = actor.message_with_options(args=(chat_id,), kwargs=kwargs, user_id=user_id, tier=tier,
+                                         deferred=bool(delay))
+    if delay:
+        actor.broker.enqueue(message, delay=int(delay * 1000))
+    elif config.FAIR_QUEUE_ENABLED:
+        fair_queue.submit(message, user_id, tier)
+    else:
+        actor.broker.enqueue(message)
+    return message
@@ -0,0 +1,42 @@
+# tests/conftest.py
+"""
+Shared setup for the test suite.
+
+Every test runs against the in-memory stand-ins from benchmarks/fakes.py:
+mongomock for MongoDB and one shared fakeredis server (Lua scripts
+included) for Redis, so no daemon or network access is needed. Files are
+written under a temporary DOWNLOAD_DIR and PUBLIC_FILES_DIR.
+
+Run with: python -m pytest
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [_ROOT, os.path.join(_ROOT, "benchmarks")]
+
+_DIRECTORY = tempfile.mkdtemp(prefix="morphile_tests_")
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ["DOWNLOAD_DIR"] = os.path.join(_DIRECTORY, "downloads")
+os.environ["PUBLIC_FILES_DIR"] = os.path.join(_DIRECTORY, "public")
+
+import fakes  # noqa: E402
+
+fakes.use_mongomock()
+fakes.use_fakeredis()
+
+import redis  # noqa: E402
+
+import database  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    """Starts every test with empty Redis and MongoDB collections (indexes are kept)."""
+    redis.Redis().flushall()
+    for name in database.db.list_collection_names():
+        database.db[name].delete_many({})
+    yield
@@ -0,0 +1,95 @@
+# tests/test_admission.py
+import asyncio
+import os
+
+import pytest
+
+import admission
+import config
+import storage
+
+USABLE = 1000
+
+
+@pytest.fixture(autouse=True)
+def disk(monkeypatch):
+    """Every filesystem a download writes to has USABLE bytes free."""
+    monkeypatch.setattr(admission, "_usable_bytes", lambda directory: USABLE)
+
+
+def test_reservations_share_the_free_space():
+    async def main():
+        return await asyncio.gather(*(admission.reserve(300) for _ in range(4)))
+
+    reservations = asyncio.run(main())
+    assert sum(r is not None for r in reservations) == 3
+
+
+def test_release_gives_the_space_back_and_is_idempotent():
+    async def main():
+        first = await admission.reserve(600)
+        refused = await admission.reserve(600)
+        await admission.release(first)
+        await admission.release(first)
+        await admission.release(None)
+        second = await admission.reserve(600)
+        return refused, second, await admission.reserve(500)
+
+    refused, second, too_big = asyncio.run(main())
+    assert refused is None
+    assert second is not None
+    # Released twice, but still only counted back once.
+    assert too_big is None
+
+
+def test_a_reservation_lapses_at_its_deadline(monkeypatch):
+    async def main():
+        monkeypatch.setattr(config, "ADMISSION_LEASE", -1)
+        crashed = await admission.reserve(900)  # Its worker never releases it.
+        monkeypatch.setattr(config, "ADMISSION_LEASE", 3600)
+        return crashed, await admission.reserve(900)
+
+    crashed, after_deadline = asyncio.run(main())
+    assert crashed is not None
+    assert after_deadline is not None
+
+
+def test_expected_wait():
+    async def main():
+        return await admission.expected_wait(100), await admission.expected_wait(USABLE + 1)
+
+    assert asyncio.run(main()) == (0, None)
+
+
+def test_a_preallocated_download_is_not_counted_twice(monkeypatch):
+    """Free space is what the filesystem reports: USABLE minus what downloads have allocated."""
+    mb = 1024 * 1024
+    path = os.path.join(storage.STAGING_DIR, "1_2_preallocated.bin")
+
+    def usable(directory):
+        on_disk = os.stat(path).st_blocks * 512 if os.path.exists(path) else 0
+        return 10 * mb - on_disk
+    monkeypatch.setattr(admission, "_usable_bytes", usable)
+
+    async def main():
+        running = await admission.reserve(6 * mb)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.posix_fallocate(fd, 0, 6 * mb)
+            await admission.allocated(running, path, os.fstat(fd).st_blocks * 512)
+        finally:
+            os.close(fd)
+        # 4 MB are really free: the 6 MB download now occupies the disk, not its reservation.
+        fits = await admission.reserve(3 * mb)
+        too_big = await admission.reserve(2 * mb)
+        await admission.release(running)
+        await admission.allocated(running, path, 0)  # Released already: must not come back.
+        return fits, too_big, await admission.reserve(1 * mb)
+
+    try:
+        fits, too_big, after_release = asyncio.run(main())
+    finally:
+        os.remove(path)
+    assert fits is not None
+    assert too_big is None
+    assert after_release is not None
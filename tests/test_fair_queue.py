@@ -0,0 +1,125 @@
+# tests/test_fair_queue.py
+import dramatiq
+import pytest
+from dramatiq.broker import MessageProxy
+from dramatiq.brokers.stub import StubBroker
+from dramatiq.middleware import TimeLimitExceeded
+
+import config
+import fair_queue
+
+TIER = fair_queue.FREE
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = StubBroker()
+    broker.declare_queue(TIER)
+    dramatiq.set_broker(broker)
+    monkeypatch.setattr(config, "FAIR_QUEUE_ENABLED", True)
+    monkeypatch.setattr(config, "FAIR_QUEUE_BORROW", False)
+    monkeypatch.setattr(config, "FAIR_QUEUE_USER_CAP", 10)
+    monkeypatch.setitem(fair_queue._SLOTS, TIER, 1)
+    return broker
+
+
+def job(name, user_id):
+    return dramatiq.Message(queue_name=TIER, actor_name="process_file", args=(name,), kwargs={},
+                            options={"user_id": user_id})
+
+
+def enqueued(broker):
+    return [dramatiq.Message.decode(data).args[0] for data in broker.queues[TIER].queue]
+
+
+def finish(message_name, broker, messages):
+    message = messages[message_name]
+    fair_queue.release(message.message_id, message.options["user_id"], TIER)
+
+
+def test_jobs_are_released_round_robin_across_users(broker):
+    messages = {name: job(name, user_id) for name, user_id in
+                [("a1", 1), ("a2", 1), ("a3", 1), ("b1", 2), ("b2", 2)]}
+    for message in messages.values():
+        fair_queue.submit(message, message.options["user_id"], TIER)
+
+    # One slot: a1 runs straight away, everything else waits its turn.
+    assert enqueued(broker) == ["a1"]
+    assert fair_queue.waiting(TIER) == 4
+    assert fair_queue.running(TIER) == 1
+
+    for name in ("a1", "a2", "b1", "a3"):
+        finish(name, broker, messages)
+    assert enqueued(broker) == ["a1", "a2", "b1", "a3", "b2"]
+    assert fair_queue.waiting(TIER) == 0
+
+
+def test_a_user_never_exceeds_the_per_user_cap(broker, monkeypatch):
+    monkeypatch.setitem(fair_queue._SLOTS, TIER, 5)
+    monkeypatch.setattr(config, "FAIR_QUEUE_USER_CAP", 1)
+    messages = {name: job(name, user_id) for name, user_id in [("a1", 1), ("a2", 1), ("a3", 1), ("b1", 2)]}
+    for message in messages.values():
+        fair_queue.submit(message, message.options["user_id"], TIER)
+
+    assert enqueued(broker) == ["a1", "b1"]
+    assert fair_queue.waiting(TIER) == 2
+
+    finish("a1", broker, messages)
+    assert enqueued(broker) == ["a1", "b1", "a2"]
+
+
+def test_a_job_that_cannot_be_enqueued_is_put_back_at_the_front(broker, monkeypatch):
+    monkeypatch.setitem(fair_queue._SLOTS, TIER, 5)
+    dramatiq.set_broker(StubBroker())  # No queues declared, so every enqueue fails.
+    for name in ("a1", "a2"):
+        fair_queue.submit(job(name, 1), 1, TIER)
+
+    assert fair_queue.waiting(TIER) == 2
+    assert fair_queue.running(TIER) == 0
+
+    dramatiq.set_broker(broker)
+    assert fair_queue.dispatch(TIER) == 2
+    assert enqueued(broker) == ["a1", "a2"]
+
+
+@pytest.fixture
+def worker_broker(broker):
+    """The broker as a worker sees it: FairShareMiddleware after Retries, and the actor declared."""
+    broker.add_middleware(fair_queue.FairShareMiddleware())
+    dramatiq.actor(lambda name: None, actor_name="process_file", queue_name=TIER, max_retries=3, broker=broker)
+    return broker
+
+
+def attempt(broker, name, retries, exception):
+    """Runs the after_process_message hooks for a failed attempt of a released job."""
+    message = job(name, 1)
+    message.options.update(tier=TIER, retries=retries)
+    fair_queue.submit(message, 1, TIER)
+    proxy = MessageProxy(message)
+    broker.emit_after("process_message", proxy, result=None, exception=exception)
+    return proxy
+
+
+@pytest.mark.parametrize("exception", [RuntimeError("bad file"), TimeLimitExceeded()])
+def test_a_job_that_fails_for_good_gives_back_its_slots(worker_broker, exception):
+    message = attempt(worker_broker, "a1", retries=3, exception=exception)
+
+    assert message.failed
+    assert fair_queue.running(TIER) == 0
+    assert not fair_queue._get_redis().zcard(fair_queue._user_running_key(1))
+
+
+def test_a_job_that_will_be_retried_keeps_its_slots(worker_broker):
+    message = attempt(worker_broker, "a1", retries=1, exception=RuntimeError("flaky"))
+
+    assert not message.failed
+    assert fair_queue.running(TIER) == 1
+
+
+def test_a_successful_job_gives_back_its_slots(worker_broker):
+    message = job("a1", 1)
+    message.options["tier"] = TIER
+    fair_queue.submit(message, 1, TIER)
+    worker_broker.emit_after("process_message", MessageProxy(message), result=None, exception=None)
+
+    assert fair_queue.running(TIER) == 0
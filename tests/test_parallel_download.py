@@ -0,0 +1,56 @@
+# tests/test_parallel_download.py
+import asyncio
+import os
+
+import fakes
+import parallel_download
+
+STALE = -3600  # A negative max_age makes every file count as untouched for too long
+
+
+def touch(directory, name, size=10):
+    with open(os.path.join(directory, name), "wb") as f:
+        f.write(b"x" * size)
+
+
+def test_download_parts_writes_the_whole_file(tmp_path):
+    path = str(tmp_path / "file.bin")
+    # The fake source's pattern covers 2 MB, enough for several parts and a short last one.
+    source = fakes.FakeFileSource(1536 * 1024 + 123, latency=0, bandwidth=1 << 40)
+    fetchers = [source.connection() for _ in range(4)]
+    asyncio.run(parallel_download.download_parts(fetchers, source.size, path, part_size=256 * 1024))
+
+    with open(path, "rb") as f:
+        assert f.read() == fakes.expected_bytes(0, source.size)
+    assert not os.path.exists(path + parallel_download.MANIFEST_SUFFIX)
+
+
+def test_download_parts_reports_the_allocated_space(tmp_path):
+    source = fakes.FakeFileSource(512 * 1024, latency=0, bandwidth=1 << 40)
+    allocated = []
+
+    async def on_allocated(nbytes):
+        allocated.append(nbytes)
+
+    asyncio.run(parallel_download.download_parts([source.connection()], source.size, str(tmp_path / "file.bin"),
+                                                 part_size=256 * 1024, allocated_callback=on_allocated))
+    assert len(allocated) == 1
+    assert 0 <= allocated[0] <= source.size
+
+
+def test_reap_partials_keeps_recent_downloads(tmp_path):
+    touch(tmp_path, "1_2_video.mp4")
+    touch(tmp_path, "3_4_big.mkv")
+    touch(tmp_path, "3_4_big.mkv" + parallel_download.MANIFEST_SUFFIX)
+    assert parallel_download.reap_partials(str(tmp_path), 3600) == (0, 0)
+
+
+def test_reap_partials_removes_abandoned_downloads_with_and_without_manifest(tmp_path):
+    touch(tmp_path, "3_4_big.mkv", size=100)
+    touch(tmp_path, "3_4_big.mkv" + parallel_download.MANIFEST_SUFFIX)
+    touch(tmp_path, "1_2_video.mp4", size=20)  # Single-stream download, no manifest
+    touch(tmp_path, "-100_1700000000_doc.pdf", size=5)  # Bot API download
+    touch(tmp_path, "notes.txt")
+
+    assert parallel_download.reap_partials(str(tmp_path), STALE) == (3, 125)
+    assert os.listdir(tmp_path) == ["notes.txt"]
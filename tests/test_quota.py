@@ -0,0 +1,80 @@
+# tests/test_quota.py
+import asyncio
+
+import pytest
+
+import config
+import database
+import quota
+
+LIMIT = 100
+
+
+@pytest.fixture(params=["redis", "mongo"])
+def backend(request, monkeypatch):
+    monkeypatch.setattr(config, "QUOTA_BACKEND", request.param)
+    return request.param
+
+
+def make_user(user_id, used=0):
+    user = {"user_id": user_id, "daily_limit_bytes": LIMIT, "daily_usage": used, "usage_day": database.utc_day()}
+    database.users.insert_one(dict(user))
+    return user
+
+
+def usage(user_id):
+    return database.users.find_one({"user_id": user_id})["daily_usage"]
+
+
+def test_reservations_never_exceed_the_daily_limit(backend):
+    user = make_user(1)
+
+    async def main():
+        return await asyncio.gather(*(quota.reserve(user, 30) for _ in range(5)))
+
+    reservations = asyncio.run(main())
+    assert sum(r is not None for r in reservations) == 3
+    assert all(r["backend"] == backend for r in reservations if r)
+
+
+def test_usage_already_recorded_counts_against_the_limit(backend):
+    user = make_user(1, used=80)
+
+    async def main():
+        return await quota.reserve(user, 30), await quota.reserve(user, 20)
+
+    too_big, fits = asyncio.run(main())
+    assert too_big is None
+    assert fits is not None
+
+
+def test_a_refund_frees_the_quota_again(backend):
+    user = make_user(1)
+
+    async def main():
+        first = await quota.reserve(user, 60)
+        refused = await quota.reserve(user, 60)
+        await quota.refund(first)
+        return first, refused, await quota.reserve(user, 60)
+
+    first, refused, after_refund = asyncio.run(main())
+    assert first is not None and refused is None
+    assert after_refund is not None
+
+
+def test_commit_records_the_usage_in_mongodb(backend):
+    user = make_user(1)
+
+    async def main():
+        await quota.commit(await quota.reserve(user, 40))
+
+    asyncio.run(main())
+    assert usage(1) == 40
+
+
+def test_refund_and_commit_accept_no_reservation():
+    async def main():
+        await quota.refund(None)
+        await quota.commit(None)
+
+    asyncio.run(main())
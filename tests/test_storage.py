@@ -0,0 +1,87 @@
+# tests/test_storage.py
+import os
+import secrets
+from datetime import timedelta
+
+import pytest
+
+import config
+import database
+import storage
+
+
+@pytest.fixture
+def download():
+    """Returns a function that writes a fresh download into STAGING_DIR."""
+    def write(content=None):
+        path = os.path.join(storage.STAGING_DIR, f"1_{secrets.token_hex(4)}_file.bin")
+        with open(path, "wb") as f:
+            f.write(content if content is not None else secrets.token_bytes(1024))
+        return path
+    return write
+
+
+@pytest.fixture
+def no_grace(monkeypatch):
+    monkeypatch.setattr(storage, "BLOB_RECLAIM_GRACE", timedelta(seconds=-1))
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_place_moves_by_rename(download):
+    source = download(b"data")
+    dest = os.path.join(storage.STAGING_DIR, "placed.bin")
+    assert storage.place(source, dest) == "rename"
+    assert not os.path.exists(source)
+    assert read(dest) == b"data"
+
+
+def test_place_with_copy_keeps_the_source(download):
+    source = download(b"data")
+    dest = os.path.join(storage.STAGING_DIR, "copied.bin")
+    assert storage.place(source, dest, copy=True) in ("reflink", "hardlink", "copy")
+    assert read(source) == read(dest) == b"data"
+    assert not [name for name in os.listdir(storage.STAGING_DIR) if name.endswith(".tmp")]
+
+
+def test_link_publishes_the_blob_under_a_random_id(download):
+    blob = storage.ingest(download(b"hello"), "report.pdf", file_unique_id="unique-1")
+    alias = storage.link(blob, "report.pdf", owner=7)
+
+    assert read(os.path.join(config.PUBLIC_FILES_DIR, alias)) == b"hello"
+    assert alias.endswith("/report.pdf") and alias.count("/") == 3
+    assert database.find_blob(blob["_id"])["refcount"] == 1
+    assert storage.find_blob("unique-1")["_id"] == blob["_id"]
+
+
+def test_the_same_content_is_stored_once(download):
+    content = secrets.token_bytes(2048)
+    first = storage.ingest(download(content), "a.bin")
+    second_path = download(content)
+    second = storage.ingest(second_path, "b.bin", file_unique_id="unique-2")
+
+    assert second["_id"] == first["_id"]
+    assert not os.path.exists(second_path)
+    assert storage.find_blob("unique-2")["_id"] == first["_id"]
+
+
+def test_reclaim_deletes_only_unreferenced_blobs(download, no_grace):
+    kept = storage.ingest(download(), "kept.bin")
+    storage.link(kept, "kept.bin")
+    dropped = storage.ingest(download(), "dropped.bin")
+    alias = storage.link(dropped, "dropped.bin")
+    storage.unlink(dropped["_id"], alias)
+
+    assert storage.reclaim_unreferenced_blobs() == (1, dropped["size"])
+    assert not os.path.exists(dropped["path"])
+    assert not os.path.lexists(os.path.join(config.PUBLIC_FILES_DIR, alias))
+    assert os.path.exists(kept["path"])
+    assert database.find_blob(kept["_id"]) is not None
+
+
+def test_reclaim_spares_blobs_within_the_grace_period(download):
+    storage.ingest(download(), "fresh.bin")
+    assert storage.reclaim_unreferenced_blobs() == (0, 0)
@@ -0,0 +1,143 @@
+# tests/test_userbot_pool.py
+import asyncio
+
+import pytest
+
+import userbot_pool
+
+
+class FakeClient:
+    """Just enough of TelegramClient for the pool: connection state and a connect counter."""
+
+    connects = 0
+    healthy = True
+
+    def __init__(self, *args):
+        self.connected = False
+
+    def is_connected(self):
+        return self.connected
+
+    async def connect(self):
+        FakeClient.connects += 1
+        self.connected = True
+
+    async def disconnect(self):
+        self.connected = False
+
+    async def is_user_authorized(self):
+        return True
+
+    async def get_me(self):
+        if not FakeClient.healthy:
+            await asyncio.sleep(60)
+        return "me"
+
+
+@pytest.fixture
+def make_pool(monkeypatch):
+    monkeypatch.setattr(userbot_pool, "TelegramClient", FakeClient)
+    monkeypatch.setattr(FakeClient, "connects", 0)
+    monkeypatch.setattr(FakeClient, "healthy", True)
+
+    def make():
+        pool = userbot_pool.UserbotPool(size=1, loop=asyncio.get_running_loop())
+        pool._clients = [userbot_pool._PooledClient(0, "test", None)]
+        return pool
+    return make
+
+
+def test_errors_from_other_io_do_not_reconnect_the_client(make_pool):
+    calls = []
+
+    async def relay(client):
+        calls.append(client)
+        raise BrokenPipeError("the HTTP client went away")
+
+    async def main():
+        with pytest.raises(BrokenPipeError):
+            await make_pool().run(relay)
+
+    asyncio.run(main())
+    assert len(calls) == 1
+    assert FakeClient.connects == 1
+
+
+def test_a_dropped_connection_is_reconnected_once_for_every_caller(make_pool):
+    async def main():
+        pool = make_pool()
+        dropped = asyncio.Event()
+
+        async def download(client):
+            if not dropped.is_set():
+                # Every download in flight fails when the shared connection drops.
+                await dropped.wait()
+                raise ConnectionError("connection lost")
+            return "done"
+
+        downloads = asyncio.gather(*(pool.run(download) for _ in range(3)))
+        await asyncio.sleep(0.01)
+        pool._clients[0].client.connected = False
+        dropped.set()
+        return await downloads
+
+    assert asyncio.run(main()) == ["done"] * 3
+    assert FakeClient.connects == 2
+
+
+def test_work_that_cannot_be_repeated_is_not_retried(make_pool):
+    calls = []
+
+    async def relay(client):
+        calls.append(client)
+        client.connected = False
+        raise ConnectionError("connection lost")
+
+    async def main():
+        pool = make_pool()
+        with pytest.raises(ConnectionError):
+            await pool.run(relay, retry=False)
+        # The next caller still gets a connected client.
+        return await pool.run(lambda client: asyncio.sleep(0, client.is_connected()))
+
+    assert asyncio.run(main()) is True
+    assert len(calls) == 1
+
+
+@pytest.fixture
+def due_health_checks(monkeypatch):
+    """Makes every acquire run a health check that times out at once."""
+    monkeypatch.setattr(userbot_pool.config, "TELETHON_HEALTHCHECK_INTERVAL", -1)
+    monkeypatch.setattr(userbot_pool.config, "TELETHON_HEALTHCHECK_TIMEOUT", 0.01)
+    monkeypatch.setattr(FakeClient, "healthy", False)
+
+
+def test_a_busy_client_is_not_health_checked(make_pool, due_health_checks):
+    async def main():
+        pool = make_pool()
+        finish = asyncio.Event()
+
+        async def download(client):
+            await finish.wait()
+            return client.is_connected()
+
+        first = asyncio.create_task(pool.run(download))
+        await asyncio.sleep(0.01)
+        # Joining the busy slot must not run get_me, let alone reconnect under the first download.
+        second = asyncio.create_task(pool.run(download))
+        await asyncio.sleep(0.05)
+        finish.set()
+        return await first, await second
+
+    assert asyncio.run(main()) == (True, True)
+    assert FakeClient.connects == 1
+
+
+def test_an_idle_client_failing_its_health_check_is_reconnected(make_pool, due_health_checks):
+    async def main():
+        pool = make_pool()
+        await pool.run(lambda client: asyncio.sleep(0))
+        await pool.run(lambda client: asyncio.sleep(0))
+
+    asyncio.run(main())
+    assert FakeClient.connects == 2
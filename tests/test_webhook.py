@@ -0,0 +1,147 @@
+# tests/test_webhook.py
+import asyncio
+import json
+
+import pytest
+import redis.asyncio as aioredis
+
+import config
+import fakes
+import webhook
+
+_SECRET = "test-secret"
+
+
+class FakeApplication:
+    """Records the updates it is given; ``handle`` decides what processing one does."""
+
+    bot = None
+
+    def __init__(self):
+        self.handled = []
+        self.handle = None
+
+    async def process_update(self, update):
+        self.handled.append(update.update_id)
+        if self.handle:
+            await self.handle(update)
+
+
+@pytest.fixture
+def app():
+    return webhook.WebhookApp(application=FakeApplication(), redis_client=aioredis.Redis(), secret=_SECRET)
+
+
+async def deliver(app, update_id):
+    """POSTs one update to the ASGI app and returns the response status."""
+    scope = {
+        "type": "http", "method": "POST", "path": app.path,
+        "headers": [(b"x-telegram-bot-api-secret-token", _SECRET.encode())],
+    }
+    body = json.dumps(fakes.file_update(update_id, user_id=1)).encode()
+    statuses = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    await app(scope, receive, send)
+    return statuses[0]
+
+
+async def ttl(app, update_id):
+    return await app.redis.ttl(f"update:{update_id}")
+
+
+def test_a_redelivered_update_is_handled_once(app):
+    async def main():
+        return [await deliver(app, 1) for _ in range(3)]
+
+    assert asyncio.run(main()) == [200, 200, 200]
+    assert app.application.handled == [1]
+    assert (app.processed, app.duplicates) == (1, 2)
+
+
+def test_the_claim_is_short_until_the_update_is_handled(app):
+    async def main():
+        during = []
+
+        async def handle(update):
+            during.append(await ttl(app, update.update_id))
+        app.application.handle = handle
+        await deliver(app, 1)
+        return during[0], await ttl(app, 1)
+
+    during, after = asyncio.run(main())
+    assert 0 < during <= config.WEBHOOK_CLAIM_TTL
+    assert after > config.WEBHOOK_CLAIM_TTL
+
+
+def test_an_update_whose_handling_failed_is_handled_on_redelivery(app):
+    async def main():
+        async def crash(update):
+            raise RuntimeError("replica died")
+        app.application.handle = crash
+        with pytest.raises(RuntimeError):
+            await deliver(app, 1)
+        app.application.handle = None
+        return await deliver(app, 1)
+
+    assert asyncio.run(main()) == 200
+    assert app.application.handled == [1, 1]
+    assert app.processed == 1
+
+
+def test_a_cancelled_update_is_handled_on_redelivery(app):
+    async def main():
+        async def hang(update):
+            await asyncio.sleep(60)
+        app.application.handle = hang
+        delivery = asyncio.create_task(deliver(app, 1))
+        while not app.application.handled:
+            await asyncio.sleep(0.01)
+        delivery.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await delivery
+        app.application.handle = None
+        return await deliver(app, 1)
+
+    assert asyncio.run(main()) == 200
+    assert app.application.handled == [1, 1]
+
+
+def test_a_redelivery_during_handling_is_deferred(app):
+    async def main():
+        release = asyncio.Event()
+
+        async def wait(update):
+            await release.wait()
+        app.application.handle = wait
+        first = asyncio.create_task(deliver(app, 1))
+        while not app.application.handled:
+            await asyncio.sleep(0.01)
+        during = await deliver(app, 1)
+        release.set()
+        return during, await first, await deliver(app, 1)
+
+    assert asyncio.run(main()) == (503, 200, 200)
+    assert app.application.handled == [1]
+    assert (app.processed, app.deferred, app.duplicates) == (1, 1, 1)
+
+
+def test_metrics_are_not_public_by_default(app):
+    scope = {"type": "http", "method": "GET", "path": "/metrics", "headers": []}
+    statuses = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    asyncio.run(app(scope, receive, send))
+    assert statuses == [404]
@@ -0,0 +1,73 @@
+# tests/test_worker_runtime.py
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import pytest
+
+import worker_runtime
+
+
+@pytest.fixture
+def runtime():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield worker_runtime.WorkerRuntime(loop=loop)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    loop.close()
+
+
+def run_in_thread(func, limit=5):
+    """Calls ``func`` on a daemon thread and returns a future of its outcome, failing the test if it hangs."""
+    future = concurrent.futures.Future()
+
+    def call():
+        try:
+            future.set_result(func())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=call, daemon=True).start()
+    done, _ = concurrent.futures.wait([future], timeout=limit)
+    assert done, f"still waiting after {limit} s"
+    return future
+
+
+def test_run_returns_the_result(runtime):
+    async def job():
+        await asyncio.sleep(0.01)
+        return 42
+
+    assert runtime.run(job()) == 42
+
+
+def test_a_job_raising_timeout_error_is_not_retried_as_a_slice(runtime):
+    # On 3.11 asyncio.TimeoutError is concurrent.futures.TimeoutError; this used to spin forever.
+    async def job():
+        raise asyncio.TimeoutError("upstream timed out")
+
+    for timeout in (None, 30):
+        started = time.monotonic()
+        future = run_in_thread(lambda: runtime.run(job(), timeout=timeout))
+        with pytest.raises(asyncio.TimeoutError, match="upstream timed out"):
+            future.result()
+        assert time.monotonic() - started < worker_runtime._WAIT_SLICE * 2
+
+
+def test_run_times_out_and_cancels_the_job(runtime):
+    cancelled = threading.Event()
+
+    async def job():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    future = run_in_thread(lambda: runtime.run(job(), timeout=0.2))
+    with pytest.raises(concurrent.futures.TimeoutError):
+        future.result()
+    assert cancelled.wait(1)
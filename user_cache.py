@@ -0,0 +1,149 @@
+# user_cache.py
+"""
+In-process read-through cache for user documents.
+
+`database.get_user` runs on every update the bot receives. This cache keeps
+recently seen users in a TTL/LRU map so hot users are served from memory.
+Every write in database.py that changes a user invalidates its entry, and
+invalidations are broadcast over Redis pub/sub so the bot, workers, admin
+CLI and cleanup script never serve each other stale quota or premium data
+for longer than it takes the message to arrive.
+"""
+import logging
+import threading
+import time
+
+import redis
+from cachetools import TTLCache
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_CHANNEL = "user_cache:invalidate"
+_CLEAR_ALL = "*"
+
+
+class UserCache:
+    """A thread-safe TTL/LRU cache of user documents with hit/miss counters."""
+
+    def __init__(self, maxsize=None, ttl=None):
+        self._cache = TTLCache(maxsize=maxsize or config.USER_CACHE_SIZE, ttl=ttl or config.USER_CACHE_TTL)
+        self._lock = threading.Lock()
+        # Bumped on every invalidation; a read-through only stores its result
+        # if no invalidation happened while it was reading from MongoDB.
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id):
+        """Returns a copy of the cached user, or None on a miss."""
+        with self._lock:
+            user = self._cache.get(user_id)
+            if user is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(user)
+
+    def generation(self):
+        """Returns a token to pass to `put` after reading a user from MongoDB."""
+        with self._lock:
+            return self._generation
+
+    def put(self, user_id, user, generation):
+        """Caches ``user`` unless it may have been invalidated since ``generation``."""
+        with self._lock:
+            if generation == self._generation:
+                self._cache[user_id] = dict(user)
+
+    def invalidate(self, user_id, publish=True):
+        """Drops one user from this process's cache and, by default, from every other process's."""
+        with self._lock:
+            self._cache.pop(user_id, None)
+            self._generation += 1
+            self.invalidations += 1
+        if publish:
+            _publish(str(user_id))
+
+    def invalidate_many(self, user_ids, publish=True):
+        """Like `invalidate` for several users, broadcast in a single message."""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        with self._lock:
+            for user_id in user_ids:
+                self._cache.pop(user_id, None)
+            self._generation += 1
+            self.invalidations += len(user_ids)
+        if publish:
+            _publish(",".join(map(str, user_ids)))
+
+    def clear(self, publish=True):
+        """Drops every cached user, e.g. after a bulk update."""
+        with self._lock:
+            self._cache.clear()
+            self._generation += 1
+            self.invalidations += 1
+        if publish:
+            _publish(_CLEAR_ALL)
+
+    def stats(self):
+        """Returns hit/miss counters and the current hit rate."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "size": len(self._cache),
+            }
+
+
+# --- Cross-process Invalidation ---
+_redis = None
+
+
+def _get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=0)
+    return _redis
+
+
+def _publish(message):
+    if not config.USER_CACHE_PUBSUB:
+        return
+    try:
+        _get_redis().publish(_CHANNEL, message)
+    except redis.exceptions.RedisError as e:
+        # Other processes will fall back to their TTL for this entry.
+        logger.warning(f"Could not broadcast user cache invalidation: {e}")
+
+
+def _listen():
+    """Applies invalidations published by other processes. Runs forever in a daemon thread."""
+    while True:
+        try:
+            pubsub = _get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(_CHANNEL)
+            # Anything published while we were disconnected is lost, so start clean.
+            cache.clear(publish=False)
+            for message in pubsub.listen():
+                data = message["data"].decode()
+                if data == _CLEAR_ALL:
+                    cache.clear(publish=False)
+                else:
+                    cache.invalidate_many((int(user_id) for user_id in data.split(",")), publish=False)
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"User cache invalidation listener disconnected: {e}")
+            time.sleep(5)
+
+
+# --- Process-wide Cache ---
+cache = UserCache()
+
+if config.USER_CACHE_PUBSUB:
+    threading.Thread(target=_listen, name="user-cache-invalidation", daemon=True).start()
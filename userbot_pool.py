@@ -0,0 +1,232 @@
+# userbot_pool.py
+"""
+Long-lived Telethon (userbot) clients shared by every job in a process.
+
+Connecting a TelegramClient costs a full MTProto handshake, and several
+worker processes opening the same SQLite .session file at once ends in
+"database is locked". Instead, each process claims its own session slot
+(a copy of the main session file, guarded by a lock file), keeps its
+clients connected on one event loop (the worker runtime's, in workers),
+and hands them out to jobs.
+"""
+import asyncio
+import atexit
+import fcntl
+import logging
+import os
+import shutil
+import threading
+import time
+
+from telethon import TelegramClient
+
+import config
+import worker_runtime
+
+logger = logging.getLogger(__name__)
+
+# What Telethon raises when its connection drops mid-request.
+_TRANSPORT_ERRORS = (ConnectionError, asyncio.IncompleteReadError)
+
+
+class _PooledClient:
+    """A single connected client plus the bookkeeping the pool needs."""
+
+    def __init__(self, slot, session_name, lock_file):
+        self.slot = slot
+        self.session_name = session_name
+        self.lock_file = lock_file
+        self.client = None
+        self.uses = 0
+        self.last_check = 0.0
+        # Bumped on every (re)connect so callers can tell whether the
+        # connection they were using has already been replaced.
+        self.generation = 0
+        self.active = 0  # Jobs currently using the client
+        self.lock = asyncio.Lock()
+
+
+class UserbotPool:
+    """
+    A per-process pool of connected Telethon clients.
+
+    Clients live on a single event loop (either the one passed in or a
+    private background thread) because Telethon connections are bound to
+    the loop they were opened on. Callers on any other loop go through
+    `run`, which hops onto the pool loop and back.
+    """
+
+    def __init__(self, size=None, loop=None):
+        self.size = size or config.TELETHON_POOL_SIZE
+        self._loop = loop
+        self._thread = None
+        self._clients = []
+        self._next = 0
+
+    # --- Lifecycle ---
+    def start(self):
+        """Claims session slots and, if needed, starts the pool's loop thread."""
+        for _ in range(self.size):
+            slot, session_name, lock_file = _claim_session_slot()
+            self._clients.append(_PooledClient(slot, session_name, lock_file))
+            logger.info(f"Claimed Telethon session slot {slot} ({session_name}.session)")
+
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="userbot-pool", daemon=True)
+            self._thread.start()
+        return self
+
+    async def close(self):
+        """Disconnects every client and releases their session slots."""
+        for pooled in self._clients:
+            if pooled.client and pooled.client.is_connected():
+                await pooled.client.disconnect()
+            fcntl.flock(pooled.lock_file, fcntl.LOCK_UN)
+            pooled.lock_file.close()
+        self._clients = []
+
+    def close_sync(self, timeout=10):
+        """Blocking variant of `close` for use from atexit and other threads."""
+        if not self._loop or self._loop.is_closed():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.close(), self._loop).result(timeout)
+        except Exception as e:
+            logger.warning(f"Failed to close Telethon pool cleanly: {e}")
+        if self._thread:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    # --- Public API ---
+    async def run(self, func, *args, retry=True, **kwargs):
+        """
+        Awaits ``func(client, *args, **kwargs)`` with a healthy pooled client
+        and returns its result. Safe to call from any event loop.
+
+        If the client's connection drops, it is reconnected and ``func`` is
+        called once more; pass ``retry=False`` when ``func`` cannot safely
+        be repeated.
+        """
+        coro = self._run(func, args, kwargs, retry)
+        if _running_loop() is self._loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._loop))
+
+    def stats(self):
+        """Returns per-slot reuse counters, mainly for logging and metrics."""
+        return {pooled.slot: pooled.uses for pooled in self._clients}
+
+    # --- Internals ---
+    async def _run(self, func, args, kwargs, retry):
+        pooled = await self._acquire()
+        generation = pooled.generation
+        try:
+            return await func(pooled.client, *args, **kwargs)
+        except _TRANSPORT_ERRORS as e:
+            # Clients are shared, so only treat this as a lost connection if
+            # the client really dropped (or another job already replaced it).
+            if pooled.client.is_connected() and pooled.generation == generation:
+                raise
+            logger.warning(f"Telethon slot {pooled.slot} lost its connection ({e!r}).")
+            if not retry:
+                raise
+        finally:
+            pooled.active -= 1
+
+        # _acquire reconnects unless another job already has.
+        pooled = await self._acquire(pooled)
+        try:
+            return await func(pooled.client, *args, **kwargs)
+        finally:
+            pooled.active -= 1
+
+    async def _acquire(self, pooled=None):
+        if pooled is None:
+            pooled = self._clients[self._next % len(self._clients)]
+            self._next += 1
+
+        async with pooled.lock:
+            if pooled.client is None:
+                pooled.client = TelegramClient(pooled.session_name, config.API_ID, config.API_HASH)
+
+            if not pooled.client.is_connected():
+                await self._connect(pooled)
+            elif not pooled.active and time.monotonic() - pooled.last_check > config.TELETHON_HEALTHCHECK_INTERVAL:
+                # Only checked while idle: a busy client answers get_me slowly, and
+                # reconnecting it would cut every download in flight on it.
+                await self._health_check(pooled)
+
+            pooled.active += 1
+            pooled.uses += 1
+            logger.debug(f"Telethon slot {pooled.slot} serving request #{pooled.uses}")
+            return pooled
+
+    async def _connect(self, pooled):
+        await pooled.client.connect()
+        if not await pooled.client.is_user_authorized():
+            raise RuntimeError(
+                f"Telethon session '{pooled.session_name}' is not authorized. "
+                "Log in once to create the main session file (see README)."
+            )
+        pooled.last_check = time.monotonic()
+        pooled.generation += 1
+        logger.info(f"Telethon slot {pooled.slot} connected.")
+
+    async def _health_check(self, pooled):
+        try:
+            await asyncio.wait_for(pooled.client.get_me(), timeout=config.TELETHON_HEALTHCHECK_TIMEOUT)
+            pooled.last_check = time.monotonic()
+        except Exception as e:
+            logger.warning(f"Telethon slot {pooled.slot} failed its health check ({e}), reconnecting.")
+            await pooled.client.disconnect()
+            await self._connect(pooled)
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _claim_session_slot():
+    """
+    Locks the first free session slot and returns (slot, session_name, lock_file).
+
+    Each slot gets its own copy of the main session file so concurrent
+    processes never share a SQLite database. The lock is released by the
+    OS if the process dies, so slots are reclaimed automatically.
+    """
+    base_session = f"{config.SESSION_NAME}.session"
+    for slot in range(config.TELETHON_SESSION_SLOTS):
+        session_name = f"{config.SESSION_NAME}_slot{slot}"
+        lock_file = open(f"{session_name}.lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            continue
+
+        if not os.path.exists(f"{session_name}.session") and os.path.exists(base_session):
+            shutil.copyfile(base_session, f"{session_name}.session")
+        return slot, session_name, lock_file
+
+    raise RuntimeError(
+        f"All {config.TELETHON_SESSION_SLOTS} Telethon session slots are in use. "
+        "Increase TELETHON_SESSION_SLOTS or run fewer worker processes."
+    )
+
+
+# --- Process-wide Pool ---
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns this process's pool, starting it on first use on the worker runtime loop."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = UserbotPool(loop=worker_runtime.get_runtime().loop).start()
+            atexit.register(_pool.close_sync)
+        return _pool
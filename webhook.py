@@ -0,0 +1,265 @@
+# webhook.py
+"""
+Webhook front-end for the bot.
+
+A small ASGI application that receives updates pushed by Telegram and runs
+them through the same handlers as polling mode (bot.build_application), so
+files are enqueued to Dramatiq exactly as before. Front-ends keep no state
+of their own: run as many replicas as needed behind a load balancer.
+
+Each request must carry WEBHOOK_SECRET in the X-Telegram-Bot-Api-Secret-Token
+header. Telegram redelivers updates it considers unacknowledged, so every
+update_id is claimed in Redis first and handled by only one replica. The
+claim is short-lived until the update has been handled, so an update whose
+replica crashed or was cancelled mid-way is handled again on redelivery.
+
+Usage:
+    python webhook.py                   # serve (uvicorn, WEBHOOK_WORKERS processes)
+    python webhook.py --set-webhook     # register WEBHOOK_URL with Telegram (once)
+    python webhook.py --delete-webhook  # go back to polling mode
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+
+import redis.asyncio as aioredis
+from telegram import Update
+
+import config
+import metrics
+from bot import build_application
+
+logger = logging.getLogger(__name__)
+
+_SECRET_HEADER = b"x-telegram-bot-api-secret-token"
+# Updates are a few KB at most; anything bigger is not from Telegram.
+MAX_BODY_BYTES = 1024 * 1024
+# Values of the update:<id> claim keys.
+_PROCESSING = b"processing"
+_DONE = b"done"
+
+
+class WebhookApp:
+    """
+    ASGI app serving POST WEBHOOK_PATH (updates), GET /healthz (load balancer
+    checks) and, with METRICS_ON_PUBLIC_SERVERS, GET /metrics.
+    """
+
+    def __init__(self, application=None, redis_client=None, secret=None, path=None):
+        self.application = application
+        self.redis = redis_client
+        self.secret = (secret if secret is not None else config.WEBHOOK_SECRET).encode()
+        self.path = path or config.WEBHOOK_PATH
+        self.processed = 0
+        self.duplicates = 0
+        self.deferred = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    # --- Lifespan ---
+    async def startup(self):
+        if not self.secret:
+            raise RuntimeError("WEBHOOK_SECRET must be set in webhook mode.")
+        if self.application is None:
+            self.application = build_application()
+        if self.redis is None:
+            self.redis = aioredis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=0)
+        await self.application.initialize()
+        if self.application.post_init:
+            await self.application.post_init(self.application)
+        logger.info(f"Webhook front-end ready on {self.path}")
+
+    async def shutdown(self):
+        if self.application.post_shutdown:
+            await self.application.post_shutdown(self.application)
+        await self.application.shutdown()
+        await self.redis.aclose()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logger.error(f"Webhook front-end failed to start: {e}", exc_info=True)
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # --- Requests ---
+    async def _http(self, scope, receive, send):
+        path, method = scope["path"], scope["method"]
+        if path == "/healthz" and method in ("GET", "HEAD"):
+            await _respond(send, 200, b"ok")
+            return
+        if path == "/metrics" and method == "GET" and config.METRICS_ON_PUBLIC_SERVERS:
+            try:
+                body = (await asyncio.to_thread(metrics.render)).encode()
+            except aioredis.RedisError as e:
+                await _respond(send, 503, f"Redis unavailable: {e}".encode())
+                return
+            await _respond(send, 200, body, content_type=metrics.CONTENT_TYPE.encode())
+            return
+        if path != self.path:
+            await _respond(send, 404, b"Not Found")
+            return
+        if method != "POST":
+            await _respond(send, 405, b"Method Not Allowed")
+            return
+
+        headers = dict(scope["headers"])
+        if not hmac.compare_digest(headers.get(_SECRET_HEADER, b""), self.secret):
+            await _respond(send, 403, b"Forbidden")
+            return
+
+        body = await _read_body(receive)
+        if body is None:
+            await _respond(send, 413, b"Payload Too Large")
+            return
+        try:
+            data = json.loads(body)
+            update = Update.de_json(data, self.application.bot)
+            if update is None:
+                raise ValueError("empty update")
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Rejected malformed update: {e}")
+            await _respond(send, 400, b"Bad Request")
+            return
+
+        claim = await self._claim(update.update_id)
+        if claim is None:
+            # Another replica is still on it; a non-200 makes Telegram redeliver
+            # later, so the update survives if that replica dies.
+            self.deferred += 1
+            await _respond(send, 503, b"Update is being processed")
+            return
+        if claim:
+            # Handler errors are reported by the application's error handler,
+            # so Telegram always gets a 200 for an update we have handled.
+            try:
+                await self.application.process_update(update)
+            except BaseException:
+                await self._release(update.update_id)
+                raise
+            await self._mark_done(update.update_id)
+            self.processed += 1
+        else:
+            self.duplicates += 1
+            logger.debug(f"Skipping duplicate update {update.update_id}")
+        await _respond(send, 200, b"")
+
+    # --- Deduplication ---
+    async def _claim(self, update_id):
+        """
+        Claims ``update_id`` for this replica. Returns True if claimed, False
+        if it was already handled, or None if another replica is handling it.
+        """
+        key = f"update:{update_id}"
+        try:
+            if await self.redis.set(key, _PROCESSING, nx=True, ex=config.WEBHOOK_CLAIM_TTL):
+                return True
+            state = await self.redis.get(key)
+        except aioredis.RedisError as e:
+            # Without Redis a redelivery might be handled twice, which beats dropping it.
+            logger.warning(f"Could not deduplicate update {update_id}: {e}")
+            return True
+        if state is None:  # expired in between
+            return await self._claim(update_id)
+        return None if state == _PROCESSING else False
+
+    async def _mark_done(self, update_id):
+        """Keeps the claim for the full WEBHOOK_DEDUP_TTL now that the update is handled."""
+        try:
+            await self.redis.set(f"update:{update_id}", _DONE, ex=config.WEBHOOK_DEDUP_TTL)
+        except aioredis.RedisError as e:
+            logger.warning(f"Could not mark update {update_id} as handled: {e}")
+
+    async def _release(self, update_id):
+        """Drops the claim of an update we failed to handle so its redelivery is not skipped."""
+        try:
+            await self.redis.delete(f"update:{update_id}")
+        except aioredis.RedisError as e:
+            logger.warning(f"Could not release update {update_id}: {e}")
+
+
+async def _read_body(receive):
+    """Reads the request body, or returns None if it exceeds MAX_BODY_BYTES."""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _respond(send, status, body, content_type=b"text/plain"):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+app = WebhookApp()
+
+
+# --- Webhook Registration ---
+async def set_webhook():
+    """Points Telegram at WEBHOOK_URL + WEBHOOK_PATH."""
+    if not (config.WEBHOOK_URL and config.WEBHOOK_SECRET):
+        raise SystemExit("WEBHOOK_URL and WEBHOOK_SECRET must be set.")
+    application = build_application()
+    async with application.bot as bot:
+        await bot.set_webhook(
+            url=config.WEBHOOK_URL + config.WEBHOOK_PATH,
+            secret_token=config.WEBHOOK_SECRET,
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    print(f"Webhook set to {config.WEBHOOK_URL + config.WEBHOOK_PATH}")
+
+
+async def delete_webhook():
+    application = build_application()
+    async with application.bot as bot:
+        await bot.delete_webhook()
+    print("Webhook deleted. The bot can be run in polling mode again.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook front-end for the Telegram bot")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--set-webhook", action="store_true", help="Register WEBHOOK_URL with Telegram and exit")
+    group.add_argument("--delete-webhook", action="store_true", help="Remove the webhook and exit")
+    args = parser.parse_args()
+
+    if args.set_webhook:
+        asyncio.run(set_webhook())
+    elif args.delete_webhook:
+        asyncio.run(delete_webhook())
+    else:
+        import uvicorn
+        uvicorn.run(
+            "webhook:app", host=config.WEBHOOK_HOST, port=config.WEBHOOK_PORT,
+            workers=config.WEBHOOK_WORKERS, lifespan="on", access_log=False
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# worker_runtime.py
+"""
+A long-lived event loop shared by every job in a worker process.
+
+Dramatiq actors are plain functions running on worker threads. Running
+each job under its own `asyncio.run` meant a fresh loop, a fresh
+`telegram.Bot` and a fresh HTTP connection pool per job, so every job
+paid new TLS handshakes to api.telegram.org. Instead, each process
+starts one loop on a background thread and keeps one initialized Bot on
+it, using a pooled HTTP/2 client. Actors hand their coroutines to `run`,
+so the jobs of all worker threads make progress concurrently on the same
+loop and reuse the same connections.
+
+The loop is started lazily, after Dramatiq has forked its worker
+processes, so nothing is shared across a fork.
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import logging
+import threading
+import time
+
+import httpx
+import telegram
+from telegram.request import HTTPXRequest
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_WAIT_SLICE = 0.5  # Seconds
+
+
+class TimedRequest(HTTPXRequest):
+    """Records the latency of every Bot API request, by API method, in metrics.py."""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            # API calls end with the method, e.g. .../bot<token>/editMessageText; file downloads with a path.
+            api_method = url.rsplit("/", 1)[-1]
+            metrics.observe("telegram_request_seconds", time.monotonic() - started,
+                            method=api_method if api_method.isalpha() else "file")
+
+
+class WorkerRuntime:
+    """
+    An event loop plus the long-lived clients that live on it.
+
+    By default the runtime owns a background loop thread (`start`/`stop`).
+    A process that is already asyncio-native, like async_worker.py, can
+    instead wrap its running loop (`open`/`aclose`) and `install` it.
+    """
+
+    def __init__(self, bot_token=None, base_url=None, base_file_url=None, local_mode=None, loop=None):
+        self._owns_loop = loop is None
+        self.loop = loop or asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="worker-runtime", daemon=True)
+        self._bot_token = bot_token or config.BOT_TOKEN
+        # Without an explicit server, the one from BOT_API_SERVER (if any) is used.
+        self._base_url = base_url or config.BOT_API_BASE_URL
+        self._base_file_url = base_file_url or (None if base_url else config.BOT_API_BASE_FILE_URL)
+        self._local_mode = (config.BOT_API_LOCAL_MODE and not base_url) if local_mode is None else local_mode
+        self.bot = None
+        self.http = None
+
+    # --- Lifecycle ---
+    def start(self):
+        """Starts the loop thread and initializes the shared Bot on it."""
+        self._thread.start()
+        self.submit(self.open()).result()
+        return self
+
+    async def open(self):
+        """Initializes the shared Bot and file download client. Must run on the runtime loop."""
+        # HTTP/2 is only spoken by the official endpoint; a custom Bot API server gets HTTP/1.1.
+        http_version = "1.1" if self._base_url else config.WORKER_BOT_HTTP_VERSION
+        request = TimedRequest(connection_pool_size=config.WORKER_BOT_POOL_SIZE, http_version=http_version)
+        kwargs = {"local_mode": self._local_mode}
+        if self._base_url:
+            kwargs["base_url"] = self._base_url
+        if self._base_file_url:
+            kwargs["base_file_url"] = self._base_file_url
+        self.bot = telegram.Bot(token=self._bot_token, request=request, **kwargs)
+        await self.bot.initialize()
+        # File downloads are streamed with a plain client so they can report progress.
+        self.http = httpx.AsyncClient(timeout=httpx.Timeout(30.0), follow_redirects=True)
+        logger.info("Worker runtime started")
+        return self
+
+    async def aclose(self):
+        """Shuts the shared Bot and download client down. Must run on the runtime loop."""
+        if self.bot:
+            await self.bot.shutdown()
+            self.bot = None
+        if self.http:
+            await self.http.aclose()
+            self.http = None
+
+    def stop(self, timeout=10):
+        """Shuts the Bot down and stops the loop thread. Safe to call more than once."""
+        if not self._owns_loop or not self._thread.is_alive():
+            return
+        try:
+            self.submit(self.aclose()).result(timeout)
+        except Exception as e:
+            logger.warning(f"Failed to shut down the worker Bot cleanly: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+
+    # --- Public API ---
+    def submit(self, coro):
+        """Schedules ``coro`` on the runtime loop and returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """
+        Runs ``coro`` on the runtime loop and blocks the calling thread until
+        it finishes. If the caller is interrupted (e.g. by Dramatiq's
+        TimeLimitExceeded) the coroutine is cancelled rather than left running.
+        """
+        future = self.submit(coro)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            # Wait in short slices: Dramatiq delivers time limits as
+            # asynchronous exceptions, which cannot interrupt a long C-level wait.
+            while True:
+                remaining = _WAIT_SLICE if deadline is None else min(_WAIT_SLICE, deadline - time.monotonic())
+                # wait() rather than result(timeout): a coroutine that raises TimeoutError
+                # itself must not be mistaken for a slice running out.
+                concurrent.futures.wait([future], timeout=max(remaining, 0))
+                if future.done():
+                    return future.result()
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise concurrent.futures.TimeoutError()
+        except BaseException:
+            future.cancel()
+            raise
+
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+
+def install(runtime):
+    """Makes ``runtime`` this process's runtime, e.g. one wrapping async_worker's loop."""
+    global _runtime
+    with _runtime_lock:
+        if _runtime is not None:
+            raise RuntimeError("A worker runtime is already running in this process.")
+        _runtime = runtime
+
+
+def get_runtime():
+    """Returns this process's runtime, starting it on first use."""
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = WorkerRuntime().start()
+            atexit.register(_runtime.stop)
+        return _runtime